@@ -1,14 +1,61 @@
 from django.contrib import admin
-from .models import ServiceCounter, Token
+from .models import (
+    ServiceCategory, ServiceCounter, Token, ArchivedToken, OutboxMessage, Broadcast, HourlyRollup, CounterRollup,
+    LeaderLease,
+)
+
+@admin.register(ServiceCategory)
+class ServiceCategoryAdmin(admin.ModelAdmin):
+    list_display = ('name', 'priority')
+    list_editable = ('priority',)
+    search_fields = ('name',)
 
 @admin.register(ServiceCounter)
 class ServiceCounterAdmin(admin.ModelAdmin):
     list_display = ('name', 'is_available')
     list_editable = ('is_available',)
+    list_filter = ('categories',)
     search_fields = ('name',)
+    filter_horizontal = ('categories',)
 
 @admin.register(Token)
 class TokenAdmin(admin.ModelAdmin):
-    list_display = ('token_number', 'customer_name', 'issued_at', 'is_served', 'counter')
-    list_filter = ('is_served', 'counter')
-    search_fields = ('customer_name',)
\ No newline at end of file
+    list_display = ('token_number', 'customer_name', 'category', 'priority', 'appointment_at', 'issued_at', 'is_served', 'counter')
+    list_filter = ('is_served', 'category', 'priority', 'counter')
+    readonly_fields = ('schedule_key',)
+    search_fields = ('customer_name',)
+
+@admin.register(ArchivedToken)
+class ArchivedTokenAdmin(admin.ModelAdmin):
+    list_display = ('token_number', 'customer_name', 'issued_at', 'completed_serving', 'counter')
+    list_filter = ('counter',)
+    search_fields = ('customer_name',)
+    date_hierarchy = 'issued_at'
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ('phone_number', 'status', 'attempts', 'created_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('phone_number',)
+
+@admin.register(Broadcast)
+class BroadcastAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'created_at', 'recipients', 'skipped')
+    list_filter = ('kind',)
+
+@admin.register(HourlyRollup)
+class HourlyRollupAdmin(admin.ModelAdmin):
+    list_display = ('day', 'hour', 'category', 'issued', 'called', 'served', 'abandoned', 'timed_out', 'refreshed_at')
+    list_filter = ('category',)
+    date_hierarchy = 'day'
+
+@admin.register(CounterRollup)
+class CounterRollupAdmin(admin.ModelAdmin):
+    list_display = ('day', 'hour', 'counter', 'served', 'busy_seconds')
+    list_filter = ('counter',)
+    date_hierarchy = 'day'
+
+@admin.register(LeaderLease)
+class LeaderLeaseAdmin(admin.ModelAdmin):
+    list_display = ('name', 'holder', 'term', 'acquired_at', 'expires_at')
+    readonly_fields = ('holder', 'term', 'acquired_at', 'expires_at')
@@ -0,0 +1,208 @@
+from functools import wraps
+import codecs
+import csv
+import json
+import tempfile
+
+from django.conf import settings
+from django.db import transaction
+from django.http import FileResponse, JsonResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import etag, require_GET, require_POST
+
+from .assignment import assign_tokens
+from .bulk_import import (
+    CONTENT_TYPES, category_lookup, check_import, import_format, issue_import, read_rows, spool,
+    text_lines, write_results,
+)
+from .estimator import estimate_wait
+from .forms import TokenForm
+from .models import Token, ServiceCounter
+from .notifications import confirmation_message, notify_counter_assigned, notify_token_completed
+from .queue_state import queue_index
+from .snapshot import queue_snapshot as shared_snapshot, snapshot_version
+from .sms import enqueue_many
+from .views import status_snapshot
+
+# Kiosks and displays talk JSON only: no templates, no session or message
+# storage is touched, so those middlewares never load or save anything.
+
+
+def _error(message, status, **extra):
+    return JsonResponse({'error': message, **extra}, status=status)
+
+
+def _json_body(request):
+    try:
+        return json.loads(request.body or b'{}')
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _has_api_key(request):
+    key = request.headers.get('x-api-key', '')
+    return bool(key) and any(constant_time_compare(key, allowed) for allowed in settings.QUEUE_API_KEYS)
+
+
+def api_key_required(view):
+    """Counter actions are for staff terminals holding one of QUEUE_API_KEYS"""
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        if not _has_api_key(request):
+            return _error('Missing or invalid API key', 401)
+        return view(request, *args, **kwargs)
+    return wrapped
+
+
+@csrf_exempt
+@require_POST
+def issue_tokens(request):
+    """Issue one token, or several for a group booking with {"tokens": [...]}"""
+    data = _json_body(request)
+    if not isinstance(data, dict):
+        return _error('Request body must be a JSON object', 400)
+
+    entries = data['tokens'] if 'tokens' in data else [data]
+    if not isinstance(entries, list) or not entries:
+        return _error('"tokens" must be a non-empty list', 400)
+    if len(entries) > settings.API_MAX_BATCH:
+        return _error(f'At most {settings.API_MAX_BATCH} tokens per request', 400)
+
+    cleaned, errors = [], {}
+    for i, entry in enumerate(entries):
+        form = TokenForm(entry if isinstance(entry, dict) else {})
+        if form.is_valid():
+            cleaned.append(form.cleaned_data)
+        else:
+            errors[i] = form.errors.get_json_data()
+    if errors:
+        return _error('Invalid token request', 400, fields=errors)
+    if any(entry['priority'] or entry['appointment_at'] for entry in cleaned) and not _has_api_key(request):
+        return _error('Priority and appointment tokens need an API key', 403)
+
+    with transaction.atomic():
+        tokens = Token.issue_many(cleaned)
+        enqueue_many([
+            (token.phone_number, confirmation_message(token.token_number, token.customer_name))
+            for token in tokens
+        ])
+
+    # Positions by schedule key, which also works before the index has seen a token
+    issued = []
+    for token in tokens:
+        category_id = token.category_id
+        ahead = queue_index.tokens_ahead_in(category_id, token.token_number, token.schedule_key)
+        issued.append({
+            'token_number': token.token_number,
+            'category': category_id,
+            'tokens_ahead': ahead,
+            'est_wait': estimate_wait(ahead),
+            'status_url': f'/status/{token.token_number}/',
+        })
+    if 'tokens' in data:
+        return JsonResponse({'tokens': issued}, status=201)
+    return JsonResponse(issued[0], status=201)
+
+
+@csrf_exempt
+@require_POST
+@api_key_required
+def import_tokens(request):
+    """Pre-issue tokens from a CSV or JSON Lines upload; answers with the issued tokens in the same format.
+
+    Any invalid row rejects the whole upload unless ?skip_invalid=1.
+    """
+    fmt = import_format(request.GET.get('format') or request.content_type)
+    if fmt is None:
+        return _error('Send text/csv or application/x-ndjson, or pass ?format=csv or ?format=jsonl', 415)
+
+    with spool(request) as upload:
+        categories = category_lookup()
+        try:
+            valid, invalid, errors = check_import(read_rows(text_lines(upload), fmt), categories)
+        except (UnicodeDecodeError, csv.Error) as e:
+            return _error(f'Unreadable {fmt} upload: {e}', 400)
+        if invalid and request.GET.get('skip_invalid') != '1':
+            return _error('Invalid rows', 400, invalid=invalid, rows=errors)
+        if not valid:
+            return _error('No tokens to import', 400)
+        if valid > settings.IMPORT_MAX_ROWS:
+            return _error(f'At most {settings.IMPORT_MAX_ROWS} tokens per import', 400)
+
+        # Results go to a temporary file too, so neither side of the import is held in memory
+        results = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        write_results(
+            issue_import(read_rows(text_lines(upload), fmt), categories, valid), codecs.getwriter('utf-8')(results), fmt
+        )
+    results.seek(0)
+    return FileResponse(results, status=201, content_type=CONTENT_TYPES[fmt])
+
+
+def _queue_etag(request):
+    return f'{queue_index.etag()}-queue'
+
+
+@require_GET
+@etag(_queue_etag)
+def queue_snapshot(request):
+    """Figures a TV display needs, answered from the in-memory index"""
+    try:
+        limit = min(settings.API_MAX_BATCH, max(0, int(request.GET.get('limit', 10))))
+    except ValueError:
+        return _error('"limit" must be an integer', 400)
+    return JsonResponse({
+        'version': queue_index.version(),
+        'current_serving': queue_index.current_head(),
+        'unserved': queue_index.unserved_count(),
+        'waiting': queue_index.waiting_count(),
+        'next': queue_index.unserved_after(0, limit),
+        'queues': [
+            {'category': category_id, 'current_serving': head, 'unserved': count}
+            for category_id, (head, count) in sorted(queue_index.queues().items(), key=lambda item: item[1][0])
+        ],
+    })
+
+
+def _token_etag(request, token_number):
+    return f'{snapshot_version()}-{token_number}-api'
+
+
+@require_GET
+@etag(_token_etag)
+def token_status(request, token_number):
+    """Status for one token, answered from the shared queue snapshot"""
+    snapshot = shared_snapshot()
+    if not snapshot.exists(token_number):
+        return _error('Unknown token', 404)
+    return JsonResponse({'token_number': token_number, **status_snapshot(token_number, snapshot)})
+
+
+@csrf_exempt
+@require_POST
+@api_key_required
+def counter_serve_next(request, counter_id):
+    """Call the next fair token to this counter"""
+    if not ServiceCounter.objects.filter(pk=counter_id).exists():
+        return _error('Unknown counter', 404)
+    assigned = assign_tokens(counter_ids=[counter_id])
+    if not assigned:
+        return _error('Counter is busy or no token can be served', 409)
+    token, counter = assigned[0]
+    notify_counter_assigned(token, counter)
+    return JsonResponse({'token_number': token.token_number, 'counter': counter.id, 'counter_name': counter.name})
+
+
+@csrf_exempt
+@require_POST
+@api_key_required
+def complete_token(request, token_number):
+    """Mark a token served and free its counter"""
+    token = Token.objects.select_related('counter').filter(token_number=token_number).first()
+    if token is None:
+        return _error('Unknown token', 404)
+    if token.is_served:
+        return _error('Token already served', 409)
+    token.complete_serving()
+    notify_token_completed(token)
+    return JsonResponse({'token_number': token.token_number, 'is_served': True})
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class QueueAppConfig(AppConfig):
+    name = 'queue_app'
+
+    def ready(self):
+        from . import middleware, signals  # noqa: F401  middleware times queries on every connection
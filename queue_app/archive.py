@@ -0,0 +1,56 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .dashboard import invalidate_dashboard
+from .models import ArchivedToken, Token
+
+
+def archivable_tokens(older_than=None):
+    """Served tokens completed more than `older_than` seconds ago"""
+    if older_than is None:
+        older_than = settings.ARCHIVE_AFTER
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    return Token.objects.filter(is_served=True).filter(
+        Q(completed_serving__lt=cutoff) | Q(completed_serving__isnull=True, issued_at__lt=cutoff)
+    )
+
+
+def archive_served_tokens(older_than=None, batch_size=None, max_batches=None):
+    """Move old served tokens into ArchivedToken, `batch_size` at a time.
+
+    Each batch is copied and deleted in its own transaction. The
+    highest-numbered token stays in the live table, so numbering carries on
+    from it and never reuses an archived number.
+
+    Returns the number of tokens archived.
+    """
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    newest = Token.objects.order_by('-token_number').values_list('token_number', flat=True).first()
+    if newest is None:
+        return 0
+
+    candidates = archivable_tokens(older_than).filter(token_number__lt=newest).order_by('token_number')
+    archived = batches = 0
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            rows = list(
+                candidates.select_for_update(skip_locked=True).values_list(*ArchivedToken.TOKEN_FIELDS)[:batch_size]
+            )
+            if not rows:
+                break
+            ArchivedToken.objects.bulk_create(
+                [ArchivedToken(**dict(zip(ArchivedToken.TOKEN_FIELDS, row))) for row in rows]
+            )
+            Token.objects.filter(pk__in=[row[0] for row in rows]).delete()
+        archived += len(rows)
+        batches += 1
+        if len(rows) < batch_size:
+            break
+
+    if archived:
+        invalidate_dashboard()
+    return archived
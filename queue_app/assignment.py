@@ -0,0 +1,167 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .dashboard import invalidate_dashboard
+from .estimator import service_estimator
+from .models import QueueChange, Token, ServiceCategory, ServiceCounter
+from .notifications import completed_message
+from .queue_state import queue_index
+from .snapshot import invalidate_queue_snapshot
+from .sms import enqueue_many
+from .wakeup import notify_assigner
+
+
+def assign_tokens(counter_ids=None):
+    """Match free counters to the fair set of waiting tokens in one transaction.
+
+    Counters are taken in order of how long they have been free. Each one
+    gets the first servable token it can handle: categories with a higher
+    priority first, then schedule order (see Token.schedule_key_for).
+    Every category keeps its own fairness window, and a counter with no
+    categories serves all of them. Candidates are popped from the queue
+    index's per-queue heaps rather than ranked by the database; rows are
+    then locked with SELECT ... FOR UPDATE SKIP LOCKED, so several assigners
+    (or an assigner running next to serve_next) never hand the same token
+    or counter out twice. The whole pass costs a constant number of queries.
+
+    Returns a list of (token, counter) pairs that were assigned.
+    """
+    with transaction.atomic():
+        counters = free_counters()
+        if counter_ids is not None:
+            counters = counters.filter(pk__in=counter_ids)
+        counters = list(counters)
+        if not counters:
+            return []
+
+        serves = {counter.id: set() for counter in counters}
+        for counter_id, category_id in ServiceCounter.categories.through.objects.filter(
+            servicecounter_id__in=serves
+        ).values_list('servicecounter_id', 'servicecategory_id'):
+            serves[counter_id].add(category_id)
+        # Only look at queues some free counter can take from
+        queues = None
+        if all(serves.values()):
+            queues = set().union(*serves.values())
+
+        queue_index.catch_up()
+        window = [token_number for _, token_number, _ in queue_index.servable(queues=queues)]
+        if not window:
+            return []
+        tokens = list(Token.waiting().filter(pk__in=window).select_for_update(skip_locked=True))
+        if len(tokens) < len(window):
+            _forget_called(set(window) - {token.token_number for token in tokens})
+        if not tokens:
+            return []
+        priority = {}
+        if any(token.category_id for token in tokens):
+            priority = dict(ServiceCategory.objects.order_by().values_list('id', 'priority'))
+        tokens.sort(key=lambda token: (-priority.get(token.category_id, 0), token.schedule_key, token.token_number))
+
+        assigned = []
+        for counter in counters:
+            categories = serves[counter.id]
+            for i, token in enumerate(tokens):
+                if not categories or token.category_id in categories:
+                    assigned.append((tokens.pop(i), counter))
+                    break
+            if not tokens:
+                break
+        if not assigned:
+            return []
+
+        now = timezone.now()
+        for token, counter in assigned:
+            token.counter = counter
+            token.started_serving = now
+            counter.current_token = token
+            counter.is_available = False
+
+        Token.objects.bulk_update([token for token, _ in assigned], ['counter', 'started_serving'])
+        ServiceCounter.objects.bulk_update([counter for _, counter in assigned], ['current_token', 'is_available'])
+
+        token_numbers = [token.token_number for token, _ in assigned]
+        QueueChange.record(token_numbers)
+        # bulk_update skips post_save, so tell the estimator the counters are busy here
+        busy = [(counter.id, True, counter.last_token_completed) for _, counter in assigned]
+        transaction.on_commit(lambda: _mark_started(token_numbers, busy))
+    return assigned
+
+
+def free_counters():
+    """Free counters, longest idle first, locked for the caller's transaction (busy ones are skipped, not waited for)"""
+    return ServiceCounter.objects.select_for_update(skip_locked=True).filter(
+        is_available=True
+    ).order_by(F('last_token_completed').asc(nulls_first=True), 'id')
+
+
+def _forget_called(token_numbers):
+    """Drop heap candidates that another process has already called or completed"""
+    for token_number, is_served in Token.objects.filter(pk__in=token_numbers).filter(
+        Q(is_served=True) | Q(started_serving__isnull=False)
+    ).values_list('token_number', 'is_served'):
+        if is_served:
+            queue_index.on_complete(token_number)
+        else:
+            queue_index.on_start(token_number)
+
+
+def _mark_started(token_numbers, busy):
+    invalidate_queue_snapshot()
+    for token_number in token_numbers:
+        queue_index.on_start(token_number)
+    service_estimator.update_counters(busy)
+    invalidate_dashboard()
+
+
+def expire_overdue_tokens(notify=False):
+    """Complete every token that has been serving longer than MAX_SERVING_TIME.
+
+    Expired tokens are selected by the database and completed, and their
+    counters freed, with two bulk UPDATEs in one transaction. With
+    `notify`, completion messages are queued in the outbox as one batch.
+
+    Returns the list of expired token numbers.
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=settings.MAX_SERVING_TIME)
+    with transaction.atomic():
+        expired = list(
+            Token.objects.select_for_update(skip_locked=True)
+            .filter(is_served=False, started_serving__lt=cutoff)
+            .values_list('token_number', 'phone_number', 'counter_id')
+        )
+        if not expired:
+            return []
+
+        token_numbers = [token_number for token_number, _, _ in expired]
+        Token.objects.filter(pk__in=token_numbers).update(is_served=True, completed_serving=now)
+        QueueChange.record(token_numbers)
+        ServiceCounter.objects.filter(current_token__in=token_numbers).update(
+            is_available=True,
+            current_token=None,
+            last_token_completed=now,
+        )
+
+        if notify:
+            enqueue_many(
+                (phone_number, completed_message(token_number, now))
+                for token_number, phone_number, _ in expired
+            )
+
+        freed = [(counter_id, False, now) for _, _, counter_id in expired if counter_id is not None]
+        transaction.on_commit(lambda: _mark_completed(token_numbers, freed))
+    return token_numbers
+
+
+def _mark_completed(token_numbers, freed):
+    invalidate_queue_snapshot()
+    for token_number in token_numbers:
+        queue_index.on_complete(token_number)
+    service_estimator.update_counters(freed)
+    invalidate_dashboard()
+    notify_assigner()
@@ -0,0 +1,72 @@
+from contextlib import contextmanager
+from datetime import timedelta
+import statistics
+import time
+
+from django.db import connection
+from django.utils import timezone
+
+from .models import Token, ServiceCounter
+
+
+@contextmanager
+def scratch_database(keepdb=False):
+    """Run against a freshly migrated test database, never the live one"""
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+
+
+def seed_tokens(served=0, waiting=0, serving=0, counters=0, batch_size=5000):
+    """Bulk-insert a token history plus an active queue"""
+    now = timezone.now()
+    created = []
+    for i in range(counters):
+        created.append(ServiceCounter(name=f'Counter {i + 1}', last_token_completed=now - timedelta(seconds=i)))
+    ServiceCounter.objects.bulk_create(created, batch_size=batch_size)
+
+    def chunks(total, **fields):
+        for start in range(0, total, batch_size):
+            size = min(batch_size, total - start)
+            Token.objects.bulk_create(
+                [Token(customer_name=f'Customer {start + i}', **fields) for i in range(size)],
+                batch_size=batch_size,
+            )
+
+    chunks(served, is_served=True, started_serving=now, completed_serving=now)
+    chunks(serving, started_serving=now)
+    chunks(waiting)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(samples):
+    """Latency summary in milliseconds for a list of durations in seconds"""
+    ms = [s * 1000 for s in samples]
+    return {
+        'count': len(ms),
+        'mean': statistics.fmean(ms) if ms else 0.0,
+        'p50': percentile(ms, 50),
+        'p95': percentile(ms, 95),
+        'p99': percentile(ms, 99),
+    }
+
+
+def time_calls(func, repeat):
+    """Call func `repeat` times and return the individual durations in seconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
@@ -0,0 +1,185 @@
+import codecs
+import csv
+import json
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .estimator import estimate_wait
+from .forms import ImportTokenForm
+from .models import ServiceCategory, Token
+from .notifications import confirmation_message
+from .queue_state import queue_index
+from .sms import enqueue_many
+
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+RESULT_FIELDS = ('token_number', 'customer_name', 'phone_number', 'category', 'tokens_ahead', 'est_wait', 'status_url')
+
+
+def import_format(name):
+    """'csv' or 'jsonl' from a format name, file name or content type; None if unrecognised"""
+    name = (name or '').lower()
+    if name in FORMATS:
+        return name
+    if name.endswith('.csv') or name in ('text/csv', 'application/csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')) or name in ('application/x-ndjson', 'application/jsonl', 'application/json-lines'):
+        return 'jsonl'
+    return None
+
+
+def spool(stream):
+    """Copy a binary stream to a temporary file, in memory while small, so an import can read it twice"""
+    upload = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    shutil.copyfileobj(stream, upload, 64 * 1024)
+    return upload
+
+
+def text_lines(upload):
+    """Decoded lines of a binary import file from the start, tolerating a UTF-8 BOM"""
+    upload.seek(0)
+    return codecs.iterdecode(upload, 'utf-8-sig')
+
+
+def read_rows(lines, fmt):
+    """Yield (line number, row dict) from text lines: CSV with a header row, or one JSON object per line.
+
+    Rows that are not JSON objects come back as None.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def category_lookup():
+    """Every service category by casefolded name and by id, for ImportTokenForm"""
+    categories = {}
+    for category in ServiceCategory.objects.all():
+        categories[category.name.casefold()] = category
+        categories[str(category.pk)] = category
+    return categories
+
+
+def clean_rows(rows, categories):
+    """Yield (line number, cleaned data, None) for valid rows and (line number, None, errors) for the rest"""
+    form = ImportTokenForm({}, categories)
+    for line_number, row in rows:
+        if row is None:
+            yield line_number, None, {'__all__': [{'message': 'Not a JSON object', 'code': 'invalid'}]}
+            continue
+        if form.rebind(row).is_valid():
+            yield line_number, form.cleaned_data, None
+        else:
+            yield line_number, None, form.errors.get_json_data()
+
+
+def check_import(rows, categories, max_errors=20):
+    """First pass over an import: (valid rows, invalid rows, errors of the first `max_errors` invalid rows by line)"""
+    valid = invalid = 0
+    errors = {}
+    for line_number, data, row_errors in clean_rows(rows, categories):
+        if row_errors is None:
+            valid += 1
+            continue
+        invalid += 1
+        if len(errors) < max_errors:
+            errors[line_number] = row_errors
+    return valid, invalid, errors
+
+
+def issue_import(rows, categories, count, chunk_size=None):
+    """Second pass: issue the valid rows as `count` consecutive token numbers, yielding one result per token.
+
+    Numbers are reserved up front, so walk-ins issued during the import
+    come after the block. Every chunk is inserted, its confirmation SMS
+    queued and its tokens announced in one short transaction, so memory
+    stays flat however long the file is. Invalid rows are skipped; reject
+    them with check_import() first for an all-or-nothing import.
+
+    Results are only produced once every chunk is in: a priority or
+    appointment row late in the file is filed ahead of rows issued before
+    it, so earlier positions would be out of date by the end of the import.
+    """
+    chunk_size = chunk_size or settings.IMPORT_CHUNK_SIZE
+    first_number = next_number = Token.reserve_numbers(count)
+    now = timezone.now()  # one issue time, so the imported walk-ins queue in file order
+    chunk = []
+    for line_number, data, row_errors in clean_rows(rows, categories):
+        if row_errors is not None:
+            continue
+        if count == 0:
+            raise ValueError(f'Line {line_number}: more valid rows than were checked; the import changed while it ran')
+        chunk.append(data)
+        count -= 1
+        if len(chunk) == chunk_size:
+            _issue_chunk(chunk, now, next_number)
+            next_number += len(chunk)
+            chunk = []
+    if chunk:
+        _issue_chunk(chunk, now, next_number)
+        next_number += len(chunk)
+    yield from _import_results(first_number, next_number, chunk_size)
+
+
+def _issue_chunk(entries, now, first_number):
+    with transaction.atomic():
+        tokens = Token.issue_many(entries, now=now, first_number=first_number)
+        enqueue_many([
+            (token.phone_number, confirmation_message(token.token_number, token.customer_name))
+            for token in tokens
+        ])
+
+
+def _import_results(first_number, end_number, chunk_size):
+    # Read back in number order, a chunk at a time; every imported token is in the index by now
+    tokens = Token.objects.filter(token_number__gte=first_number, token_number__lt=end_number).order_by(
+        'token_number'
+    ).values_list('token_number', 'customer_name', 'phone_number', 'category_id', 'category__name', 'schedule_key')
+    for token_number, customer_name, phone_number, category_id, category_name, schedule_key in tokens.iterator(
+        chunk_size=chunk_size
+    ):
+        ahead = queue_index.tokens_ahead_in(category_id, token_number, schedule_key)
+        yield {
+            'token_number': token_number,
+            'customer_name': customer_name,
+            'phone_number': phone_number or '',
+            'category': category_name or '',
+            'tokens_ahead': ahead,
+            'est_wait': estimate_wait(ahead),
+            'status_url': f'/status/{token_number}/',
+        }
+
+
+def write_results(results, out, fmt):
+    """Write import results to a text stream (or nowhere if None) in the import's format.
+
+    Returns (count, first, last token number).
+    """
+    count, first, last = 0, None, None
+    writer = None
+    if out is not None and fmt == 'csv':
+        writer = csv.DictWriter(out, RESULT_FIELDS)
+        writer.writeheader()
+    for result in results:
+        if writer is not None:
+            writer.writerow(result)
+        elif out is not None:
+            out.write(json.dumps(result) + '\n')
+        count += 1
+        first = result['token_number'] if first is None else first
+        last = result['token_number']
+    return count, first, last
@@ -0,0 +1,23 @@
+import time
+
+from django.core.cache import cache
+
+VERSION_KEY = 'queue_app:dashboard:version'
+
+
+def dashboard_version():
+    """Current version of the cached admin dashboard fragments"""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seeded from the clock so an evicted key never reuses an old version
+        cache.add(VERSION_KEY, time.time_ns())
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def invalidate_dashboard():
+    """Retire every cached dashboard fragment after a token or counter change"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, time.time_ns())
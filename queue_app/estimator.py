@@ -0,0 +1,198 @@
+import asyncio
+from datetime import timedelta
+import math
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .queue_state import running_in_event_loop
+
+
+class _Ewma:
+    """Exponentially weighted moving average of service seconds"""
+    __slots__ = ('value', 'samples')
+
+    def __init__(self):
+        self.value = None
+        self.samples = 0
+
+    def add(self, seconds, alpha):
+        self.value = seconds if self.value is None else alpha * seconds + (1 - alpha) * self.value
+        self.samples += 1
+
+
+class ServiceTimeEstimator:
+    """Rolling service-time statistics per counter and per hour of day.
+
+    Updated in memory on every completed token, so wait estimates are a
+    handful of arithmetic operations. Recent history is replayed from the
+    database on first use and every ESTIMATOR_REFRESH_INTERVAL seconds,
+    which also folds in completions recorded by other processes.
+
+    The service rate only counts open counters: those serving a token or
+    that finished one in the last ESTIMATOR_ACTIVE_WINDOW seconds. Counter
+    saves and deletes, and the assigner's bulk updates, keep their state
+    current in this process; the periodic replay picks up the others'.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+        self._loaded_at = None
+        self._reload_scheduled = False
+
+    def _reset(self):
+        self._overall = _Ewma()
+        self._by_counter = {}
+        self._by_hour = [_Ewma() for _ in range(24)]
+        self._counters = {}  # counter id -> (busy, last service completed)
+
+    def _add(self, counter_id, started, completed):
+        seconds = (completed - started).total_seconds()
+        # Timed-out tokens only tell us MAX_SERVING_TIME, not how long service took
+        if seconds <= 0 or seconds >= settings.MAX_SERVING_TIME:
+            return
+        alpha = settings.ESTIMATOR_ALPHA
+        self._overall.add(seconds, alpha)
+        self._by_hour[timezone.localtime(started).hour].add(seconds, alpha)
+        if counter_id is not None:
+            self._by_counter.setdefault(counter_id, _Ewma()).add(seconds, alpha)
+
+    def _stale(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at >= settings.ESTIMATOR_REFRESH_INTERVAL
+
+    def _history(self):
+        from .models import Token, ArchivedToken
+        history = []
+        # Recent completions live in Token; top up from the archive after archive_tokens ran
+        for model in (Token, ArchivedToken):
+            limit = settings.ESTIMATOR_WARMUP_SAMPLES - len(history)
+            if limit <= 0:
+                break
+            rows = model.objects.filter(started_serving__isnull=False, completed_serving__isnull=False)
+            if model is Token:
+                rows = rows.filter(is_served=True)
+            history.extend(
+                rows.order_by('-completed_serving')
+                .values_list('counter_id', 'started_serving', 'completed_serving')[:limit]
+            )
+        return history, _counter_states()
+
+    def _apply(self, history, counters):
+        self._reset()
+        for counter_id, started, completed in reversed(history):
+            self._add(counter_id, started, completed)
+        self._counters = counters
+        self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if not self._stale():
+            return
+        if running_in_event_loop():
+            # Reload in a worker thread; async views await arefresh() first
+            if not self._reload_scheduled:
+                self._reload_scheduled = True
+                asyncio.get_running_loop().run_in_executor(None, self._reload)
+            return
+        self._apply(*self._history())
+
+    def _reload(self):
+        try:
+            history = self._history()
+            with self._lock:
+                self._apply(*history)
+        finally:
+            self._reload_scheduled = False
+
+    async def arefresh(self):
+        """Replay history off the event loop if it is due, so estimates after it never query"""
+        if self._stale():
+            await sync_to_async(self._reload)()
+
+    def record(self, counter_id, started, completed):
+        """Fold one completed service into the statistics"""
+        with self._lock:
+            if self._loaded_at is None:
+                return  # the first read replays history, including this one
+            self._add(counter_id, started, completed)
+
+    def update_counters(self, states):
+        """Record (counter id, busy, last service completed) for counters that were saved"""
+        with self._lock:
+            for counter_id, busy, last_completed in states:
+                self._counters[counter_id] = (busy, last_completed)
+
+    def remove_counter(self, counter_id):
+        with self._lock:
+            self._counters.pop(counter_id, None)
+
+    def reload_counters(self):
+        """Re-read every counter's state after a change no signal reports, e.g. a queue reset"""
+        states = _counter_states()
+        with self._lock:
+            self._counters = states
+
+    def _open_counters(self, now):
+        idle_since = now - timedelta(seconds=settings.ESTIMATOR_ACTIVE_WINDOW)
+        return [
+            counter_id for counter_id, (busy, last_completed) in self._counters.items()
+            if busy or (last_completed is not None and last_completed >= idle_since)
+        ]
+
+    def mean_service_seconds(self, counter_id=None):
+        with self._lock:
+            self._ensure_loaded()
+            return self._mean(counter_id)
+
+    def _mean(self, counter_id):
+        stats = self._by_counter.get(counter_id)
+        if stats is not None and stats.samples >= settings.ESTIMATOR_MIN_SAMPLES:
+            return stats.value
+        if self._overall.samples >= settings.ESTIMATOR_MIN_SAMPLES:
+            return self._overall.value
+        return None  # too little history to go on
+
+    def service_rate(self, when=None):
+        """Tokens per second the open counters get through, or None until there are ESTIMATOR_MIN_SAMPLES services"""
+        now = timezone.now()
+        with self._lock:
+            self._ensure_loaded()
+            counters = self._open_counters(now)
+            if self._overall.samples < settings.ESTIMATOR_MIN_SAMPLES or not counters:
+                return None
+            # Scale by how this hour of day compares with the overall average
+            hour = self._by_hour[timezone.localtime(when or now).hour]
+            factor = 1.0
+            if hour.samples >= settings.ESTIMATOR_MIN_SAMPLES:
+                factor = hour.value / self._overall.value
+            return sum(1.0 / (self._mean(counter_id) * factor) for counter_id in counters)
+
+    def estimate_wait(self, tokens_ahead):
+        """Minutes until a token with tokens_ahead in front of it is served"""
+        rate = self.service_rate()
+        if not rate:
+            # Not enough history yet: fixed per-token estimate
+            per_token = getattr(settings, 'PER_TOKEN_MINUTES', 2)
+            return (tokens_ahead + 1) * per_token
+        return max(1, math.ceil((tokens_ahead + 1) / rate / 60))
+
+
+def _counter_states():
+    from .models import ServiceCounter
+    return {
+        counter_id: (not is_available, last_completed)
+        for counter_id, is_available, last_completed in ServiceCounter.objects.values_list(
+            'id', 'is_available', 'last_token_completed'
+        )
+    }
+
+
+service_estimator = ServiceTimeEstimator()
+
+
+def estimate_wait(tokens_ahead):
+    """Minutes until a token with tokens_ahead in front of it is served"""
+    return service_estimator.estimate_wait(tokens_ahead)
@@ -0,0 +1,97 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import json
+import random
+import re
+import threading
+import time
+import uuid
+
+MESSAGES_PATH = re.compile(r'^/2010-04-01/Accounts/(?P<account>[^/]+)/Messages\.json$')
+
+
+class FakeTwilioHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+
+    def setup(self):
+        super().setup()
+        self.server.count('connections')
+        if self.server.handshake:
+            # Stand-in for the TCP and TLS round trips to a remote API, paid once per connection
+            time.sleep(self.server.handshake)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        match = MESSAGES_PATH.match(self.path)
+        if match is None:
+            return self.reply(404, {'code': 20404, 'message': 'The requested resource was not found', 'status': 404})
+
+        params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        to = params.get('To', '')
+        if to in server.fail_numbers or random.random() < server.failure_rate:
+            server.count('failed')
+            return self.reply(500, {'code': 20500, 'message': 'Simulated gateway failure', 'status': 500})
+
+        server.count('accepted')
+        self.reply(201, {
+            'sid': 'SM' + uuid.uuid4().hex,
+            'account_sid': match['account'],
+            'messaging_service_sid': params.get('MessagingServiceSid'),
+            'to': to,
+            'from': params.get('From'),
+            'body': params.get('Body', ''),
+            'status': 'queued',
+            'num_segments': '1',
+        })
+
+    def reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTwilioServer(ThreadingHTTPServer):
+    """Local stand-in for the Twilio Messages endpoint, for offline benchmarks.
+
+    Accepts the same form-encoded POST as api.twilio.com and answers with
+    a Twilio-shaped JSON body after `latency` seconds; `failure_rate` and
+    `fail_numbers` make it answer 500 instead. Each new connection first
+    waits `handshake` seconds, as setting one up to the real API costs
+    several round trips that a loopback connection does not.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, failure_rate=0.0, fail_numbers=(), handshake=0.0):
+        super().__init__(address, FakeTwilioHandler)
+        self.latency = latency
+        self.handshake = handshake
+        self.failure_rate = failure_rate
+        self.fail_numbers = set(fail_numbers)
+        self.stats = {'connections': 0, 'accepted': 0, 'failed': 0}
+        self._lock = threading.Lock()
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+def start_fake_gateway(port=0, host='127.0.0.1', **options):
+    """Run a FakeTwilioServer on a daemon thread; port 0 picks a free one"""
+    server = FakeTwilioServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,4 +1,5 @@
 from django import forms
+from .models import ServiceCategory
 
 class TokenForm(forms.Form):
     customer_name = forms.CharField(
@@ -12,10 +13,87 @@ class TokenForm(forms.Form):
         label='Phone (optional)',
         widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Enter phone number for SMS'})
     )
+    category = forms.ModelChoiceField(
+        queryset=ServiceCategory.objects.all(),
+        required=False,
+        label='Service',
+        empty_label='General',
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    # Set by staff kiosks through the API; the public form leaves them at their defaults
+    priority = forms.TypedChoiceField(
+        choices=[(0, 'Normal'), (1, 'Priority'), (2, 'Urgent')],
+        coerce=int,
+        required=False,
+        empty_value=0,
+    )
+    appointment_at = forms.DateTimeField(required=False)
+
+class ImportTokenForm(TokenForm):
+    """One row of a bulk import; the category is given by name or id"""
+    category = forms.CharField(required=False)
+
+    def __init__(self, data, categories):
+        super().__init__(data)
+        self.categories = categories  # casefolded name or str(id) -> ServiceCategory, looked up once per import
+
+    def rebind(self, data):
+        """Validate another row with this form; a new form per row would deep-copy every field each time"""
+        self.data = data
+        self._errors = None
+        return self
+
+    def clean_category(self):
+        value = self.cleaned_data['category'].strip()
+        if not value:
+            return None
+        try:
+            return self.categories[value.casefold()]
+        except KeyError:
+            raise forms.ValidationError(f'Unknown service category "{value}"', code='invalid_choice')
+
+class ReportForm(forms.Form):
+    first_day = forms.DateField(
+        required=False,
+        label='From',
+        widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'})
+    )
+    last_day = forms.DateField(
+        required=False,
+        label='To',
+        widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'})
+    )
+    # A ServiceCategory id, or 0 for the general queue of tokens issued without one
+    category = forms.TypedChoiceField(
+        coerce=int,
+        empty_value=None,
+        required=False,
+        label='Service',
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['category'].choices = [
+            ('', 'All services'), (0, 'General queue'), *ServiceCategory.objects.values_list('id', 'name')
+        ]
+
+    def clean(self):
+        cleaned_data = super().clean()
+        first_day, last_day = cleaned_data.get('first_day'), cleaned_data.get('last_day')
+        if first_day and last_day and first_day > last_day:
+            raise forms.ValidationError('The first day must not be after the last day')
+        return cleaned_data
 
 class CounterForm(forms.Form):
     name = forms.CharField(
         max_length=100,
         label='Counter Name',
         widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Counter name'})
+    )
+    categories = forms.ModelMultipleChoiceField(
+        queryset=ServiceCategory.objects.all(),
+        required=False,
+        label='Serves (none selected = all services)',
+        widget=forms.SelectMultiple(attrs={'class': 'form-control'})
     )
\ No newline at end of file
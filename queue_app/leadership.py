@@ -0,0 +1,60 @@
+from datetime import timedelta
+import os
+import socket
+
+from django.conf import settings
+from django.db.models import Case, DateTimeField, ExpressionWrapper, F, Q, When
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from .models import LeaderLease
+
+
+class Leadership:
+    """One process's claim on a named LeaderLease, e.g. the auto assigner's.
+
+    The lease is a row with an expiry time on the database clock, so nodes
+    never have to agree on the time. The leader extends it on every
+    heartbeat; a standby calls heartbeat() too, and takes the lease over
+    once it has gone `ttl` seconds without one.
+    """
+
+    def __init__(self, name, holder=None, ttl=None):
+        self.name = name
+        self.holder = holder or f'{socket.gethostname()}:{os.getpid()}'
+        self.ttl = ttl or settings.ASSIGNER_LEASE_TTL
+        self.is_leader = False
+        self._row_ready = False
+
+    def heartbeat(self):
+        """Take the lease if it is free or lapsed, or extend it if held here; True while this process leads.
+
+        Call it inside the transaction that does the leader's work. The lease
+        row then stays locked until that work commits, so a leader that
+        stalled past its expiry and lost the lease cannot commit anything
+        after its successor has started.
+        """
+        if not self._row_ready:
+            LeaderLease.objects.get_or_create(name=self.name, defaults={'expires_at': timezone.now()})
+            self._row_ready = True
+        expires_at = ExpressionWrapper(Now() + timedelta(seconds=self.ttl), output_field=DateTimeField())
+        taken = LeaderLease.objects.filter(
+            Q(holder=self.holder) | Q(expires_at__lte=Now()), name=self.name
+        ).update(
+            holder=self.holder,
+            expires_at=expires_at,
+            term=Case(When(holder=self.holder, then=F('term')), default=F('term') + 1),
+            acquired_at=Case(When(holder=self.holder, then=F('acquired_at')), default=Now()),
+        )
+        self.is_leader = bool(taken)
+        return self.is_leader
+
+    def current_holder(self):
+        """Holder of the lease while it is live, or None"""
+        return LeaderLease.objects.filter(name=self.name, expires_at__gt=Now()).values_list('holder', flat=True).first()
+
+    def release(self):
+        """Give the lease up on shutdown so a standby takes over at its next heartbeat"""
+        if self.is_leader:
+            LeaderLease.objects.filter(name=self.name, holder=self.holder).update(expires_at=Now())
+            self.is_leader = False
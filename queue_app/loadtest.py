@@ -0,0 +1,186 @@
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import unquote
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+import asyncio
+import threading
+import time
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+
+
+class _QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class PooledWSGIServer(WSGIServer):
+    """wsgiref server handing connections to a fixed pool of threads, like a threaded WSGI worker"""
+    request_queue_size = 4096
+
+    def __init__(self, address, threads):
+        super().__init__(address, _QuietWSGIRequestHandler)
+        self.set_app(WSGIHandler())
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix='wsgi')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            pass  # clients going away mid-stream
+        finally:
+            self.shutdown_request(request)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def start_wsgi_server(threads, port=0, host='127.0.0.1'):
+    server = PooledWSGIServer((host, port), threads)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class ASGIServer:
+    """Minimal HTTP/1.1 front end for Django's ASGI handler: one request per connection.
+
+    Enough to compare concurrency with PooledWSGIServer without an ASGI
+    server installed; deploy with uvicorn or daphne instead.
+    """
+
+    def __init__(self, port=0, host='127.0.0.1'):
+        self.app = ASGIHandler()
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+        threading.Thread(target=self._run, args=(host, port, started), daemon=True).start()
+        started.wait()
+
+    def _run(self, host, port, started):
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(self._connection, host, port, backlog=4096)
+        )
+        self.server_address = self.server.sockets[0].getsockname()[:2]
+        started.set()
+        self.loop.run_forever()
+
+    async def _connection(self, reader, writer):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        lines = head.decode('latin-1').split('\r\n')
+        method, target, _ = lines[0].split(' ', 2)
+        headers = []
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers.append((name.strip().lower().encode('latin-1'), value.strip().encode('latin-1')))
+        length = int(dict(headers).get(b'content-length', 0))
+        body = await reader.readexactly(length) if length else b''
+        path, _, query = target.partition('?')
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': unquote(path),
+            'raw_path': path.encode(),
+            'query_string': query.encode(),
+            'root_path': '',
+            'headers': headers,
+            'client': writer.get_extra_info('peername')[:2],
+            'server': writer.get_extra_info('sockname')[:2],
+        }
+        disconnected = asyncio.Event()
+        request_sent = False
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if disconnected.is_set():
+                return
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                out = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n'.encode()]
+                out.extend(name + b': ' + value + b'\r\n' for name, value in message.get('headers', ()))
+                out.append(b'Connection: close\r\n\r\n')
+                writer.write(b''.join(out))
+            else:
+                writer.write(message.get('body', b''))
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    disconnected.set()
+
+        async def watch():
+            await reader.read()  # returns at EOF, when the client hangs up
+            disconnected.set()
+
+        watcher = asyncio.create_task(watch())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            watcher.cancel()
+            writer.close()
+
+    def stop(self):
+        async def close():
+            self.server.close()
+            await self.server.wait_closed()
+        asyncio.run_coroutine_threadsafe(close(), self.loop).result(timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+def _request_bytes(path, headers=()):
+    lines = [f'GET {path} HTTP/1.1', 'Host: localhost', 'Connection: close', *headers, '', '']
+    return '\r\n'.join(lines).encode()
+
+
+async def fetch(port, path, headers=()):
+    """GET a path and return the status code, reading until the server closes"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(_request_bytes(path, headers))
+        response = await reader.read()
+    finally:
+        writer.close()
+    return int(response.split(b' ', 2)[1]) if response else 0
+
+
+async def hold_stream(port, path, timeout, connected, release):
+    """Open an SSE stream, report seconds to its first event to `connected`, and hold it until `release`"""
+    start = time.perf_counter()
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+        writer.write(_request_bytes(path, ['Accept: text/event-stream']))
+        received = b''
+        deadline = start + timeout
+        while b'event: status' not in received:
+            remaining = deadline - time.perf_counter()
+            chunk = await asyncio.wait_for(reader.read(4096), remaining) if remaining > 0 else b''
+            if not chunk:
+                return
+            received += chunk
+        connected(time.perf_counter() - start)
+        await release.wait()
+    except (asyncio.TimeoutError, ConnectionError, OSError):
+        pass
+    finally:
+        if writer is not None:
+            writer.close()
@@ -0,0 +1,57 @@
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import json
+import logging
+import queue
+
+from django.utils.module_loading import import_string
+
+# Attributes every LogRecord has; anything else was passed with extra={...}
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+class StructuredFormatter(logging.Formatter):
+    """One JSON object per line, with any extra={...} fields as keys"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class BackgroundHandler(QueueHandler):
+    """Formats records in the caller and writes them from a listener thread.
+
+    `target` is the dotted path of the handler doing the actual I/O; the
+    remaining keyword arguments are passed to it. Used from LOGGING so a
+    slow disk or terminal never holds up a request or the SMS dispatcher.
+    """
+
+    def __init__(self, target, **kwargs):
+        super().__init__(queue.SimpleQueue())
+        self.target = import_string(target)(**kwargs)
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def close(self):
+        if self.listener._thread is not None:
+            self.listener.stop()  # flushes what is still queued
+            self.target.close()
+        super().close()
+
+
+def mask_phone(phone_number):
+    """Keep only the last digits of a phone number for logs"""
+    if not phone_number:
+        return ''
+    return '*' * max(len(phone_number) - 4, 0) + phone_number[-4:]
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from queue_app.archive import archive_served_tokens, archivable_tokens
+from django.conf import settings
+
+class Command(BaseCommand):
+    help = 'Move old served tokens from the live queue table into the archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=settings.ARCHIVE_AFTER,
+                            help='Archive tokens completed more than this many seconds ago')
+        parser.add_argument('--batch-size', type=int, default=settings.ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, help='Stop after this many batches (default: until done)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many tokens would be archived')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            count = archivable_tokens(options['older_than']).count()
+            self.stdout.write(f'{count} served tokens are old enough to archive')
+            return
+        archived = archive_served_tokens(options['older_than'], options['batch_size'], options['max_batches'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} served tokens'))
@@ -1,46 +1,100 @@
-from django.core.management.base import BaseCommand
-from django.utils import timezone
-from queue_app.models import Token, ServiceCounter
+import signal
+import sys
 import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from queue_app.assignment import assign_tokens, expire_overdue_tokens
+from queue_app.leadership import Leadership
+from queue_app.models import QueueChange
+from queue_app.queue_state import queue_index
+from queue_app.wakeup import AssignerWakeup
 from django.conf import settings
 
+LEASE_NAME = 'auto_assign_tokens'
+
+
 class Command(BaseCommand):
-    help = 'Automatically assign tokens to available counters'
+    help = 'Automatically assign tokens to available counters (one leader among all running copies)'
+    notify = False
+    pruned_at = None
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notify-expired', action='store_true',
+                            help='Send completion SMS for tokens auto-completed after a timeout')
+        parser.add_argument('--node', help='Name of this copy in the leader lease (default: host:pid)')
 
-    def handle(self, *args, **kwargs):
+    def handle(self, *args, **options):
+        self.notify = options['notify_expired']
+        leadership = Leadership(LEASE_NAME, options['node'])
+        # Release the lease on a normal stop too, so a standby takes over at its next heartbeat
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        # The leader runs as soon as a token is issued or a counter is freed;
+        # the interval is only a fallback for missed wakeups and the timeout sweep
+        wakeup = AssignerWakeup()
+        leading = None
+        try:
+            while True:
+                with transaction.atomic():
+                    # Renewed in the pass's transaction: a copy that lost the lease commits nothing
+                    if leadership.heartbeat():
+                        self.assign_tokens()
+                if leadership.is_leader != leading:
+                    leading = leadership.is_leader
+                    self.report_role(leadership)
+                if leading:
+                    # Bound only while leading, so a standby on this host leaves the port to the
+                    # leader; retried every pass until a copy that just stepped down lets go of it
+                    wakeup.open()
+                    self.prune_changes()
+                    self.wait(wakeup)
+                else:
+                    wakeup.close()
+                    time.sleep(settings.ASSIGNER_HEARTBEAT)
+        finally:
+            wakeup.close()
+            leadership.release()
+
+    def report_role(self, leadership):
+        if leadership.is_leader:
+            self.stdout.write(self.style.SUCCESS(f'{leadership.holder} is now assigning tokens'))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f'{leadership.holder} standing by; {leadership.current_holder() or "another copy"} is assigning tokens'
+            ))
+
+    def wait(self, wakeup):
+        """Until a local wakeup, a change synced from another node, or the next heartbeat is due"""
+        deadline = time.monotonic() + min(settings.AUTO_ASSIGN_INTERVAL, settings.ASSIGNER_HEARTBEAT)
         while True:
-            self.assign_tokens()
-            time.sleep(settings.AUTO_ASSIGN_INTERVAL)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if wakeup.wait(min(remaining, settings.QUEUE_SYNC_INTERVAL or remaining)):
+                return
+            if settings.QUEUE_SYNC_INTERVAL and queue_index.sync():
+                return
 
-    def assign_tokens(self):
-        # Get available counters
-        counters = ServiceCounter.objects.filter(is_available=True)
-        if not counters.exists():
+    def prune_changes(self):
+        if self.pruned_at is not None and time.monotonic() - self.pruned_at < 60:
             return
+        self.pruned_at = time.monotonic()
+        QueueChange.prune(settings.QUEUE_CHANGE_RETENTION)
 
-        # Get unassigned tokens that can be served
-        for counter in counters:
-            next_token = Token.get_next_servable()
-            if next_token:
-                if next_token.start_serving(counter):
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f'Assigned token #{next_token.token_number} to counter {counter.name}'
-                        )
-                    )
+    def assign_tokens(self):
+        # Pair every free counter with the fair set of waiting tokens in one pass
+        for token, counter in assign_tokens():
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Assigned token #{token.token_number} to counter {counter.name}'
+                )
+            )
 
         # Auto-complete tokens that have been serving too long
-        serving_tokens = Token.objects.filter(
-            is_served=False,
-            started_serving__isnull=False
-        )
-        
-        for token in serving_tokens:
-            serve_duration = timezone.now() - token.started_serving
-            if serve_duration.total_seconds() > settings.MAX_SERVING_TIME:
-                token.complete_serving()
-                self.stdout.write(
-                    self.style.WARNING(
-                        f'Auto-completed token #{token.token_number} due to timeout'
-                    )
-                )
\ No newline at end of file
+        expired = expire_overdue_tokens(notify=self.notify)
+        if expired:
+            self.stdout.write(
+                self.style.WARNING(
+                    f'Auto-completed {len(expired)} token(s) due to timeout: '
+                    + ', '.join(f'#{n}' for n in expired)
+                )
+            )
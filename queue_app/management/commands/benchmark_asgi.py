@@ -0,0 +1,126 @@
+import asyncio
+import json
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from queue_app.benchmarking import scratch_database, seed_tokens, summarize
+from queue_app.loadtest import ASGIServer, fetch, hold_stream, start_wsgi_server
+from queue_app.models import Token
+
+
+class Command(BaseCommand):
+    help = 'Hold open status streams while polling queue_status, under a threaded WSGI server and under ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--streams', type=int, default=1000, help='Status streams held open during the run')
+        parser.add_argument('--pollers', type=int, default=20, help='Concurrent queue_status clients')
+        parser.add_argument('--polls', type=int, default=10, help='Status requests per poller')
+        parser.add_argument('--threads', type=int, default=32, help='Worker threads of the WSGI server')
+        parser.add_argument('--timeout', type=float, default=2.0, help='Seconds before a poll counts as failed')
+        parser.add_argument('--connect-timeout', type=float, default=15.0, help='Seconds a stream may take to deliver its first event')
+        parser.add_argument('--only', choices=['wsgi', 'asgi'], help='Run one server only')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON')
+
+    def handle(self, *args, **options):
+        overrides = override_settings(
+            DEBUG=False,
+            ALLOWED_HOSTS=['*'],
+            SMS_ENABLED=False,
+            ASSIGNER_WAKEUP_PORT=0,
+            STATUS_STREAM_HEARTBEAT=1,  # notice clients that hung up within a second
+            STATUS_STREAM_MAX_AGE=3600,
+        )
+        servers = [options['only']] if options['only'] else ['wsgi', 'asgi']
+        with overrides, scratch_database():
+            seed_tokens(served=1000, waiting=200, counters=5)
+            tokens = list(Token.waiting().values_list('token_number', flat=True))
+            results = [self.run(kind, tokens, options) for kind in servers]
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{'server':<8}{'streams':>9}{'held':>7}{'1st ev p95':>12}{'polls':>8}{'ok':>7}{'polls/s':>9}"
+            f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'threads':>9}"
+        ))
+        for r in results:
+            p = r['polls']
+            self.stdout.write(
+                f"{r['server']:<8}{r['streams']:>9}{r['held']:>7}{r['first_event_p95']:>12.1f}{p['count']:>8}"
+                f"{r['polls_ok']:>7}{r['throughput']:>9.1f}{p['p50']:>9.2f}{p['p95']:>9.2f}{p['p99']:>9.2f}"
+                f"{r['peak_threads']:>9}"
+            )
+        self.stdout.write(f"WSGI server: {options['threads']} threads; polls slower than {options['timeout']:g}s fail")
+
+    def run(self, kind, tokens, options):
+        if kind == 'wsgi':
+            server = start_wsgi_server(options['threads'])
+        else:
+            server = ASGIServer()
+        port = server.server_address[1]
+        peak = [threading.active_count()]
+        sampling = threading.Event()
+
+        def sample_threads():
+            while not sampling.wait(0.05):
+                peak[0] = max(peak[0], threading.active_count())
+
+        sampler = threading.Thread(target=sample_threads, daemon=True)
+        sampler.start()
+        try:
+            result = asyncio.run(self.drive(port, tokens, options))
+        finally:
+            sampling.set()
+            sampler.join()
+            server.stop()
+        result.update({'server': kind, 'peak_threads': peak[0]})
+        return result
+
+    async def drive(self, port, tokens, options):
+        timeout = options['timeout']
+        release = asyncio.Event()
+        first_events = []
+        streams = [
+            asyncio.create_task(hold_stream(
+                port, f'/status/{tokens[i % len(tokens)]}/stream/', options['connect_timeout'],
+                first_events.append, release,
+            ))
+            for i in range(options['streams'])
+        ]
+        # Poll once every stream is open, or once the rest have given up
+        deadline = time.perf_counter() + options['connect_timeout']
+        while len(first_events) < options['streams'] and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+
+        samples, ok = [], 0
+
+        async def poller(offset):
+            nonlocal ok
+            for i in range(options['polls']):
+                token_number = tokens[(offset + i) % len(tokens)]
+                start = time.perf_counter()
+                try:
+                    status = await asyncio.wait_for(
+                        fetch(port, f'/status/{token_number}/', ['X-Requested-With: XMLHttpRequest']), timeout
+                    )
+                except (asyncio.TimeoutError, ConnectionError, OSError):
+                    status = None
+                samples.append(time.perf_counter() - start)
+                ok += status == 200
+
+        start = time.perf_counter()
+        await asyncio.gather(*(poller(i * options['polls']) for i in range(options['pollers'])))
+        elapsed = time.perf_counter() - start
+        held = len(first_events)
+        release.set()
+        await asyncio.gather(*streams)
+        first_event = summarize(first_events)
+        return {
+            'streams': options['streams'],
+            'held': held,
+            'first_event_p95': first_event['p95'],
+            'polls': summarize(samples),
+            'polls_ok': ok,
+            'throughput': ok / elapsed if elapsed else 0.0,
+        }
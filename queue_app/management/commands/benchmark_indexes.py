@@ -0,0 +1,72 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from queue_app.assignment import free_counters
+from queue_app.models import Token, ServiceCounter
+from queue_app.benchmarking import scratch_database, seed_tokens, summarize, time_calls
+
+
+def hot_queries():
+    """The queue's hot access paths, as (label, queryset factory); each is the exact queryset the app runs"""
+    cutoff = timezone.now() - timedelta(seconds=settings.MAX_SERVING_TIME)
+    return [
+        ('waiting head', lambda: Token.waiting()[:1]),
+        ('fairness window', lambda: Token.servable()[:4]),
+        ('unserved list', lambda: Token.objects.filter(is_served=False).order_by('token_number').values_list('token_number', 'started_serving')),
+        ('timeout sweep', lambda: Token.objects.filter(is_served=False, started_serving__lt=cutoff).values_list('token_number')),
+        ('recently served', lambda: Token.objects.filter(is_served=True).order_by('-issued_at')[:20]),
+        ('free counters', free_counters),  # the assigner's, row locks included
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Seed a scratch database and compare hot query plans and timings with and without the queue indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--history', type=int, default=100000, help='Served tokens to seed')
+        parser.add_argument('--waiting', type=int, default=500, help='Waiting tokens to seed')
+        parser.add_argument('--serving', type=int, default=20, help='Tokens being served to seed')
+        parser.add_argument('--counters', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=200, help='Executions per query')
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            self.stdout.write(f"Seeding {options['history']} served tokens into a scratch {connection.vendor} database...")
+            seed_tokens(
+                served=options['history'],
+                waiting=options['waiting'],
+                serving=options['serving'],
+                counters=options['counters'],
+            )
+            indexes = [(model, index) for model in (Token, ServiceCounter) for index in model._meta.indexes]
+
+            with connection.schema_editor() as editor:
+                for model, index in indexes:
+                    editor.remove_index(model, index)
+            before = self.run_queries('Without indexes', options['repeat'])
+
+            with connection.schema_editor() as editor:
+                for model, index in indexes:
+                    editor.add_index(model, index)
+            after = self.run_queries('With indexes', options['repeat'])
+
+        self.stdout.write(self.style.MIGRATE_HEADING('\nSummary (mean ms per query)'))
+        for label in before:
+            speedup = before[label] / after[label] if after[label] else float('inf')
+            self.stdout.write(f'  {label:<18} {before[label]:>9.3f} -> {after[label]:>9.3f}   x{speedup:.1f}')
+
+    def run_queries(self, heading, repeat):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\n{heading}'))
+        means = {}
+        for label, build in hot_queries():
+            # Locking querysets only run inside a transaction; one per query, so BEGIN/COMMIT stay out of the timings
+            with transaction.atomic():
+                plan = build().explain()
+                stats = summarize(time_calls(lambda: list(build()), repeat))
+            means[label] = stats['mean']
+            self.stdout.write(self.style.SUCCESS(f'{label}: mean {stats["mean"]:.3f} ms, p95 {stats["p95"]:.3f} ms'))
+            for line in plan.splitlines():
+                self.stdout.write(f'    {line}')
+        return means
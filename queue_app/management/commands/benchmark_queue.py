@@ -0,0 +1,172 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from queue_app.models import Token, ServiceCounter
+from queue_app.benchmarking import scratch_database, seed_tokens, summarize
+from queue_app.management.commands.auto_assign_tokens import Command as AutoAssignCommand
+
+
+class Recorder:
+    """Collects latency and query counts for one kind of operation"""
+
+    def __init__(self, name):
+        self.name = name
+        self.samples = []
+        self.queries = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def call(self, func):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            result = func()
+            duration = time.perf_counter() - start
+        with self._lock:
+            self.samples.append(duration)
+            self.queries += len(captured)
+        return result
+
+    def report(self):
+        stats = summarize(self.samples)
+        count = stats['count']
+        stats.update({
+            'operation': self.name,
+            'throughput': count / self.elapsed if self.elapsed else 0.0,
+            'queries_per_op': self.queries / count if count else 0.0,
+        })
+        return stats
+
+
+class Command(BaseCommand):
+    help = 'Drive the token lifecycle through the real views against a scratch database and report latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--history', type=int, default=10000, help='Served tokens to seed before the run')
+        parser.add_argument('--issue', type=int, default=500, help='Tokens issued through generate_token')
+        parser.add_argument('--pollers', type=int, default=8, help='Concurrent queue_status clients')
+        parser.add_argument('--polls', type=int, default=200, help='Status requests per poller')
+        parser.add_argument('--counters', type=int, default=5)
+        parser.add_argument('--cycles', type=int, default=100, help='serve_next + mark_served rounds')
+        parser.add_argument('--ticks', type=int, default=50, help='auto_assign_tokens passes')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON for comparison across commits')
+
+    def handle(self, *args, **options):
+        overrides = override_settings(
+            DEBUG=False,
+            ALLOWED_HOSTS=['testserver'],
+            SMS_ENABLED=True,
+            SMS_BACKEND='queue_app.sms.FakeBackend',
+            ASSIGNER_WAKEUP_PORT=0,
+        )
+        with overrides, scratch_database():
+            seed_tokens(served=options['history'], counters=options['counters'])
+            staff = get_user_model().objects.create_user('benchmark', password='benchmark', is_staff=True)
+            results = [
+                self.issue_burst(options['issue']),
+                self.api_issue_burst(options['issue']),
+                self.status_polling(options['pollers'], options['polls']),
+                self.status_polling(options['pollers'], options['polls'], api=True),
+                *self.serve_cycles(staff, options['cycles']),
+                self.assign_ticks(options['ticks']),
+            ]
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{'operation':<18}{'count':>7}{'ops/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}"
+        ))
+        for r in results:
+            self.stdout.write(
+                f"{r['operation']:<18}{r['count']:>7}{r['throughput']:>10.1f}{r['p50']:>9.2f}"
+                f"{r['p95']:>9.2f}{r['p99']:>9.2f}{r['queries_per_op']:>9.1f}"
+            )
+
+    def timed(self, recorder, run):
+        start = time.perf_counter()
+        run()
+        recorder.elapsed = time.perf_counter() - start
+        return recorder.report()
+
+    def issue_burst(self, count):
+        recorder = Recorder('generate_token')
+        client = Client()
+
+        def run():
+            for i in range(count):
+                recorder.call(lambda: client.post('/generate-token/', {
+                    'customer_name': f'Burst {i}',
+                    'phone_number': '9999999999',
+                }))
+        return self.timed(recorder, run)
+
+    def api_issue_burst(self, count):
+        recorder = Recorder('api_issue')
+        client = Client()
+
+        def run():
+            for i in range(count):
+                recorder.call(lambda: client.post('/api/v1/tokens/', json.dumps({
+                    'customer_name': f'Kiosk {i}',
+                    'phone_number': '9999999999',
+                }), content_type='application/json'))
+        return self.timed(recorder, run)
+
+    def status_polling(self, pollers, polls, api=False):
+        recorder = Recorder('api_token_status' if api else 'queue_status')
+        url = '/api/v1/tokens/{}/' if api else '/status/{}/'
+        token_numbers = list(Token.objects.filter(is_served=False).values_list('token_number', flat=True))
+        if not token_numbers:
+            return recorder.report()
+
+        def poll(worker):
+            client = Client(HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            for i in range(polls):
+                token_number = token_numbers[(worker * polls + i) % len(token_numbers)]
+                recorder.call(lambda: client.get(url.format(token_number)))
+            connection.close()
+
+        def run():
+            with ThreadPoolExecutor(max_workers=pollers) as pool:
+                list(pool.map(poll, range(pollers)))
+        return self.timed(recorder, run)
+
+    def serve_cycles(self, staff, cycles):
+        serve = Recorder('serve_next')
+        complete = Recorder('mark_served')
+        client = Client()
+        client.force_login(staff)
+        counter_ids = list(ServiceCounter.objects.values_list('id', flat=True))
+        ServiceCounter.objects.update(is_available=True, current_token=None)
+
+        def run():
+            for i in range(cycles):
+                counter_id = counter_ids[i % len(counter_ids)]
+                serve.call(lambda: client.post('/serve-next/', {'counter_id': counter_id}))
+                token_number = ServiceCounter.objects.filter(pk=counter_id).values_list('current_token', flat=True).first()
+                if token_number:
+                    complete.call(lambda: client.post(f'/mark-served/{token_number}/'))
+
+        start = time.perf_counter()
+        run()
+        serve.elapsed = complete.elapsed = time.perf_counter() - start
+        return [serve.report(), complete.report()]
+
+    def assign_ticks(self, ticks):
+        recorder = Recorder('auto_assign')
+        command = AutoAssignCommand(stdout=io.StringIO())
+
+        def run():
+            for _ in range(ticks):
+                # Free every counter so each pass has real work to do
+                Token.objects.filter(is_served=False, started_serving__isnull=False).update(is_served=True)
+                ServiceCounter.objects.update(is_available=True, current_token=None)
+                recorder.call(command.assign_tokens)
+        return self.timed(recorder, run)
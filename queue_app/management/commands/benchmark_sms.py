@@ -0,0 +1,91 @@
+import json
+import logging
+import time
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.test.utils import override_settings
+from queue_app.benchmarking import scratch_database
+from queue_app.fake_gateway import start_fake_gateway
+from queue_app.models import OutboxMessage
+from queue_app.sms import dispatch_pending, enqueue_many, reset_backend
+
+
+class Command(BaseCommand):
+    help = 'Drain an SMS outbox through TwilioBackend into a local fake gateway and report throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500)
+        parser.add_argument('--latency', type=float, default=0.02, help='Gateway seconds per message')
+        parser.add_argument('--handshake', type=float, default=0.06,
+                            help='Gateway seconds to set up each connection (TCP plus TLS round trips to a remote API)')
+        parser.add_argument('--failure-rate', type=float, default=0.05, help='Fraction of sends the gateway rejects')
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--compare', action='store_true', help='Also run with keep-alive disabled (a connection per message)')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON')
+
+    def handle(self, *args, **options):
+        pool_sizes = [options['workers'], 0] if options['compare'] else [options['workers']]
+        sms_logger = logging.getLogger('queue_app.sms')
+        level = sms_logger.level
+        sms_logger.setLevel(logging.CRITICAL)  # simulated failures would flood the console
+        try:
+            with scratch_database():
+                results = [self.run(options, pool_size) for pool_size in pool_sizes]
+        finally:
+            sms_logger.setLevel(level)
+            reset_backend()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{'keep-alive':<12}{'messages':>9}{'msg/s':>9}{'sent':>7}{'gave up':>9}{'attempts':>10}{'connections':>13}"
+        ))
+        for r in results:
+            self.stdout.write(
+                f"{'on' if r['pool_size'] else 'off':<12}{r['messages']:>9}{r['throughput']:>9.1f}{r['sent']:>7}"
+                f"{r['gave_up']:>9}{r['attempts']:>10}{r['connections']:>13}"
+            )
+
+    def run(self, options, pool_size):
+        OutboxMessage.objects.all().delete()
+        gateway = start_fake_gateway(
+            latency=options['latency'], handshake=options['handshake'], failure_rate=options['failure_rate']
+        )
+        overrides = override_settings(
+            SMS_ENABLED=True,
+            SMS_BACKEND='queue_app.sms.TwilioBackend',
+            TWILIO_ACCOUNT_SID='AC' + '0' * 32,
+            TWILIO_AUTH_TOKEN='benchmark',
+            TWILIO_MESSAGING_SERVICE_SID='',
+            TWILIO_PHONE_NUMBER='+15005550006',
+            TWILIO_API_BASE_URL=gateway.base_url,
+            SMS_HTTP_POOL_SIZE=pool_size,
+            SMS_RETRY_BACKOFF=0,  # retry failures straight away
+        )
+        try:
+            with overrides:
+                reset_backend()
+                enqueue_many((f'98{i:08d}', f'Benchmark message {i}') for i in range(options['messages']))
+                start = time.perf_counter()
+                while True:
+                    sent, failed = dispatch_pending(options['batch_size'], options['workers'])
+                    if not sent and not failed:
+                        break
+                elapsed = time.perf_counter() - start
+        finally:
+            gateway.shutdown()
+            gateway.server_close()
+
+        counts = dict(OutboxMessage.objects.values_list('status').annotate(n=Count('id')))
+        return {
+            'pool_size': pool_size,
+            'messages': options['messages'],
+            'seconds': elapsed,
+            'throughput': options['messages'] / elapsed if elapsed else 0.0,
+            'sent': counts.get(OutboxMessage.STATUS_SENT, 0),
+            'gave_up': counts.get(OutboxMessage.STATUS_FAILED, 0),
+            'attempts': gateway.stats['accepted'] + gateway.stats['failed'],
+            'connections': gateway.stats['connections'],
+        }
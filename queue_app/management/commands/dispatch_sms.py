@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from queue_app.sms import dispatch_pending
+from queue_app.metrics import serve_metrics
+import time
+from django.conf import settings
+
+class Command(BaseCommand):
+    help = 'Deliver queued SMS messages from the outbox in the background'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the outbox once and exit')
+        parser.add_argument('--batch-size', type=int, default=settings.SMS_DISPATCH_BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=settings.SMS_DISPATCH_WORKERS)
+        parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics (SMS send durations) on this local port')
+
+    def handle(self, *args, **options):
+        if options['metrics_port']:
+            serve_metrics(options['metrics_port'])
+        while True:
+            sent, failed = dispatch_pending(options['batch_size'], options['workers'])
+            if sent or failed:
+                self.stdout.write(
+                    self.style.SUCCESS(f'Dispatched {sent} SMS ({failed} failed)')
+                )
+            elif options['once']:
+                return
+            else:
+                # Only sleep when the outbox is empty so a backlog drains back-to-back
+                time.sleep(settings.SMS_DISPATCH_INTERVAL)
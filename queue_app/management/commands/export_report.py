@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from queue_app.reporting import history_frame, rollup_frame
+
+
+class Command(BaseCommand):
+    help = 'Export token history or the hourly rollups as CSV or Parquet through pandas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='File to write; .parquet for Parquet (needs pyarrow), anything else for CSV')
+        parser.add_argument('--from', dest='date_from', type=_date, help='First day (YYYY-MM-DD; default: 7 days ago)')
+        parser.add_argument('--to', dest='date_to', type=_date, help='Last day (default: today)')
+        parser.add_argument('--tokens', action='store_true',
+                            help='One row per live or archived token instead of one per hour and service')
+
+    def handle(self, *args, **options):
+        last_day = options['date_to'] or timezone.localdate()
+        first_day = options['date_from'] or last_day - timedelta(days=6)
+        if first_day > last_day:
+            raise CommandError('--from must not be after --to')
+        try:
+            if options['tokens']:
+                frame = history_frame(first_day, last_day)
+            else:
+                frame = rollup_frame(first_day, last_day)
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+        output = options['output']
+        try:
+            if output.endswith('.parquet'):
+                frame.to_parquet(output, index=False)
+            else:
+                frame.to_csv(output, index=False)
+        except (ImportError, OSError) as e:
+            raise CommandError(f'Cannot write {output}: {e}')
+        self.stdout.write(self.style.SUCCESS(f'Wrote {len(frame)} rows to {output}'))
+
+
+def _date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
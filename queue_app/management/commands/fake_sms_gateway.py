@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from queue_app.fake_gateway import FakeTwilioServer
+
+class Command(BaseCommand):
+    help = 'Serve a local stand-in for the Twilio Messages API (point TWILIO_API_BASE_URL at it)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8099)
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--latency', type=float, default=0.05, help='Seconds to wait before answering each message')
+        parser.add_argument('--handshake', type=float, default=0.0, help='Extra seconds for each new connection (TCP and TLS setup)')
+        parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of messages answered with a 500')
+        parser.add_argument('--fail-number', action='append', default=[], help='Always fail messages to this number')
+
+    def handle(self, *args, **options):
+        server = FakeTwilioServer(
+            (options['host'], options['port']),
+            latency=options['latency'],
+            handshake=options['handshake'],
+            failure_rate=options['failure_rate'],
+            fail_numbers=options['fail_number'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Fake SMS gateway listening on {server.base_url} (set TWILIO_API_BASE_URL={server.base_url})'
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            stats = server.stats
+            self.stdout.write(
+                f"{stats['accepted']} accepted, {stats['failed']} failed, {stats['connections']} connections"
+            )
@@ -0,0 +1,65 @@
+import csv
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from queue_app.bulk_import import (
+    FORMATS, category_lookup, check_import, import_format, issue_import, read_rows, spool, text_lines, write_results,
+)
+
+
+class Command(BaseCommand):
+    help = 'Pre-issue tokens from a CSV or JSON Lines file (customer_name, phone_number, category, priority, appointment_at)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - for standard input')
+        parser.add_argument('--format', choices=FORMATS, help='File format (default: from the file extension)')
+        parser.add_argument('--output', help='Write the issued tokens and their positions to this file (- for standard output)')
+        parser.add_argument('--chunk-size', type=int, default=settings.IMPORT_CHUNK_SIZE, help='Tokens inserted per transaction')
+        parser.add_argument('--skip-invalid', action='store_true', help='Import the valid rows even if some are invalid')
+        parser.add_argument('--dry-run', action='store_true', help='Only check the file')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or import_format(path)
+        if fmt is None:
+            raise CommandError('Cannot tell the format from the file name; pass --format')
+        try:
+            source = spool(sys.stdin.buffer) if path == '-' else open(path, 'rb')
+        except OSError as e:
+            raise CommandError(f'Cannot read {path}: {e}')
+
+        with source:
+            categories = category_lookup()
+            try:
+                valid, invalid, errors = check_import(read_rows(text_lines(source), fmt), categories)
+            except (UnicodeDecodeError, csv.Error) as e:
+                raise CommandError(f'Unreadable {fmt} file: {e}')
+            for line_number, row_errors in errors.items():
+                for field, messages in row_errors.items():
+                    for message in messages:
+                        self.stderr.write(f"line {line_number}: {field}: {message['message']}")
+            if invalid > len(errors):
+                self.stderr.write(f'... and {invalid - len(errors)} more invalid rows')
+            if invalid and not options['skip_invalid']:
+                raise CommandError(f'{invalid} invalid rows; fix them or pass --skip-invalid')
+            if options['dry_run'] or not valid:
+                self.stdout.write(f'{valid} rows would be issued, {invalid} skipped')
+                return
+
+            output = options['output']
+            out = None
+            if output == '-':
+                out = self.stdout
+            elif output:
+                out = open(output, 'w', newline='', encoding='utf-8')
+            try:
+                results = issue_import(read_rows(text_lines(source), fmt), categories, valid, options['chunk_size'])
+                count, first, last = write_results(results, out, fmt)
+            finally:
+                if out is not None and out is not self.stdout:
+                    out.close()
+
+        summary = self.stderr if output == '-' else self.stdout
+        summary.write(self.style.SUCCESS(f'Issued {count} tokens, #{first} to #{last}'))
+        if invalid:
+            summary.write(self.style.WARNING(f'Skipped {invalid} invalid rows'))
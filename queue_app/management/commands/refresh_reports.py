@@ -0,0 +1,43 @@
+from datetime import datetime
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from queue_app.reporting import first_history_day, refresh_rollups
+
+
+class Command(BaseCommand):
+    help = 'Keep the hourly report rollups up to date in the background'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Refresh once and exit')
+        parser.add_argument('--from', dest='date_from', type=_date,
+                            help='First day to rebuild (YYYY-MM-DD; default: the last REPORTING_REFRESH_DAYS days)')
+        parser.add_argument('--to', dest='date_to', type=_date, help='Last day to rebuild (default: today)')
+        parser.add_argument('--all', action='store_true', help='Rebuild every day since the oldest token, then exit')
+
+    def handle(self, *args, **options):
+        first_day, last_day = options['date_from'], options['date_to']
+        if options['all']:
+            first_day = first_history_day()
+            if first_day is None:
+                self.stdout.write('No tokens to report on')
+                return
+        if first_day and last_day and first_day > last_day:
+            raise CommandError('--from must not be after --to')
+        # A backfill of chosen days runs once; the default window slides along with the clock
+        once = options['once'] or options['all'] or options['date_from'] or options['date_to']
+        while True:
+            start = time.perf_counter()
+            days = refresh_rollups(first_day, last_day)
+            if days:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Refreshed {len(days)} days of rollups ({days[0]} to {days[-1]}) '
+                    f'in {time.perf_counter() - start:.1f}s'
+                ))
+            if once:
+                return
+            time.sleep(settings.REPORTING_REFRESH_INTERVAL)
+
+
+def _date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
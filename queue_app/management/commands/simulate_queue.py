@@ -0,0 +1,116 @@
+from datetime import datetime, time as dt_time, timedelta
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from queue_app.simulation import (
+    WEEKDAYS, arrival_profile, category_priorities, current_counters, history_workload, next_weekday_start,
+    service_profile, simulate, synthetic_workload,
+)
+
+
+class Command(BaseCommand):
+    help = 'Replay historical or synthetic arrivals through the assignment rules in memory and report waits'
+
+    def add_arguments(self, parser):
+        source = parser.add_argument_group('arrivals')
+        source.add_argument('--from', dest='date_from', type=_date, help='Replay tokens issued from this day (YYYY-MM-DD)')
+        source.add_argument('--to', dest='date_to', type=_date, help='Last day to replay (default: same as --from)')
+        source.add_argument('--weekday', choices=WEEKDAYS, help='Synthetic arrivals at the average hourly rate of this weekday')
+        source.add_argument('--rate', type=float, help='Synthetic arrivals per hour between --open and --close')
+        source.add_argument('--open', type=int, default=9, help='First hour of arrivals for --rate')
+        source.add_argument('--close', type=int, default=17, help='Hour arrivals stop for --rate')
+        source.add_argument('--days', type=int, default=1, help='Synthetic days to simulate back to back')
+        source.add_argument('--scale', type=float, default=1.0, help='Multiply synthetic arrival rates (e.g. 1.2 for 20%% growth)')
+        source.add_argument('--history-days', type=int, default=28, help='History used for arrival rates and service times')
+        source.add_argument('--service-mean', type=float, help='Mean service seconds when there is no history')
+        source.add_argument('--seed', type=int)
+        parser.add_argument('--counters', type=int, nargs='+',
+                            help='Counters serving every category; several values compare them (default: the configured counters)')
+        parser.add_argument('--threshold', type=int, help='Fairness threshold (default: FAIRNESS_THRESHOLD)')
+        parser.add_argument('--target-p95', type=float, help='Report the fewest counters keeping p95 wait under this many minutes')
+        parser.add_argument('--by-hour', action='store_true', help='Break results down by hour of day')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON')
+
+    def handle(self, *args, **options):
+        workload = self.workload(options)
+        if not len(workload):
+            raise CommandError('No tokens to simulate')
+        setups = [[frozenset()] * count for count in options['counters'] or []] or [current_counters()]
+        if not setups[0]:
+            raise CommandError('No counters are configured; pass --counters')
+        priorities = category_priorities()
+        utc_offset = timezone.localtime().utcoffset().total_seconds()  # hours of day ignore DST changes mid-run
+        results = [
+            simulate(workload, counters, options['threshold'], priorities, utc_offset)
+            for counters in setups
+        ]
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{'counters':>8}{'tokens':>9}{'mean':>8}{'p50':>8}{'p90':>8}{'p95':>8}{'p99':>8}{'max':>8}"
+            f"{'queue':>8}{'max q':>7}{'util':>7}{'tok/s':>10}"
+        ))
+        for r in results:
+            w = r['wait']
+            self.stdout.write(
+                f"{r['counters']:>8}{r['tokens']:>9}{w['mean']:>8.1f}{w['p50']:>8.1f}{w['p90']:>8.1f}{w['p95']:>8.1f}"
+                f"{w['p99']:>8.1f}{w['max']:>8.1f}{r['queue']['mean']:>8.1f}{r['queue']['max']:>7}"
+                f"{r['utilisation']:>7.0%}{r['tokens_per_second']:>10.0f}"
+            )
+            if r['unserved']:
+                self.stdout.write(self.style.WARNING(f"  {r['unserved']} tokens are in queues no counter serves"))
+        self.stdout.write('Waits in minutes from when a token became due to when it was called')
+
+        if options['by_hour']:
+            for r in results:
+                self.stdout.write(self.style.MIGRATE_HEADING(
+                    f"\n{r['counters']} counters{'hour':>8}{'tokens':>9}{'p50':>8}{'p95':>8}{'queue':>8}{'util':>7}"
+                ))
+                for h in r['hours']:
+                    self.stdout.write(
+                        f"{'':>11}{h['hour']:>6}:00{h['arrivals']:>9}{h['wait']['p50']:>8.1f}{h['wait']['p95']:>8.1f}"
+                        f"{h['queue']:>8.1f}{h['utilisation']:>7.0%}"
+                    )
+
+        if options['target_p95'] is not None:
+            enough = [r['counters'] for r in results if r['wait']['p95'] <= options['target_p95'] and not r['unserved']]
+            if enough:
+                self.stdout.write(self.style.SUCCESS(
+                    f"{min(enough)} counters keep p95 wait within {options['target_p95']:g} minutes"
+                ))
+            else:
+                self.stdout.write(self.style.WARNING(
+                    f"None of the simulated setups keeps p95 wait within {options['target_p95']:g} minutes"
+                ))
+
+    def workload(self, options):
+        if options['date_from']:
+            start = _local_midnight(options['date_from'])
+            end = _local_midnight(options['date_to'] or options['date_from']) + timedelta(days=1)
+            return history_workload(start, end)
+
+        if options['weekday']:
+            rates = arrival_profile(options['weekday'], options['history_days'])
+        elif options['rate'] is not None:
+            rates = [options['rate'] if options['open'] <= hour < options['close'] else 0.0 for hour in range(24)]
+        else:
+            raise CommandError('Pass --from to replay history, or --weekday or --rate for synthetic arrivals')
+        return synthetic_workload(
+            rates,
+            next_weekday_start(options['weekday']),
+            days=options['days'],
+            scale=options['scale'],
+            profile=service_profile(options['history_days']),
+            service_mean=options['service_mean'],
+            seed=options['seed'],
+        )
+
+
+def _date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _local_midnight(day):
+    return timezone.make_aware(datetime.combine(day, dt_time.min))
@@ -0,0 +1,174 @@
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import heapq
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from .queue_state import queue_index
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Process-local counters and histograms rendered in Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, tuple(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value, buckets=DEFAULT_BUCKETS):
+        key = (name, tuple(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def gauge(self, name, func):
+        """Register a callable evaluated at scrape time"""
+        self._gauges[name] = func
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            snapshots = [(key, list(h.counts), h.sum, h.count, h.buckets) for key, h in histograms]
+
+        seen = set()
+
+        def header(name):
+            if name not in seen and name in self._help:
+                kind, help_text = self._help[name]
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+            seen.add(name)
+
+        for (name, labels), value in counters:
+            header(name)
+            lines.append(f'{name}{_labels(labels)} {value}')
+
+        for (name, labels), counts, total, count, buckets in snapshots:
+            header(name)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_labels(labels + (("le", repr(bound)),))} {cumulative}')
+            lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{_labels(labels)} {total}')
+            lines.append(f'{name}_count{_labels(labels)} {count}')
+
+        for name, func in sorted(self._gauges.items()):
+            header(name)
+            try:
+                lines.append(f'{name} {func()}')
+            except Exception as e:
+                logger.error(f"Metric {name} failed: {e}")
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+registry = MetricsRegistry()
+registry.describe('queue_http_requests_total', 'counter', 'Requests handled, by view, method and status')
+registry.describe('queue_http_request_duration_seconds', 'histogram', 'Request latency by view')
+registry.describe('queue_db_queries_total', 'counter', 'Database queries executed, by view')
+registry.describe('queue_db_query_seconds_total', 'counter', 'Time spent in database queries, by view')
+registry.describe('queue_sms_send_duration_seconds', 'histogram', 'Time spent handing one SMS to the provider')
+registry.describe('queue_unserved_tokens', 'gauge', 'Tokens issued but not yet served')
+registry.describe('queue_waiting_tokens', 'gauge', 'Tokens not yet called to a counter')
+registry.gauge('queue_unserved_tokens', queue_index.unserved_count)
+registry.gauge('queue_waiting_tokens', queue_index.waiting_count)
+
+
+def observe_sms(duration, ok):
+    registry.observe('queue_sms_send_duration_seconds', (('outcome', 'sent' if ok else 'failed'),), duration)
+
+
+class SlowRequestProfiles:
+    """Keeps cProfile dumps of the slowest sampled requests on disk"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kept = []  # min-heap of (duration, path)
+
+    def record(self, profile, duration, view_name):
+        keep = settings.METRICS_PROFILE_KEEP
+        with self._lock:
+            if len(self._kept) >= keep and duration <= self._kept[0][0]:
+                return
+            os.makedirs(settings.METRICS_PROFILE_DIR, exist_ok=True)
+            safe_view = ''.join(c if c.isalnum() or c in '-_' else '_' for c in view_name)
+            path = os.path.join(
+                settings.METRICS_PROFILE_DIR,
+                f'{int(duration * 1000):06d}ms-{safe_view}-{time.time_ns()}.prof',
+            )
+            profile.dump_stats(path)
+            heapq.heappush(self._kept, (duration, path))
+            while len(self._kept) > keep:
+                _, stale = heapq.heappop(self._kept)
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+
+slow_profiles = SlowRequestProfiles()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port, host='127.0.0.1'):
+    """Expose this process's metrics on a side port (for background commands)"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,118 @@
+from contextvars import ContextVar
+import cProfile
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .metrics import registry, slow_profiles
+
+
+class _QueryTimer:
+    """connection.execute_wrapper hook that counts and times queries"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+# The _QueryTimer of the request being handled. A context variable follows
+# an async view's sync_to_async calls into their worker thread, where a
+# wrapper installed on the event loop thread's connection can't see them.
+_request_queries = ContextVar('request_queries', default=None)
+
+
+def _time_query(execute, sql, params, many, context):
+    queries = _request_queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    return queries(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    """Put _time_query on every connection, whichever thread opens it"""
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+class MetricsMiddleware:
+    """Record per-view latency and database usage for the /metrics/ endpoint.
+
+    Works in both sync and async chains, so it does not push async views
+    back onto a thread under ASGI. Queries are counted in either, including
+    those an async view runs through sync_to_async; profiles are only taken
+    of sync requests.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        profile = None
+        if settings.METRICS_PROFILE_SAMPLE_RATE and random.random() < settings.METRICS_PROFILE_SAMPLE_RATE:
+            profile = cProfile.Profile()
+
+        queries = _QueryTimer()
+        timing = _request_queries.set(queries)
+        start = time.perf_counter()
+        if profile is not None:
+            try:
+                profile.enable()
+            except ValueError:  # another profiler is already active in this thread
+                profile = None
+        try:
+            response = self.get_response(request)
+        finally:
+            if profile is not None:
+                profile.disable()
+            _request_queries.reset(timing)
+        duration = time.perf_counter() - start
+
+        view = self._record(request, response, duration, queries)
+        if profile is not None:
+            slow_profiles.record(profile, duration, view)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+        queries = _QueryTimer()
+        timing = _request_queries.set(queries)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_queries.reset(timing)
+        self._record(request, response, time.perf_counter() - start, queries)
+        return response
+
+    def _record(self, request, response, duration, queries=None):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        registry.inc('queue_http_requests_total', (('view', view), ('method', request.method), ('status', response.status_code)))
+        registry.observe('queue_http_request_duration_seconds', (('view', view),), duration)
+        if queries is not None and queries.count:
+            registry.inc('queue_db_queries_total', (('view', view),), queries.count)
+            registry.inc('queue_db_query_seconds_total', (('view', view),), queries.seconds)
+        return view
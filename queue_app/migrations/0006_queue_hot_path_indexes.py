@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-18 06:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue_app', '0005_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='servicecounter',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['last_token_completed'], name='counter_free_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(condition=models.Q(('is_served', False), ('started_serving__isnull', True)), fields=['token_number'], name='token_waiting_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(condition=models.Q(('is_served', False)), fields=['token_number'], name='token_unserved_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(condition=models.Q(('is_served', False)), fields=['started_serving'], name='token_serving_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(condition=models.Q(('is_served', True)), fields=['-issued_at'], name='token_served_recent_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-18 06:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue_app', '0007_broadcast'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token_number', models.PositiveIntegerField()),
+                ('customer_name', models.CharField(max_length=100)),
+                ('phone_number', models.CharField(blank=True, max_length=20, null=True)),
+                ('issued_at', models.DateTimeField()),
+                ('started_serving', models.DateTimeField(blank=True, null=True)),
+                ('completed_serving', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('counter', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='queue_app.servicecounter')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['issued_at'], name='archive_issued_idx'), models.Index(fields=['completed_serving'], name='archive_completed_idx'), models.Index(fields=['token_number'], name='archive_token_idx')],
+            },
+        ),
+    ]
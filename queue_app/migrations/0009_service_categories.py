@@ -0,0 +1,45 @@
+# Generated by Django 5.2.5 on 2026-10-18 06:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue_app', '0008_archivedtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceCategory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('priority', models.PositiveSmallIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'service categories',
+                'ordering': ['-priority', 'name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='archivedtoken',
+            name='category',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='queue_app.servicecategory'),
+        ),
+        migrations.AddField(
+            model_name='servicecounter',
+            name='categories',
+            field=models.ManyToManyField(blank=True, related_name='counters', to='queue_app.servicecategory'),
+        ),
+        migrations.AddField(
+            model_name='token',
+            name='category',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tokens', to='queue_app.servicecategory'),
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(condition=models.Q(('is_served', False), ('started_serving__isnull', True)), fields=['category', 'token_number'], name='token_waiting_category_idx'),
+        ),
+    ]
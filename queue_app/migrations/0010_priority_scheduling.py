@@ -0,0 +1,50 @@
+# Generated by Django 5.2.5 on 2026-10-18 06:30
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_schedule_key(apps, schema_editor):
+    # Existing tokens are all walk-ins: they arrived when they were issued
+    Token = apps.get_model('queue_app', 'Token')
+    Token.objects.update(schedule_key=models.F('issued_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue_app', '0009_service_categories'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedtoken',
+            name='appointment_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedtoken',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='token',
+            name='appointment_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='token',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Normal'), (1, 'Priority'), (2, 'Urgent')], default=0),
+        ),
+        migrations.AddField(
+            model_name='token',
+            name='schedule_key',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_schedule_key, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(condition=models.Q(('is_served', False), ('started_serving__isnull', True)), fields=['category', 'schedule_key', 'token_number'], name='token_schedule_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue_app', '0010_priority_scheduling'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CounterRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('hour', models.PositiveSmallIntegerField()),
+                ('served', models.PositiveIntegerField(default=0)),
+                ('busy_seconds', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HourlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('hour', models.PositiveSmallIntegerField()),
+                ('issued', models.PositiveIntegerField(default=0)),
+                ('called', models.PositiveIntegerField(default=0)),
+                ('served', models.PositiveIntegerField(default=0)),
+                ('abandoned', models.PositiveIntegerField(default=0)),
+                ('timed_out', models.PositiveIntegerField(default=0)),
+                ('wait_seconds', models.FloatField(default=0)),
+                ('service_seconds', models.FloatField(default=0)),
+                ('wait_histogram', models.JSONField(default=list)),
+                ('service_histogram', models.JSONField(default=list)),
+                ('refreshed_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['issued_at'], name='token_issued_idx'),
+        ),
+        migrations.AddField(
+            model_name='counterrollup',
+            name='counter',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='queue_app.servicecounter'),
+        ),
+        migrations.AddField(
+            model_name='hourlyrollup',
+            name='category',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='queue_app.servicecategory'),
+        ),
+        migrations.AddIndex(
+            model_name='counterrollup',
+            index=models.Index(fields=['day', 'hour'], name='counter_rollup_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hourlyrollup',
+            index=models.Index(fields=['day', 'hour'], name='rollup_day_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:13
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue_app', '0011_reporting_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderLease',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('holder', models.CharField(blank=True, max_length=100)),
+                ('term', models.PositiveIntegerField(default=0)),
+                ('acquired_at', models.DateTimeField(blank=True, null=True)),
+                ('expires_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QueueChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('token_number', models.PositiveIntegerField(blank=True, null=True)),
+                ('source', models.CharField(max_length=8)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='queue_change_created_idx')],
+            },
+        ),
+    ]
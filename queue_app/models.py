@@ -1,21 +1,68 @@
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
 from django.conf import settings
 from django.utils import timezone
-from twilio.rest import Client
+from datetime import timedelta
 import logging
 
+from .dashboard import invalidate_dashboard
+from .queue_state import queue_index
+from .snapshot import invalidate_queue_snapshot
+from .wakeup import notify_assigner
+
 logger = logging.getLogger(__name__)
 
+class ServiceCategory(models.Model):
+    """A department with its own queue and fairness window"""
+    name = models.CharField(max_length=100, unique=True)
+    priority = models.PositiveSmallIntegerField(default=0)  # higher is called first when counters are shared
+
+    class Meta:
+        ordering = ['-priority', 'name']
+        verbose_name_plural = 'service categories'
+
+    def __str__(self):
+        return self.name
+
+
+def queue_filter(category_id):
+    """Q matching one queue; tokens without a category form the general queue"""
+    if category_id is None:
+        return Q(category__isnull=True)
+    return Q(category_id=category_id)
+
+
+def any_queue_filter(category_ids):
+    q = Q(pk__in=[])
+    for category_id in category_ids:
+        q |= queue_filter(category_id)
+    return q
+
+
 class ServiceCounter(models.Model):
     name = models.CharField(max_length=100)
     is_available = models.BooleanField(default=True)
+    # Empty means the counter serves every category
+    categories = models.ManyToManyField(ServiceCategory, blank=True, related_name='counters')
     current_token = models.ForeignKey('Token', null=True, blank=True, on_delete=models.SET_NULL, related_name='serving_at')
     last_token_completed = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Free counters, longest idle first (assignment engine)
+            models.Index(fields=['last_token_completed'], name='counter_free_idx', condition=models.Q(is_available=True)),
+        ]
+
     @classmethod
-    def get_next_available(cls):
-        """Get the counter that's been free the longest"""
-        return cls.objects.filter(is_available=True).order_by('last_token_completed').first()
+    def get_next_available(cls, category_id=None):
+        """Get the counter that's been free the longest (that can serve category_id, if given)"""
+        counters = cls.objects.filter(is_available=True)
+        if category_id is not None:
+            counters = counters.filter(Q(categories__isnull=True) | Q(categories=category_id)).distinct()
+        return counters.order_by(
+            models.F('last_token_completed').asc(nulls_first=True), 'id'
+        ).first()
 
     def __str__(self):
         return self.name
@@ -24,43 +71,133 @@ class Token(models.Model):
     token_number = models.AutoField(primary_key=True)
     customer_name = models.CharField(max_length=100)
     phone_number = models.CharField(max_length=20, blank=True, null=True)
+    category = models.ForeignKey(ServiceCategory, null=True, blank=True, on_delete=models.SET_NULL, related_name='tokens')
+    priority = models.PositiveSmallIntegerField(default=0, choices=[(0, 'Normal'), (1, 'Priority'), (2, 'Urgent')])
+    appointment_at = models.DateTimeField(null=True, blank=True)  # booked time slot, if any
+    # Virtual arrival time: the queue is served in schedule_key order (see schedule_key_for)
+    schedule_key = models.DateTimeField(default=timezone.now)
     issued_at = models.DateTimeField(auto_now_add=True)
     is_served = models.BooleanField(default=False)
     counter = models.ForeignKey(ServiceCounter, null=True, blank=True, on_delete=models.SET_NULL)
     started_serving = models.DateTimeField(null=True, blank=True)
     completed_serving = models.DateTimeField(null=True, blank=True)
 
-    FAIRNESS_THRESHOLD = 3  # Maximum tokens ahead allowed for parallel serving
+    FAIRNESS_THRESHOLD = 3  # Default maximum tokens ahead allowed for parallel serving
+
+    class Meta:
+        indexes = [
+            # Waiting tokens in queue order (fairness window, assignment)
+            models.Index(
+                fields=['token_number'], name='token_waiting_idx',
+                condition=models.Q(is_served=False, started_serving__isnull=True),
+            ),
+            # Head of each category's queue
+            models.Index(
+                fields=['category', 'token_number'], name='token_waiting_category_idx',
+                condition=models.Q(is_served=False, started_serving__isnull=True),
+            ),
+            # Each category's queue in schedule order (fairness window)
+            models.Index(
+                fields=['category', 'schedule_key', 'token_number'], name='token_schedule_idx',
+                condition=models.Q(is_served=False, started_serving__isnull=True),
+            ),
+            # Unserved tokens in queue order (queue index, dashboard)
+            models.Index(fields=['token_number'], name='token_unserved_idx', condition=models.Q(is_served=False)),
+            # Tokens being served, by start time (timeout sweep)
+            models.Index(fields=['started_serving'], name='token_serving_idx', condition=models.Q(is_served=False)),
+            # Recently served list on the dashboard
+            models.Index(fields=['-issued_at'], name='token_served_recent_idx', condition=models.Q(is_served=True)),
+            # Tokens issued on a day (report rollups)
+            models.Index(fields=['issued_at'], name='token_issued_idx'),
+        ]
 
     def __str__(self):
         return f"Token {self.token_number} ({self.customer_name})"
 
+    def save(self, *args, **kwargs):
+        # Recomputed on every save so editing priority or the slot re-files the token
+        self.schedule_key = self.schedule_key_for(self.issued_at or timezone.now(), self.priority, self.appointment_at)
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def schedule_key_for(issued_at, priority=0, appointment_at=None):
+        """Virtual arrival time that orders a token in its queue.
+
+        A walk-in arrives when it is issued. A priority token is treated as
+        having arrived PRIORITY_HEAD_START seconds earlier per level, and an
+        appointment APPOINTMENT_HEAD_START seconds before its slot. Every
+        waiting token ages at the same rate, so the order never has to be
+        recomputed, and a priority token can never overtake a walk-in that
+        has already waited longer than its head start: that bounds how long
+        the FIFO can be held up.
+        """
+        if appointment_at is not None:
+            key = appointment_at - timedelta(seconds=settings.APPOINTMENT_HEAD_START)
+        else:
+            key = issued_at
+        return key - timedelta(seconds=settings.PRIORITY_HEAD_START * priority)
+
+    @classmethod
+    def fairness_threshold(cls):
+        """FAIRNESS_THRESHOLD from settings, falling back to the class default"""
+        return getattr(settings, 'FAIRNESS_THRESHOLD', cls.FAIRNESS_THRESHOLD)
+
+    @classmethod
+    def waiting(cls):
+        """Tokens that have not been called to a counter yet, in queue order"""
+        return cls.objects.filter(
+            is_served=False,
+            started_serving__isnull=True
+        ).order_by('token_number')
+
+    @classmethod
+    def servable(cls, threshold=None, queues=None):
+        """Waiting tokens inside their own queue's fairness window, resolved in a single query.
+
+        A queue's window is its first `threshold` + 1 due tokens in schedule
+        order (ties broken by token number). Appointments are not due until
+        their schedule_key has passed. Each category is ranked separately, so
+        every queue keeps an independent window. `queues` limits the result
+        to some category ids (None in it meaning the general queue).
+        """
+        if threshold is None:
+            threshold = cls.fairness_threshold()
+        due = cls.waiting().filter(schedule_key__lte=timezone.now())
+        if queues is not None:
+            due = due.filter(any_queue_filter(queues))
+        window = due.order_by().annotate(rank=Window(
+            RowNumber(),
+            partition_by=[F('category')],
+            order_by=[F('schedule_key').asc(), F('token_number').asc()],
+        )).filter(rank__lte=threshold + 1).values('pk')
+        # Locking (select_for_update) works on the plain outer query
+        return cls.objects.filter(pk__in=window).order_by('schedule_key', 'token_number')
+
     @property
     def can_be_served(self):
         """Check if this token can be served based on fairness rules"""
         if self.is_served:
             return False
         
-        # Get the lowest unserved token number that hasn't started serving
-        earliest_pending = Token.objects.filter(
-            is_served=False, 
-            started_serving__isnull=True
-        ).order_by('token_number').first()
-
-        if not earliest_pending:
-            return True
-
-        # Allow serving if we're within FAIRNESS_THRESHOLD of the earliest pending
-        return self.token_number <= earliest_pending.token_number + self.FAIRNESS_THRESHOLD
+        return Token.servable(queues=[self.category_id]).filter(pk=self.pk).exists()
 
     def start_serving(self, counter):
         """Mark token as being served at a counter"""
-        if not self.can_be_served:
+        # The claim is a conditional UPDATE on the fairness window, so a token
+        # that left the window (or was taken by another counter) is rejected
+        now = timezone.now()
+        claimed = Token.servable(queues=[self.category_id]).filter(pk=self.pk).update(
+            counter=counter, started_serving=now
+        )
+        if not claimed:
             return False
-        
+
         self.counter = counter
-        self.started_serving = timezone.now()
-        self.save()
+        self.started_serving = now
+        token_number = self.token_number
+        QueueChange.record([token_number])
+        transaction.on_commit(invalidate_queue_snapshot)
+        transaction.on_commit(lambda: queue_index.on_start(token_number))
         
         counter.current_token = self
         counter.is_available = False
@@ -75,18 +212,287 @@ class Token(models.Model):
         if self.counter:
             self.counter.is_available = True
             self.counter.current_token = None
+            self.counter.last_token_completed = self.completed_serving
             self.counter.save()
         self.save()
 
     @classmethod
-    def get_next_servable(cls):
+    def issue_many(cls, entries, now=None, first_number=None):
+        """Issue tokens from dicts of Token fields (as TokenForm cleans them) with one INSERT.
+
+        Bulk imports pass one `now` for every chunk, so their walk-ins keep
+        file order, and number tokens from a block taken with reserve_numbers().
+        """
+        now = now or timezone.now()
+        tokens = cls.objects.bulk_create([
+            cls(
+                token_number=None if first_number is None else first_number + i,
+                customer_name=entry['customer_name'],
+                phone_number=entry.get('phone_number') or None,
+                category=entry.get('category'),
+                priority=entry.get('priority') or 0,
+                appointment_at=entry.get('appointment_at'),
+                schedule_key=cls.schedule_key_for(now, entry.get('priority') or 0, entry.get('appointment_at')),
+            )
+            for i, entry in enumerate(entries)
+        ])
+        # bulk_create skips save() and post_save, so announce the new tokens here
+        issued = [(token.token_number, token.category_id, token.schedule_key) for token in tokens]
+        QueueChange.record([token_number for token_number, _, _ in issued])
+        transaction.on_commit(lambda: _tokens_issued(issued))
+        return tokens
+
+    @classmethod
+    def reserve_numbers(cls, count):
+        """Take `count` consecutive token numbers for a bulk import and return the first.
+
+        Moves the table's id sequence past the block in a short transaction,
+        so tokens issued while the import runs are numbered after it.
+        """
+        table = cls._meta.db_table
+        column = cls._meta.pk.column
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Waits for inserts in flight and holds off new ones until the block is taken
+                cursor.execute(f'LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE')
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence(%s, %s), "
+                    f"GREATEST(nextval(pg_get_serial_sequence(%s, %s)) - 1, "
+                    f"(SELECT COALESCE(MAX({column}), 0) FROM {table})) + %s)",
+                    [table, column, table, column, count],
+                )
+            elif connection.vendor == 'sqlite':
+                # AUTOINCREMENT keeps the last number handed out in sqlite_sequence
+                cursor.execute(
+                    f"UPDATE sqlite_sequence SET seq = MAX(seq, (SELECT COALESCE(MAX({column}), 0) FROM {table})) + %s "
+                    f"WHERE name = %s",
+                    [count, table],
+                )
+                if not cursor.rowcount:
+                    cursor.execute(
+                        f"INSERT INTO sqlite_sequence (name, seq) SELECT %s, COALESCE(MAX({column}), 0) + %s FROM {table}",
+                        [table, count],
+                    )
+                cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+            else:
+                raise NotImplementedError(f'Reserving token numbers is not supported on {connection.vendor}')
+            last = cursor.fetchone()[0]
+        return last - count + 1
+
+    @classmethod
+    def get_next_servable(cls, queues=None):
         """Get the next token that can be fairly served"""
-        unserved = cls.objects.filter(
-            is_served=False,
-            started_serving__isnull=True
-        ).order_by('token_number')
-        
-        for token in unserved[:cls.FAIRNESS_THRESHOLD + 1]:
-            if token.can_be_served:
-                return token
-        return None
\ No newline at end of file
+        batch = cls.get_next_servable_batch(1, queues)
+        return batch[0] if batch else None
+
+    @classmethod
+    def get_next_servable_batch(cls, count, queues=None):
+        """Get up to `count` tokens that can be fairly served, in schedule order.
+
+        Picked from the queue index's heaps, then fetched by primary key.
+        """
+        window = [token_number for _, token_number, _ in queue_index.servable(queues=queues)]
+        return list(cls.waiting().filter(pk__in=window).order_by('schedule_key', 'token_number')[:count])
+
+
+def _tokens_issued(issued):
+    invalidate_queue_snapshot()
+    for token_number, category_id, schedule_key in issued:
+        queue_index.on_issue(token_number, category_id, schedule_key)
+    invalidate_dashboard()
+    notify_assigner()
+
+
+class ArchivedToken(models.Model):
+    """A served token moved out of the live Token table by archive_tokens"""
+    # token_number is not unique: reset_queue restarts numbering from 1
+    token_number = models.PositiveIntegerField()
+    customer_name = models.CharField(max_length=100)
+    phone_number = models.CharField(max_length=20, blank=True, null=True)
+    category = models.ForeignKey(ServiceCategory, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    priority = models.PositiveSmallIntegerField(default=0)
+    appointment_at = models.DateTimeField(null=True, blank=True)
+    issued_at = models.DateTimeField()
+    counter = models.ForeignKey(ServiceCounter, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    started_serving = models.DateTimeField(null=True, blank=True)
+    completed_serving = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    # Columns copied verbatim from Token
+    TOKEN_FIELDS = (
+        'token_number', 'customer_name', 'phone_number', 'category_id', 'priority', 'appointment_at', 'issued_at',
+        'counter_id', 'started_serving', 'completed_serving',
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['issued_at'], name='archive_issued_idx'),
+            models.Index(fields=['completed_serving'], name='archive_completed_idx'),
+            models.Index(fields=['token_number'], name='archive_token_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived token {self.token_number} ({self.customer_name})"
+
+
+class Broadcast(models.Model):
+    """One status update fanned out to every waiting token"""
+    KIND_ALL_BUSY = 'all_busy'
+
+    kind = models.CharField(max_length=30)
+    created_at = models.DateTimeField(auto_now_add=True)
+    recipients = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)  # deduplicated or rate limited
+
+    def __str__(self):
+        return f"{self.kind} broadcast to {self.recipients}"
+
+    def progress(self):
+        """Delivery counts of this broadcast's messages, by outbox status"""
+        counts = {
+            row['status']: row['n']
+            for row in self.messages.values('status').annotate(n=models.Count('id'))
+        }
+        return {
+            'recipients': self.recipients,
+            'skipped': self.skipped,
+            'sent': counts.get(OutboxMessage.STATUS_SENT, 0),
+            'failed': counts.get(OutboxMessage.STATUS_FAILED, 0),
+            'pending': counts.get(OutboxMessage.STATUS_PENDING, 0) + counts.get(OutboxMessage.STATUS_SENDING, 0),
+        }
+
+
+class OutboxMessage(models.Model):
+    """An SMS waiting to be delivered by the background dispatcher"""
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    phone_number = models.CharField(max_length=20)
+    body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    broadcast = models.ForeignKey(Broadcast, null=True, blank=True, on_delete=models.SET_NULL, related_name='messages')
+    token_number = models.PositiveIntegerField(null=True, blank=True)  # recipient token, for broadcast dedup
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+            models.Index(fields=['created_at'], name='outbox_broadcast_recent_idx', condition=models.Q(broadcast__isnull=False)),
+        ]
+
+    def __str__(self):
+        return f"SMS to {self.phone_number} ({self.status})"
+
+
+
+class QueueChange(models.Model):
+    """A committed change to a token's place in the queue, for every process to pick up.
+
+    Written in the same transaction as the change. Each process polls for
+    rows it did not write every QUEUE_SYNC_INTERVAL seconds and applies them
+    to its queue index and process-local caches (see QueueStateIndex.sync()).
+    token_number is None when the whole queue was reset.
+    """
+    id = models.BigAutoField(primary_key=True)
+    token_number = models.PositiveIntegerField(null=True, blank=True)  # not a foreign key: tokens get deleted
+    source = models.CharField(max_length=8)  # instance_id of the queue index in the process that made the change
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='queue_change_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Change to token #{self.token_number}" if self.token_number else "Queue reset"
+
+    @classmethod
+    def record(cls, token_numbers):
+        """Log changes to these tokens (None for a queue reset) inside the caller's transaction"""
+        source = queue_index.instance_id
+        changes = [cls(token_number=token_number, source=source) for token_number in token_numbers]
+        if len(changes) == 1:
+            changes[0].save(force_insert=True)  # bulk_create would wrap the one INSERT in a transaction of its own
+        else:
+            cls.objects.bulk_create(changes)
+
+    @classmethod
+    def prune(cls, older_than):
+        """Delete changes older than `older_than` seconds; every process has long applied them"""
+        cutoff = timezone.now() - timedelta(seconds=older_than)
+        return cls.objects.filter(created_at__lt=cutoff).delete()[0]
+
+
+class LeaderLease(models.Model):
+    """Which process may run a singleton job, such as the auto assigner, until expires_at.
+
+    The holder renews the lease on every heartbeat; once it lapses any
+    standby may take it over (see leadership.Leadership).
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    holder = models.CharField(max_length=100, blank=True)
+    term = models.PositiveIntegerField(default=0)  # bumped on every change of holder
+    acquired_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} held by {self.holder or 'nobody'}"
+
+class HourlyRollup(models.Model):
+    """Token activity in one local hour for one service category, rebuilt by refresh_reports.
+
+    Each event counts in the hour it happened: issue and abandonment in the
+    hour the token was issued, waits in the hour it was called, service
+    times in the hour it was completed. The histograms hold counts per
+    reporting.BUCKETS bucket, so percentiles can be merged across any range.
+    """
+    day = models.DateField()
+    hour = models.PositiveSmallIntegerField()
+    category = models.ForeignKey(ServiceCategory, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    issued = models.PositiveIntegerField(default=0)
+    called = models.PositiveIntegerField(default=0)
+    served = models.PositiveIntegerField(default=0)
+    abandoned = models.PositiveIntegerField(default=0)  # never called: closed without service, or still waiting when the day ended
+    timed_out = models.PositiveIntegerField(default=0)  # completed by the MAX_SERVING_TIME sweep
+    wait_seconds = models.FloatField(default=0)
+    service_seconds = models.FloatField(default=0)  # timed-out tokens excluded
+    wait_histogram = models.JSONField(default=list)
+    service_histogram = models.JSONField(default=list)
+    refreshed_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['day', 'hour'], name='rollup_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.hour:02d}:00 ({self.category or 'General'})"
+
+
+class CounterRollup(models.Model):
+    """Tokens completed at one counter in one local hour, and the seconds it spent serving"""
+    day = models.DateField()
+    hour = models.PositiveSmallIntegerField()
+    counter = models.ForeignKey(ServiceCounter, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    served = models.PositiveIntegerField(default=0)
+    busy_seconds = models.FloatField(default=0)  # service split across the hours it spanned
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['day', 'hour'], name='counter_rollup_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.hour:02d}:00 ({self.counter or 'removed counter'})"
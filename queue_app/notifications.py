@@ -0,0 +1,123 @@
+from datetime import timedelta
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .estimator import estimate_wait
+from .models import Token, Broadcast, OutboxMessage
+from .queue_state import queue_index
+from .sms import enqueue_sms
+
+logger = logging.getLogger(__name__)
+
+
+def confirmation_message(token_number, customer_name):
+    """First SMS a customer gets after their token is issued"""
+    return (
+        f"Hi {customer_name}, your token #{token_number} is confirmed. "
+#        f"Counters will be allotted soon. Estimated wait: {est_wait} minutes. "
+        f"You will receive an update when a counter is assigned."
+        f"Track your status at /status/{token_number}/"
+    )
+
+
+def completed_message(token_number, completed_at):
+    """Thank-you SMS once a token has been served, whether staff or the timeout sweep completed it"""
+    completed_time = timezone.localtime(completed_at).strftime('%H:%M')
+    return (
+        f"Your token #{token_number} has been served and collected at {completed_time}. "
+        f"Thank you for visiting!"
+    )
+
+
+def notify_counter_assigned(token, counter):
+    """Tell a customer which counter is now serving their token"""
+    if not token.phone_number:
+        return
+    start_time = timezone.localtime(timezone.now()).strftime('%H:%M')
+    message = (
+        f"Hi {token.customer_name}, your token #{token.token_number} "
+        f"is now being served at counter {counter.name}. "
+        f"Estimated service start time: {start_time}. Please proceed soon."
+    )
+    enqueue_sms(token.phone_number, message)
+
+
+def notify_token_completed(token):
+    """Let the next servable token get ready and thank the customer just served"""
+    next_possible = Token.get_next_servable()
+    if next_possible and next_possible.phone_number:
+        # Estimate wait time for the next_possible token and attach expected time
+        tokens_ahead_np = queue_index.tokens_ahead(next_possible.token_number)
+        est_wait_np = estimate_wait(tokens_ahead_np)
+        expected_time = (timezone.localtime(timezone.now()) + timedelta(minutes=est_wait_np)).strftime('%H:%M')
+        message = (
+            f"Update for token #{next_possible.token_number}: a counter will be allotted soon. "
+            f"Estimated wait: {est_wait_np} minutes (approx at {expected_time}). Please be ready to proceed to the waiting area."
+        )
+        enqueue_sms(next_possible.phone_number, message)
+
+    # Notify the token owner that their order has been served/collected
+    if token.phone_number:
+        enqueue_sms(token.phone_number, completed_message(token.token_number, token.completed_serving or timezone.now()))
+
+
+def all_busy_message(token_number, customer_name):
+    return (
+        f"Dear {customer_name}, all counters are currently busy. "
+        f"You’ll be notified once a counter is free."
+    )
+
+
+def broadcast_to_waiting(kind, build_message):
+    """Queue one status SMS for every waiting token that has a phone number.
+
+    Recipients are read as plain tuples, and the messages are written to the
+    outbox with one bulk insert; the dispatch_sms worker delivers them.
+    A token is skipped if it already got a `kind` broadcast within
+    BROADCAST_DEDUP_WINDOW seconds, or any broadcast within
+    BROADCAST_MIN_INTERVAL seconds.
+
+    `build_message(token_number, customer_name)` returns the message text.
+    Returns the Broadcast, or None when SMS is disabled or nobody is due one.
+    """
+    if not settings.SMS_ENABLED:
+        return None
+
+    now = timezone.now()
+    dedup_since = now - timedelta(seconds=settings.BROADCAST_DEDUP_WINDOW)
+    rate_since = now - timedelta(seconds=settings.BROADCAST_MIN_INTERVAL)
+
+    recipients = Token.waiting().exclude(phone_number__isnull=True).exclude(phone_number='').values_list(
+        'token_number', 'customer_name', 'phone_number'
+    )
+    # Only recent broadcast messages are scanned, never the whole outbox
+    recently_notified = set(
+        OutboxMessage.objects.filter(broadcast__isnull=False, created_at__gte=min(dedup_since, rate_since))
+        .filter(Q(broadcast__kind=kind, created_at__gte=dedup_since) | Q(created_at__gte=rate_since))
+        .values_list('token_number', flat=True)
+    )
+
+    messages, skipped = [], 0
+    for token_number, customer_name, phone_number in recipients:
+        if token_number in recently_notified:
+            skipped += 1
+            continue
+        messages.append(OutboxMessage(
+            phone_number=phone_number,
+            body=build_message(token_number, customer_name),
+            token_number=token_number,
+        ))
+    if not messages:
+        logger.info(f"{kind} broadcast skipped: all {skipped} recipients recently notified")
+        return None
+
+    with transaction.atomic():
+        broadcast = Broadcast.objects.create(kind=kind, recipients=len(messages), skipped=skipped)
+        for message in messages:
+            message.broadcast = broadcast
+        OutboxMessage.objects.bulk_create(messages, batch_size=500)
+    return broadcast
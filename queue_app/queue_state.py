@@ -0,0 +1,651 @@
+from bisect import bisect_left, bisect_right, insort
+import asyncio
+import heapq
+import logging
+import threading
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from .dashboard import invalidate_dashboard
+from .snapshot import SNAPSHOT_CACHE, invalidate_queue_snapshot
+
+logger = logging.getLogger(__name__)
+
+ALL_QUEUES = object()  # current_head() across every category
+SYNC_BATCH = 1000  # QueueChange rows read per query by sync()
+LOCAL_CACHES = (LocMemCache, FileBasedCache)  # cache backends other nodes cannot see
+
+
+class QueueStateIndex:
+    """In-memory view of the unserved tokens, kept current on issue/start/complete.
+
+    Answers "who is at the head" and "how many tokens are ahead of N" without
+    touching the database, both overall and per service category (each
+    category's queue is its own list in schedule order, with None for
+    tokens that have no category). Each queue also keeps a heap of its
+    waiting tokens keyed by schedule_key, so the assigner can pick the next
+    tokens in O(log n). The index is rebuilt lazily and compared against
+    the database every QUEUE_STATE_CHECK_INTERVAL seconds, which also picks up
+    changes made by other processes (e.g. the auto assigner). In between,
+    sync() applies the changes other processes logged in QueueChange every
+    QUEUE_SYNC_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._unserved = _SortedList()  # token numbers with is_served=False
+        self._serving = set()  # subset of _unserved that has started serving
+        self._queue_of = {}  # unserved token number -> (category id, schedule key)
+        self._queues = {}  # category id -> _SortedList of (schedule key, token number) of unserved tokens
+        self._heaps = {}  # category id -> heap of (schedule key, token number); stale entries skipped lazily
+        self._high_water = 0  # highest token number ever indexed
+        self._gap = None  # (lowest number catch_up skipped over, when that last changed)
+        self._change_id = 0  # last QueueChange applied
+        self._change_gap = None  # like _gap, for QueueChange ids
+        self._checked_at = None
+        self._synced_at = None
+        self._refresh_scheduled = False
+        self._loop_waiters = {}  # event loop -> future resolved on the next change (async status streams)
+        # Bumped on every change; the instance id keeps versions from
+        # different processes from being mistaken for one another
+        self._version = 0
+        self.instance_id = uuid.uuid4().hex[:8]
+
+    def _bump(self):
+        self._version += 1
+        self._changed.notify_all()
+        for loop, waiter in self._loop_waiters.items():
+            try:
+                loop.call_soon_threadsafe(_resolve, waiter)
+            except RuntimeError:
+                pass  # the loop has been closed
+        self._loop_waiters.clear()
+
+    def _load(self):
+        from .models import QueueChange, Token
+        # Read before the tokens: changes committed meanwhile get synced again rather than skipped
+        change_id = QueueChange.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        unserved, serving, queue_of = [], set(), {}
+        rows = Token.objects.filter(is_served=False).order_by('token_number').values_list(
+            'token_number', 'started_serving', 'category_id', 'schedule_key'
+        )
+        for token_number, started_serving, category_id, schedule_key in rows:
+            unserved.append(token_number)
+            queue_of[token_number] = (category_id, schedule_key.timestamp())
+            if started_serving is not None:
+                serving.add(token_number)
+        return unserved, serving, queue_of, change_id
+
+    def _replace(self, unserved, serving, queue_of, change_id):
+        queues, heaps = {}, {}
+        for token_number in unserved:
+            category_id, key = queue_of[token_number]
+            queues.setdefault(category_id, []).append((key, token_number))
+            if token_number not in serving:
+                heaps.setdefault(category_id, []).append((key, token_number))
+        queues = {category_id: _SortedList(sorted(queue)) for category_id, queue in queues.items()}
+        for heap in heaps.values():
+            heapq.heapify(heap)
+        self._unserved, self._serving = _SortedList(unserved), serving
+        self._queue_of, self._queues, self._heaps = queue_of, queues, heaps
+        if unserved:
+            self._high_water = max(self._high_water, unserved[-1])
+        self._change_id = max(self._change_id, change_id)
+        self._checked_at = self._synced_at = time.monotonic()
+
+    def rebuild(self):
+        """Reload the index from the database"""
+        loaded = self._load()
+        with self._lock:
+            self._replace(*loaded)
+            self._bump()
+
+    def check(self, repair=True):
+        """Compare the index with the database and return the differences.
+
+        The result maps 'missing' (unserved in the DB but not indexed),
+        'extra' (indexed but no longer unserved), 'serving' (tokens whose
+        serving state disagrees) and 'queue' (tokens filed under the wrong
+        category or schedule position) to sets of token numbers.
+        """
+        unserved, serving, queue_of, change_id = self._load()
+        with self._lock:
+            indexed = set(self._unserved)
+            db_unserved = set(unserved)
+            drift = {
+                'missing': db_unserved - indexed,
+                'extra': indexed - db_unserved,
+                'serving': serving ^ (self._serving & db_unserved),
+                'queue': {n for n in db_unserved & indexed if self._queue_of[n] != queue_of[n]},
+            }
+            if repair:
+                self._replace(unserved, serving, queue_of, change_id)
+                if any(drift.values()):
+                    self._bump()
+        if any(drift.values()):
+            logger.warning(f"Queue state index drifted from database: {drift}")
+        return drift
+
+    def _stale(self):
+        return self._checked_at is None or time.monotonic() - self._checked_at > _check_interval()
+
+    def _sync_due(self):
+        interval = _sync_interval()
+        return bool(interval) and self._synced_at is not None and time.monotonic() - self._synced_at >= interval
+
+    def _ensure_fresh(self):
+        if not (self._stale() or self._sync_due()):
+            return
+        if running_in_event_loop():
+            # Never block an event loop on the reload: it runs in a worker
+            # thread, and async views await arefresh() before reading
+            if not self._refresh_scheduled:
+                self._refresh_scheduled = True
+                asyncio.get_running_loop().run_in_executor(None, self._refresh)
+            return
+        self._refresh()
+
+    def _refresh(self):
+        try:
+            if self._checked_at is None:
+                self.rebuild()
+            elif self._stale():
+                self.check(repair=True)
+            elif self._sync_due():
+                self.sync()
+        finally:
+            self._refresh_scheduled = False
+
+    async def arefresh(self):
+        """Load, re-check or sync the index off the event loop if it is due, so the reads after it never query"""
+        if self._stale() or self._sync_due():
+            await sync_to_async(self._refresh)()
+
+    def sync(self):
+        """Apply the queue changes other processes logged in QueueChange since the last sync.
+
+        Reads the log on its primary key, then the current state of the
+        tokens it names, so the index ends up matching the database whatever
+        order the changes came in. Changes made by this process are skipped:
+        its on_* hooks applied them at commit. A logged queue reset reloads
+        the whole index. Caches that only this process or node can see are
+        retired too, since the process making a change can only retire its
+        own. Gaps in the log are rescanned as in catch_up(). Returns the
+        number of tokens whose indexed state changed, plus one for a reset.
+        """
+        from .models import QueueChange, Token
+        with self._lock:
+            if self._checked_at is None:
+                return 0  # not loaded yet; the first read loads everything
+            after = self._change_id if self._change_gap is None else self._change_gap[0] - 1
+            self._synced_at = time.monotonic()
+        # With no change seen yet (an empty log at load) ids can start anywhere
+        expected, missing = (after + 1 if after else None), None
+        seen, changed, reset = 0, 0, False
+        while True:
+            rows = list(QueueChange.objects.filter(id__gt=after).order_by('id').values_list(
+                'id', 'token_number', 'source'
+            )[:SYNC_BATCH])
+            token_numbers = set()
+            for change_id, token_number, source in rows:
+                if missing is None and expected is not None and change_id != expected:
+                    missing = expected
+                expected = change_id + 1
+                if source == self.instance_id:
+                    continue
+                if token_number is None:
+                    reset = True
+                else:
+                    token_numbers.add(token_number)
+            if token_numbers and not reset:
+                states = {
+                    row[0]: row[1:] for row in Token.objects.filter(pk__in=token_numbers).values_list(
+                        'token_number', 'is_served', 'started_serving', 'category_id', 'schedule_key'
+                    )
+                }
+                with self._lock:
+                    for token_number in token_numbers:
+                        # Rescanning a gap reads changes applied before; only count real ones
+                        version = self._version
+                        self._apply(token_number, states.get(token_number))
+                        changed += self._version != version
+            seen += len(token_numbers)
+            if len(rows) < SYNC_BATCH or reset:
+                break
+            after = rows[-1][0]
+        with self._lock:
+            if expected is not None:
+                self._change_id = max(self._change_id, expected - 1)
+            self._change_gap = _next_gap(self._change_gap, missing)
+            if reset:
+                self._high_water = 0  # numbering restarted
+                self._gap = None
+        if reset:
+            self.rebuild()
+        if seen or reset:
+            _invalidate_local_caches()  # an edit that left the queue alone still shows on the dashboard
+        return changed + reset
+
+    def _apply(self, token_number, state):
+        # Bring one token in line with its row: (is_served, started_serving, category_id, schedule_key), or None once deleted
+        if state is None or state[0]:
+            self.on_complete(token_number)
+            return
+        started_serving, category_id, schedule_key = state[1:]
+        filed = self._queue_of.get(token_number)
+        if filed is not None and filed != (category_id, schedule_key.timestamp()):
+            self.on_complete(token_number)  # priority, slot or category edited: file it again
+        self.on_issue(token_number, category_id, schedule_key)
+        if started_serving is not None:
+            self.on_start(token_number)
+
+    def catch_up(self):
+        """Index tokens issued by other processes since the last one seen here.
+
+        One query on the primary key, so a process that acts on the index
+        (the auto assigner) sees new tokens without waiting for the next
+        full check.
+
+        Numbers can commit out of order: PostgreSQL transactions finish in any
+        order, and bulk imports fill a reserved block below walk-ins issued
+        meanwhile. So the scan restarts from the lowest number it skipped,
+        until that number shows up or a full check is due anyway.
+        """
+        from .models import Token
+        with self._lock:
+            self._ensure_fresh()
+            after = self._high_water if self._gap is None else self._gap[0] - 1
+        rows = Token.objects.filter(
+            is_served=False, started_serving__isnull=True, token_number__gt=after
+        ).order_by('token_number').values_list('token_number', 'category_id', 'schedule_key')
+        # Before any number has been seen (e.g. every token was served or
+        # archived at load) numbering can be anywhere: nothing is missing yet
+        expected, missing = (after + 1 if after else None), None
+        for token_number, category_id, schedule_key in rows:
+            if missing is None and expected is not None and token_number != expected:
+                missing = expected
+            expected = token_number + 1
+            self.on_issue(token_number, category_id, schedule_key)
+        with self._lock:
+            self._gap = _next_gap(self._gap, missing)
+
+    def clear(self):
+        with self._lock:
+            self._replace([], set(), {}, self._change_id)
+            self._high_water = 0  # reset_queue restarts numbering
+            self._gap = None
+            self._bump()
+
+    # Updates -------------------------------------------------------------
+
+    def on_issue(self, token_number, category_id=None, schedule_key=None):
+        with self._lock:
+            if self._checked_at is None:
+                return  # not loaded yet; the first read will see this token
+            if token_number in self._queue_of:
+                return
+            key = schedule_key.timestamp() if schedule_key is not None else time.time()
+            self._queue_of[token_number] = (category_id, key)
+            self._high_water = max(self._high_water, token_number)
+            self._unserved.add(token_number)
+            self._queues.setdefault(category_id, _SortedList()).add((key, token_number))
+            heapq.heappush(self._heaps.setdefault(category_id, []), (key, token_number))
+            self._bump()
+
+    def on_save(self, token_number, is_served, started_serving, category_id, schedule_key):
+        """Bring an indexed token in line with its saved row, filing it again if its priority, slot or category changed"""
+        with self._lock:
+            if self._checked_at is None:
+                return
+            self._apply(token_number, (is_served, started_serving, category_id, schedule_key))
+
+    def on_start(self, token_number):
+        with self._lock:
+            if self._checked_at is None:
+                return
+            if token_number in self._queue_of and token_number not in self._serving:
+                self._serving.add(token_number)  # its heap entry is now stale
+                self._bump()
+
+    def on_complete(self, token_number):
+        with self._lock:
+            if self._checked_at is None:
+                return
+            if token_number not in self._queue_of:
+                return
+            category_id, key = self._queue_of.pop(token_number)
+            self._unserved.discard(token_number)
+            queue = self._queues[category_id]
+            queue.discard((key, token_number))
+            if not queue:
+                del self._queues[category_id]
+            self._serving.discard(token_number)
+            self._bump()
+
+    # Reads ---------------------------------------------------------------
+
+    def current_head(self, category_id=ALL_QUEUES):
+        """Front of one category's queue (or the lowest unserved token overall), or None when empty"""
+        with self._lock:
+            self._ensure_fresh()
+            if category_id is ALL_QUEUES:
+                return self._unserved.first()
+            queue = self._queues.get(category_id)
+            return queue.first()[1] if queue else None
+
+    def tokens_ahead(self, token_number):
+        """Number of unserved tokens ahead of token_number in its own queue"""
+        with self._lock:
+            self._ensure_fresh()
+            return self._position(token_number)[1]
+
+    def tokens_ahead_in(self, category_id, token_number, schedule_key):
+        """Unserved tokens in category_id's queue ahead of a token not indexed yet"""
+        with self._lock:
+            self._ensure_fresh()
+            queue = self._queues.get(category_id)
+            return queue.bisect_left((schedule_key.timestamp(), token_number)) if queue else 0
+
+    def position(self, token_number):
+        """(front of its queue, tokens ahead of it, still unserved) read under one lock"""
+        with self._lock:
+            self._ensure_fresh()
+            return self._position(token_number)
+
+    def _position(self, token_number):
+        if token_number not in self._queue_of:
+            # Tokens no longer queued are measured against the whole queue
+            ahead = self._unserved.bisect_left(token_number)
+            return self._unserved.first(), ahead, False
+        category_id, key = self._queue_of[token_number]
+        queue = self._queues[category_id]
+        return queue.first()[1], queue.bisect_left((key, token_number)), True
+
+    def servable(self, queues=None, threshold=None, now=None):
+        """Each queue's fairness window, merged in schedule order.
+
+        Mirrors Token.servable(): the first `threshold` + 1 due waiting
+        tokens of every queue. Costs O(k log n) per queue, peeking at the
+        top of its heap. Returns (schedule key, token number, category id)
+        tuples.
+        """
+        from .models import Token
+        if threshold is None:
+            threshold = Token.fairness_threshold()
+        now = time.time() if now is None else now
+        window = []
+        with self._lock:
+            self._ensure_fresh()
+            for category_id, heap in self._heaps.items():
+                if queues is not None and category_id not in queues:
+                    continue
+                taken = []
+                while heap and len(taken) <= threshold:
+                    key, token_number = heap[0]
+                    if (self._queue_of.get(token_number) != (category_id, key)
+                            or token_number in self._serving
+                            or (taken and taken[-1] == heap[0])):
+                        # Started, completed or re-filed since it was pushed; a token
+                        # re-filed back to its old place has a duplicate entry next to it
+                        heapq.heappop(heap)
+                        continue
+                    if key > now:
+                        break  # appointments not due yet; everything below is later still
+                    taken.append(heapq.heappop(heap))
+                for entry in taken:
+                    heapq.heappush(heap, entry)
+                    window.append((entry[0], entry[1], category_id))
+        window.sort()
+        return window
+
+    def queues(self):
+        """Map each category id with unserved tokens to (front of queue, unserved count)"""
+        with self._lock:
+            self._ensure_fresh()
+            return {category_id: (queue.first()[1], len(queue)) for category_id, queue in self._queues.items()}
+
+    def unserved_count(self):
+        with self._lock:
+            self._ensure_fresh()
+            return len(self._unserved)
+
+    def waiting_count(self):
+        """Unserved tokens that have not been called to a counter yet"""
+        with self._lock:
+            self._ensure_fresh()
+            return len(self._unserved) - len(self._serving)
+
+    def unserved_after(self, token_number, limit):
+        """Up to `limit` unserved token numbers greater than token_number"""
+        with self._lock:
+            self._ensure_fresh()
+            return self._unserved.after(token_number, limit)
+
+    def is_unserved(self, token_number):
+        with self._lock:
+            self._ensure_fresh()
+            return token_number in self._queue_of
+
+    def version(self):
+        with self._lock:
+            self._ensure_fresh()
+            return self._version
+
+    def etag(self):
+        """Changes whenever anything a status page shows may have changed"""
+        return f"{self.instance_id}-{self.version()}"
+
+    def wait_for_change(self, version, timeout):
+        """Block until the index moves past `version` (or `timeout` passes).
+
+        All waiting status streams share one condition variable, so a single
+        change fans out to every subscriber. They wake every
+        QUEUE_SYNC_INTERVAL seconds as well, to sync changes made by other
+        processes. Returns the current version.
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            self._ensure_fresh()
+            while version is not None and self._version == version:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._changed.wait(min(remaining, _sync_interval() or remaining))
+                self._ensure_fresh()
+            return self._version
+
+    async def await_change(self, version, timeout):
+        """wait_for_change() for async views: waits without holding a thread.
+
+        Every coroutine waiting on the same event loop shares one future,
+        resolved from whichever thread bumps the version.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            await self.arefresh()
+            remaining = deadline - loop.time()
+            with self._lock:
+                if version is None or self._version != version or remaining <= 0:
+                    return self._version
+                waiter = self._loop_waiters.get(loop)
+                if waiter is None or waiter.done():
+                    waiter = self._loop_waiters[loop] = loop.create_future()
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), min(remaining, _sync_interval() or remaining))
+            except asyncio.TimeoutError:
+                pass
+
+
+def _check_interval():
+    return getattr(settings, 'QUEUE_STATE_CHECK_INTERVAL', 30)
+
+
+def _sync_interval():
+    return getattr(settings, 'QUEUE_SYNC_INTERVAL', 1)
+
+
+def _next_gap(gap, missing):
+    """(lowest number a scan skipped over, since when) for the next scan to start from.
+
+    Dropped once that number shows up, or after a check interval: by then
+    it was rolled back or served, and the full check covers it anyway.
+    """
+    if missing is None:
+        return None
+    now = time.monotonic()
+    if gap is None or gap[0] != missing:
+        return (missing, now)
+    if now - gap[1] > _check_interval():
+        return None
+    return gap
+
+
+def _invalidate_local_caches():
+    # Another process changed the queue; it could only retire the caches it shares with us
+    if isinstance(caches[SNAPSHOT_CACHE], LOCAL_CACHES):
+        invalidate_queue_snapshot()
+    if isinstance(caches['default'], LOCAL_CACHES):
+        invalidate_dashboard()
+
+
+def running_in_event_loop():
+    """True when called from a coroutine, where blocking database access is not allowed"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _SortedList:
+    """Sorted items kept in buckets of LOAD to 2 * LOAD, for the queue index's ordered queues.
+
+    A plain sorted list pays O(n) to delete near its front, which is where
+    completions land. Here adding or removing an item shifts one bucket
+    and updates a Fenwick tree of bucket lengths, so both changes and
+    "how many items are ahead" counts are O(log n + LOAD) however long the
+    queue grows. The tree is rebuilt, O(n / LOAD), only when a bucket
+    splits or empties.
+    """
+    LOAD = 512
+    __slots__ = ('_buckets', '_maxes', '_len', '_tree')
+
+    def __init__(self, items=()):
+        """`items` must already be sorted"""
+        items = list(items)
+        self._buckets = [items[i:i + self.LOAD] for i in range(0, len(items), self.LOAD)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._len = len(items)
+        self._tree = None  # Fenwick tree of bucket lengths, built on first count
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for bucket in self._buckets:
+            yield from bucket
+
+    def first(self):
+        return self._buckets[0][0] if self._buckets else None
+
+    def add(self, item):
+        if not self._buckets:
+            self._buckets, self._maxes = [[item]], [item]
+            self._len = 1
+            self._tree = None
+            return
+        k = bisect_left(self._maxes, item)
+        if k == len(self._maxes):
+            # Tokens are nearly always issued in order, so this is usually an append
+            k -= 1
+            self._buckets[k].append(item)
+            self._maxes[k] = item
+        else:
+            insort(self._buckets[k], item)
+        self._len += 1
+        bucket = self._buckets[k]
+        if len(bucket) > 2 * self.LOAD:
+            self._buckets[k:k + 1] = [bucket[:self.LOAD], bucket[self.LOAD:]]
+            self._maxes[k:k + 1] = [bucket[self.LOAD - 1], bucket[-1]]
+            self._tree = None
+        else:
+            self._resize(k, 1)
+
+    def discard(self, item):
+        k = bisect_left(self._maxes, item)
+        if k == len(self._maxes):
+            return
+        bucket = self._buckets[k]
+        i = bisect_left(bucket, item)
+        if bucket[i] != item:
+            return
+        del bucket[i]
+        self._len -= 1
+        if not bucket:
+            del self._buckets[k]
+            del self._maxes[k]
+            self._tree = None
+            return
+        if i == len(bucket):
+            self._maxes[k] = bucket[-1]
+        self._resize(k, -1)
+
+    def bisect_left(self, item):
+        """Number of items less than `item`"""
+        k = bisect_left(self._maxes, item)
+        if k == len(self._maxes):
+            return self._len
+        return self._count_before(k) + bisect_left(self._buckets[k], item)
+
+    def _resize(self, k, delta):
+        tree = self._tree
+        if tree is None:
+            return
+        k += 1
+        while k < len(tree):
+            tree[k] += delta
+            k += k & -k
+
+    def _count_before(self, k):
+        """Items in the buckets before bucket k"""
+        tree = self._tree
+        if tree is None:
+            tree = self._tree = [0] + [len(bucket) for bucket in self._buckets]
+            for i in range(1, len(tree)):
+                parent = i + (i & -i)
+                if parent < len(tree):
+                    tree[parent] += tree[i]
+        count = 0
+        while k > 0:
+            count += tree[k]
+            k -= k & -k
+        return count
+
+    def after(self, item, limit):
+        """Up to `limit` items greater than `item`, in order"""
+        k = bisect_right(self._maxes, item)
+        if k == len(self._buckets):
+            return []
+        bucket = self._buckets[k]
+        found = bucket[bisect_right(bucket, item):]
+        for bucket in self._buckets[k + 1:]:
+            if len(found) >= limit:
+                break
+            found.extend(bucket)
+        return found[:limit]
+
+
+queue_index = QueueStateIndex()
@@ -0,0 +1,334 @@
+from datetime import datetime, time as dt_time, timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedToken, CounterRollup, HourlyRollup, ServiceCategory, ServiceCounter, Token
+
+try:
+    import numpy as np
+    import pandas as pd
+except ImportError:  # optional: only the DataFrame export needs them
+    np = pd = None
+
+# Upper bounds in seconds of the wait and service-time histogram buckets; one more bucket holds the rest
+BUCKETS = (15, 30, 60, 90, 120, 180, 240, 300, 420, 600, 900, 1200, 1800, 2400, 3600, 5400, 7200, 10800, 14400)
+PERCENTILES = (50, 90, 95, 99)
+# Tokens issued up to this long before a day still have their calls and completions counted in it
+CARRY_OVER = timedelta(days=1)
+ROLLUP_FIELDS = ('issued', 'called', 'served', 'abandoned', 'timed_out', 'wait_seconds', 'service_seconds')
+EXPORT_FIELDS = (
+    'token_number', 'category_id', 'counter_id', 'priority', 'appointment_at', 'issued_at', 'started_serving',
+    'completed_serving',
+)
+
+
+def day_bounds(day):
+    """Aware datetimes of a local day's first moment and the next day's"""
+    start = timezone.make_aware(datetime.combine(day, dt_time.min))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), dt_time.min))
+
+
+def _bucket(seconds):
+    for i, bound in enumerate(BUCKETS):
+        if seconds < bound:
+            return i
+    return len(BUCKETS)
+
+
+def histogram_percentile(counts, pct):
+    """Seconds below which `pct` percent of a bucket histogram lies, interpolated within its bucket"""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = total * pct / 100
+    seen = 0
+    for i, count in enumerate(counts):
+        if count and seen + count >= rank:
+            lower = BUCKETS[i - 1] if i else 0
+            if i == len(BUCKETS):
+                return float(lower)  # open-ended last bucket
+            return lower + (BUCKETS[i] - lower) * (rank - seen) / count
+        seen += count
+    return float(BUCKETS[-1])
+
+
+def _merge(into, counts):
+    if not into:
+        into.extend([0] * (len(BUCKETS) + 1))
+    for i, count in enumerate(counts):
+        into[i] += count
+
+
+class _Hour:
+    __slots__ = ROLLUP_FIELDS + ('wait_histogram', 'service_histogram')
+
+    def __init__(self):
+        for field in ROLLUP_FIELDS:
+            setattr(self, field, 0)
+        self.wait_histogram = [0] * (len(BUCKETS) + 1)
+        self.service_histogram = [0] * (len(BUCKETS) + 1)
+
+
+def _day_tokens(start, end):
+    for model in (Token, ArchivedToken):
+        rows = model.objects.filter(issued_at__gte=start - CARRY_OVER, issued_at__lt=end).order_by()
+        yield from rows.values_list(*EXPORT_FIELDS).iterator(chunk_size=2000)
+
+
+def _busy_hours(counters, counter_id, started, completed, start, end):
+    # Split a service across the local hours it spanned, keeping the part inside the day
+    t, until = max(started, start), min(completed, end)
+    while t < until:
+        hour_end = min(until, timezone.localtime(t).replace(minute=0, second=0, microsecond=0) + timedelta(hours=1))
+        key = (counter_id, timezone.localtime(t).hour)
+        counters.setdefault(key, [0, 0.0])[1] += (hour_end - t).total_seconds()
+        t = hour_end
+
+
+def rollup_day(day, now=None):
+    """Rebuild one local day's HourlyRollup and CounterRollup rows from live and archived tokens.
+
+    Reads the tokens issued that day and the day before, and replaces the
+    day's rows in one transaction. Returns the number of rollup rows written.
+    """
+    now = now or timezone.now()
+    start, end = day_bounds(day)
+    day_over = now >= end
+    max_service = settings.MAX_SERVING_TIME
+    hours, counters = {}, {}
+
+    def hour_of(moment, category_id):
+        key = (timezone.localtime(moment).hour, category_id)
+        if key not in hours:
+            hours[key] = _Hour()
+        return hours[key]
+
+    for _, category_id, counter_id, priority, slot, issued, started, completed in _day_tokens(start, end):
+        if issued >= start:
+            row = hour_of(issued, category_id)
+            row.issued += 1
+            if started is None and (completed is not None or day_over):
+                row.abandoned += 1
+        if started is None:
+            continue
+        if start <= started < end:
+            row = hour_of(started, category_id)
+            due = max(issued, Token.schedule_key_for(issued, priority, slot))
+            wait = max(0.0, (started - due).total_seconds())
+            row.called += 1
+            row.wait_seconds += wait
+            row.wait_histogram[_bucket(wait)] += 1
+        if completed is None:
+            completed = min(now, started + timedelta(seconds=max_service))  # still at the counter
+        elif start <= completed < end:
+            row = hour_of(completed, category_id)
+            row.served += 1
+            service = (completed - started).total_seconds()
+            if service >= max_service:
+                row.timed_out += 1
+            elif service > 0:
+                row.service_seconds += service
+                row.service_histogram[_bucket(service)] += 1
+            counters.setdefault((counter_id, timezone.localtime(completed).hour), [0, 0.0])[0] += 1
+        _busy_hours(counters, counter_id, started, completed, start, end)
+
+    refreshed_at = timezone.now()
+    with transaction.atomic():
+        HourlyRollup.objects.filter(day=day).delete()
+        CounterRollup.objects.filter(day=day).delete()
+        HourlyRollup.objects.bulk_create([
+            HourlyRollup(
+                day=day, hour=hour, category_id=category_id, refreshed_at=refreshed_at,
+                wait_histogram=row.wait_histogram, service_histogram=row.service_histogram,
+                **{field: getattr(row, field) for field in ROLLUP_FIELDS},
+            )
+            for (hour, category_id), row in hours.items()
+        ])
+        CounterRollup.objects.bulk_create([
+            CounterRollup(day=day, hour=hour, counter_id=counter_id, served=served, busy_seconds=busy)
+            for (counter_id, hour), (served, busy) in counters.items()
+        ])
+    return len(hours) + len(counters)
+
+
+def first_history_day():
+    """Local day of the oldest live or archived token, or None without any"""
+    issued = [
+        model.objects.order_by('issued_at').values_list('issued_at', flat=True).first()
+        for model in (Token, ArchivedToken)
+    ]
+    issued = [t for t in issued if t is not None]
+    return timezone.localdate(min(issued)) if issued else None
+
+
+def refresh_rollups(first_day=None, last_day=None):
+    """Rebuild the rollups of each local day from first_day to last_day, oldest first.
+
+    By default only the last REPORTING_REFRESH_DAYS days up to today: older
+    days only change when their tokens are archived, which keeps them intact.
+    Returns the days refreshed.
+    """
+    last_day = last_day or timezone.localdate()
+    first_day = first_day or last_day - timedelta(days=settings.REPORTING_REFRESH_DAYS - 1)
+    days = []
+    day = first_day
+    while day <= last_day:
+        rollup_day(day)
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def _minutes(seconds):
+    return None if seconds is None else seconds / 60
+
+
+def _summary(count, seconds, histogram):
+    summary = {'mean': _minutes(seconds / count) if count else None}
+    for pct in PERCENTILES:
+        summary[f'p{pct}'] = _minutes(histogram_percentile(histogram, pct))
+    return summary
+
+
+def _group():
+    return {'issued': 0, 'served': 0, 'abandoned': 0, 'wait_histogram': []}
+
+
+def _add_to_group(group, row):
+    for field in ('issued', 'served', 'abandoned'):
+        group[field] += row[field]
+    _merge(group['wait_histogram'], row['wait_histogram'])
+
+
+def _group_figures(group):
+    figures = {field: group[field] for field in ('issued', 'served', 'abandoned')}
+    figures['wait_p50'] = _minutes(histogram_percentile(group['wait_histogram'], 50))
+    figures['wait_p95'] = _minutes(histogram_percentile(group['wait_histogram'], 95))
+    return figures
+
+
+def report(first_day, last_day, category=None):
+    """Queue figures for a range of local days, read from the rollup tables only.
+
+    `category` is a ServiceCategory id, or 0 for the general queue; None
+    covers every queue. Waits and service times are in minutes. Counter
+    utilisation is busy time over the hours in which any queue saw activity.
+    """
+    in_range = HourlyRollup.objects.filter(day__range=(first_day, last_day))
+    rows = in_range if category is None else in_range.filter(category_id=category or None)
+    totals = dict.fromkeys(ROLLUP_FIELDS, 0)
+    waits, services = [], []
+    days, categories = {}, {}
+    hours = [_group() for _ in range(24)]
+    for row in rows.values('day', 'hour', 'category_id', 'wait_histogram', 'service_histogram', *ROLLUP_FIELDS):
+        for field in ROLLUP_FIELDS:
+            totals[field] += row[field]
+        _merge(waits, row['wait_histogram'])
+        _merge(services, row['service_histogram'])
+        _add_to_group(hours[row['hour']], row)
+        _add_to_group(days.setdefault(row['day'], _group()), row)
+        _add_to_group(categories.setdefault(row['category_id'], _group()), row)
+
+    open_seconds = in_range.values_list('day', 'hour').distinct().count() * 3600
+    counters = {}
+    for counter_id, served, busy in CounterRollup.objects.filter(day__range=(first_day, last_day)).values_list(
+        'counter_id', 'served', 'busy_seconds'
+    ):
+        counter = counters.setdefault(counter_id, {'served': 0, 'busy_seconds': 0.0})
+        counter['served'] += served
+        counter['busy_seconds'] += busy
+    counter_names = dict(ServiceCounter.objects.values_list('id', 'name'))
+    category_names = dict(ServiceCategory.objects.values_list('id', 'name'))
+
+    return {
+        'first_day': first_day,
+        'last_day': last_day,
+        'refreshed_at': in_range.order_by('-refreshed_at').values_list('refreshed_at', flat=True).first(),
+        **totals,
+        'abandonment_rate': totals['abandoned'] / totals['issued'] if totals['issued'] else None,
+        'wait': _summary(totals['called'], totals['wait_seconds'], waits),
+        'service': _summary(totals['served'] - totals['timed_out'], totals['service_seconds'], services),
+        'hours': [{'hour': hour, **_group_figures(group)} for hour, group in enumerate(hours)],
+        'days': [{'day': day, **_group_figures(group)} for day, group in sorted(days.items())],
+        'categories': [
+            {'category': category_names.get(category_id, 'General') if category_id else 'General',
+             **_group_figures(group)}
+            for category_id, group in sorted(categories.items(), key=lambda item: -item[1]['issued'])
+        ],
+        'counters': [
+            {'counter': counter_names.get(counter_id, 'Removed counter'), **figures,
+             'utilisation': figures['busy_seconds'] / open_seconds if open_seconds else None}
+            for counter_id, figures in sorted(counters.items(), key=lambda item: -item[1]['busy_seconds'])
+        ],
+    }
+
+
+def _require_pandas():
+    if pd is None:
+        raise ImproperlyConfigured('DataFrame exports need pandas and NumPy: pip install pandas')
+
+
+def history_frame(first_day, last_day, chunk_size=50000):
+    """Every live and archived token issued in a range of local days, as a pandas DataFrame.
+
+    Rows are fetched in chunks of `chunk_size` and turned into columns
+    chunk by chunk, so long ranges never sit in memory as Python tuples.
+    Adds wait_seconds (from when the token was due to its call),
+    service_seconds and abandoned, matching the rollups.
+    """
+    _require_pandas()
+    start, _ = day_bounds(first_day)
+    _, end = day_bounds(last_day)
+    frames = []
+    for model in (Token, ArchivedToken):
+        rows = model.objects.filter(issued_at__gte=start, issued_at__lt=end).order_by().values_list(*EXPORT_FIELDS)
+        chunk = []
+        for row in rows.iterator(chunk_size=chunk_size):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                frames.append(_chunk_frame(chunk))
+                chunk = []
+        if chunk:
+            frames.append(_chunk_frame(chunk))
+    if not frames:
+        return pd.DataFrame(columns=EXPORT_FIELDS + ('wait_seconds', 'service_seconds', 'abandoned'))
+
+    frame = pd.concat(frames, ignore_index=True)
+    slot = frame['appointment_at'] - pd.Timedelta(seconds=settings.APPOINTMENT_HEAD_START)
+    schedule_key = slot.fillna(frame['issued_at']) - pd.to_timedelta(
+        frame['priority'] * settings.PRIORITY_HEAD_START, unit='s'
+    )
+    due = frame['issued_at'].where(frame['issued_at'] >= schedule_key, schedule_key)
+    frame['wait_seconds'] = (frame['started_serving'] - due).dt.total_seconds().clip(lower=0)
+    service = (frame['completed_serving'] - frame['started_serving']).dt.total_seconds()
+    frame['service_seconds'] = service.where(service < settings.MAX_SERVING_TIME)
+    day_ends = frame['issued_at'].dt.tz_convert(timezone.get_current_timezone_name()).dt.normalize() + pd.Timedelta(days=1)
+    frame['abandoned'] = frame['started_serving'].isna() & (
+        frame['completed_serving'].notna() | (day_ends <= pd.Timestamp(timezone.now()))
+    )
+    return frame.sort_values('issued_at', ignore_index=True)
+
+
+def _chunk_frame(rows):
+    frame = pd.DataFrame.from_records(rows, columns=EXPORT_FIELDS)
+    for column in ('appointment_at', 'issued_at', 'started_serving', 'completed_serving'):
+        frame[column] = pd.to_datetime(frame[column], utc=True)
+    for column in ('category_id', 'counter_id'):
+        frame[column] = frame[column].astype('Int64')  # nullable integers
+    frame['priority'] = frame['priority'].astype(np.int16)
+    return frame
+
+
+def rollup_frame(first_day, last_day):
+    """The HourlyRollup rows of a range of local days as a pandas DataFrame, histograms left out"""
+    _require_pandas()
+    fields = ('day', 'hour', 'category_id') + ROLLUP_FIELDS
+    rows = HourlyRollup.objects.filter(day__range=(first_day, last_day)).order_by('day', 'hour', 'category_id')
+    records = [
+        row[:-1] + (histogram_percentile(row[-1], 50), histogram_percentile(row[-1], 95))
+        for row in rows.values_list(*fields, 'wait_histogram')
+    ]
+    return pd.DataFrame.from_records(records, columns=fields + ('wait_p50', 'wait_p95'))
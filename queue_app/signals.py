@@ -0,0 +1,61 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .dashboard import invalidate_dashboard
+from .estimator import service_estimator
+from .models import QueueChange, Token, ServiceCounter
+from .queue_state import queue_index
+from .snapshot import invalidate_queue_snapshot
+from .wakeup import notify_assigner
+
+
+@receiver(post_save, sender=Token)
+def update_queue_index(sender, instance, created, **kwargs):
+    """Keep the in-memory queue index in step with saved tokens"""
+    token_number = instance.token_number
+    QueueChange.record([token_number])  # for the other processes
+    # Registered first, so a status stream woken by the index reads the new snapshot
+    transaction.on_commit(invalidate_queue_snapshot)
+    if created:
+        category_id, schedule_key = instance.category_id, instance.schedule_key
+        transaction.on_commit(lambda: queue_index.on_issue(token_number, category_id, schedule_key))
+        transaction.on_commit(notify_assigner)
+    else:
+        # Also re-files a token whose priority, slot or category was edited
+        state = (instance.is_served, instance.started_serving, instance.category_id, instance.schedule_key)
+        transaction.on_commit(lambda: queue_index.on_save(token_number, *state))
+
+
+@receiver(post_save, sender=ServiceCounter)
+def wake_assigner_for_free_counter(sender, instance, **kwargs):
+    """A counter that was created or freed can take a token straight away"""
+    if instance.is_available:
+        transaction.on_commit(notify_assigner)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_save, sender=ServiceCounter)
+def invalidate_dashboard_fragments(sender, **kwargs):
+    transaction.on_commit(invalidate_dashboard)
+
+
+@receiver(post_save, sender=Token)
+def record_service_time(sender, instance, created, **kwargs):
+    """Feed each completed service into the wait-time estimator"""
+    if instance.is_served and instance.started_serving and instance.completed_serving:
+        args = (instance.counter_id, instance.started_serving, instance.completed_serving)
+        transaction.on_commit(lambda: service_estimator.record(*args))
+
+
+@receiver(post_save, sender=ServiceCounter)
+def track_open_counter(sender, instance, **kwargs):
+    """Tell the wait-time estimator whether the counter is serving and when it last finished"""
+    state = (instance.pk, not instance.is_available, instance.last_token_completed)
+    transaction.on_commit(lambda: service_estimator.update_counters([state]))
+
+
+@receiver(post_delete, sender=ServiceCounter)
+def forget_closed_counter(sender, instance, **kwargs):
+    counter_id = instance.pk
+    transaction.on_commit(lambda: service_estimator.remove_counter(counter_id))
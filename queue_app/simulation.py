@@ -0,0 +1,396 @@
+from bisect import insort
+from datetime import datetime, time as dt_time, timedelta
+import heapq
+import math
+import random
+import time
+
+from django.conf import settings
+from django.db.models import Count
+from django.db.models.functions import ExtractHour
+from django.utils import timezone
+
+from .benchmarking import percentile
+
+try:
+    import numpy as np
+except ImportError:  # optional: the pure-Python paths give the same results, only slower
+    np = None
+
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+WAIT_PERCENTILES = (50, 90, 95, 99)
+
+
+class Workload:
+    """Tokens to push through the simulator, as parallel lists sorted by issue time.
+
+    Times are epoch seconds. `ready` is when a token joins its queue's
+    fairness window: its issue time, or for an appointment the moment its
+    schedule key comes due. `service` is how long a counter spends on it.
+    """
+
+    def __init__(self, issued, service, category, schedule_key):
+        order = sorted(range(len(issued)), key=issued.__getitem__)
+        self.issued = [float(issued[i]) for i in order]
+        self.service = [float(service[i]) for i in order]
+        self.category = [category[i] for i in order]
+        self.schedule_key = [float(schedule_key[i]) for i in order]
+        self.ready = [max(t, key) for t, key in zip(self.issued, self.schedule_key)]
+
+    def __len__(self):
+        return len(self.issued)
+
+
+def _schedule_keys(issued, priority, appointment_at):
+    # Token.schedule_key_for in epoch seconds
+    keys = []
+    for t, level, slot in zip(issued, priority, appointment_at):
+        key = slot - settings.APPOINTMENT_HEAD_START if slot is not None else t
+        keys.append(key - settings.PRIORITY_HEAD_START * level)
+    return keys
+
+
+def _history_rows(start, end):
+    from .models import ArchivedToken, Token
+    fields = ('issued_at', 'started_serving', 'completed_serving', 'category_id', 'priority', 'appointment_at')
+    rows = []
+    for model in (Token, ArchivedToken):
+        rows.extend(model.objects.filter(issued_at__gte=start, issued_at__lt=end).values_list(*fields))
+    return rows
+
+
+def _service_seconds(started, completed):
+    """Recorded service time, or None when the token was never completed at a counter"""
+    if started is None or completed is None:
+        return None
+    seconds = (completed - started).total_seconds()
+    if seconds <= 0:
+        return None
+    return min(seconds, settings.MAX_SERVING_TIME)  # timed-out tokens held the counter this long
+
+
+def _fallback_service():
+    from .estimator import service_estimator
+    return service_estimator.mean_service_seconds() or getattr(settings, 'PER_TOKEN_MINUTES', 2) * 60
+
+
+def history_workload(start, end):
+    """Replay tokens issued between two datetimes, live and archived.
+
+    Tokens without a recorded service time (still waiting, or completed
+    without being called) get one drawn from the ones that have it.
+    """
+    rows = _history_rows(start, end)
+    observed = [s for s in (_service_seconds(r[1], r[2]) for r in rows) if s is not None]
+    rng = random.Random(0)
+    fallback = _fallback_service()
+    issued, service, category, priority, appointment_at = [], [], [], [], []
+    for issued_at, started, completed, category_id, level, slot in rows:
+        seconds = _service_seconds(started, completed)
+        if seconds is None:
+            seconds = rng.choice(observed) if observed else fallback
+        issued.append(issued_at.timestamp())
+        service.append(seconds)
+        category.append(category_id)
+        priority.append(level)
+        appointment_at.append(slot.timestamp() if slot is not None else None)
+    return Workload(issued, service, category, _schedule_keys(issued, priority, appointment_at))
+
+
+def service_profile(days=28):
+    """(service seconds, category, priority) of recently completed tokens, for resampling"""
+    end = timezone.now()
+    profile = []
+    for _, started, completed, category_id, level, _ in _history_rows(end - timedelta(days=days), end):
+        seconds = _service_seconds(started, completed)
+        if seconds is not None:
+            profile.append((seconds, category_id, level))
+    return profile
+
+
+def arrival_profile(weekday, days=28):
+    """Mean tokens issued in each local hour (0-23) on one weekday over the last `days` days"""
+    from .models import ArchivedToken, Token
+    end = timezone.now()
+    start = end - timedelta(days=days)
+    counts = [0] * 24
+    week_day = (WEEKDAYS.index(weekday) + 1) % 7 + 1  # Django counts from Sunday = 1
+    for model in (Token, ArchivedToken):
+        rows = model.objects.filter(
+            issued_at__gte=start, issued_at__lt=end, issued_at__week_day=week_day
+        ).annotate(hour=ExtractHour('issued_at')).order_by().values('hour').annotate(n=Count('pk'))
+        for row in rows:
+            counts[row['hour']] += row['n']
+    first = timezone.localdate(start)
+    occurrences = sum(
+        1 for i in range((timezone.localdate(end) - first).days + 1)
+        if (first + timedelta(days=i)).weekday() == WEEKDAYS.index(weekday)
+    )
+    return [count / max(occurrences, 1) for count in counts]
+
+
+def synthetic_workload(hourly_rates, start, days=1, scale=1.0, profile=None, service_mean=None, seed=None):
+    """Poisson arrivals at `hourly_rates[h]` tokens per local hour h, for `days` days from `start`.
+
+    Each token's service time, category and priority are resampled from
+    `profile` (see service_profile) when given, otherwise every token is a
+    walk-in for the general queue with exponentially distributed service
+    times averaging `service_mean` seconds.
+    """
+    service_mean = service_mean or _fallback_service()
+    origin = start.timestamp()
+    if np is not None:
+        rng = np.random.default_rng(seed)
+        rates = np.tile(np.asarray(hourly_rates, dtype=float) * scale, days)
+        counts = rng.poisson(rates)
+        hour_starts = origin + 3600.0 * np.arange(len(rates))
+        issued = np.sort(np.repeat(hour_starts, counts) + rng.uniform(0, 3600, counts.sum()))
+        if profile:
+            picks = rng.integers(0, len(profile), len(issued))
+            service = [profile[i][0] for i in picks.tolist()]
+            category = [profile[i][1] for i in picks.tolist()]
+            priority = [profile[i][2] for i in picks.tolist()]
+        else:
+            service = rng.exponential(service_mean, len(issued)).tolist()
+            category = [None] * len(issued)
+            priority = [0] * len(issued)
+        issued = issued.tolist()
+    else:
+        rng = random.Random(seed)
+        issued = []
+        for hour in range(24 * days):
+            rate = hourly_rates[hour % 24] * scale
+            t = rng.expovariate(rate / 3600) if rate > 0 else 3600
+            while t < 3600:
+                issued.append(origin + 3600 * hour + t)
+                t += rng.expovariate(rate / 3600)
+        if profile:
+            picks = [rng.choice(profile) for _ in issued]
+            service = [pick[0] for pick in picks]
+            category = [pick[1] for pick in picks]
+            priority = [pick[2] for pick in picks]
+        else:
+            service = [rng.expovariate(1 / service_mean) for _ in issued]
+            category = [None] * len(issued)
+            priority = [0] * len(issued)
+    return Workload(issued, service, category, _schedule_keys(issued, priority, [None] * len(issued)))
+
+
+def next_weekday_start(weekday=None):
+    """Local midnight of the next `weekday` (today when it matches), or of today"""
+    today = timezone.localdate()
+    if weekday is not None:
+        today += timedelta(days=(WEEKDAYS.index(weekday) - today.weekday()) % 7)
+    return timezone.make_aware(datetime.combine(today, dt_time.min))
+
+
+def current_counters():
+    """Category sets of the configured counters (empty set: serves every category)"""
+    from .models import ServiceCounter
+    serves = {counter_id: set() for counter_id in ServiceCounter.objects.order_by('id').values_list('id', flat=True)}
+    for counter_id, category_id in ServiceCounter.categories.through.objects.values_list(
+        'servicecounter_id', 'servicecategory_id'
+    ):
+        serves[counter_id].add(category_id)
+    return [frozenset(categories) for categories in serves.values()]
+
+
+def category_priorities():
+    from .models import ServiceCategory
+    return dict(ServiceCategory.objects.order_by().values_list('id', 'priority'))
+
+
+class _HourlyTotals:
+    """Time-weighted queue length and busy counters per local hour of day"""
+
+    def __init__(self, utc_offset):
+        self.offset = utc_offset
+        self.queue = [0.0] * 24
+        self.busy = [0.0] * 24
+        self.covered = [0.0] * 24
+
+    def add(self, t0, t1, waiting, busy):
+        while t0 < t1:
+            local = t0 + self.offset
+            edge = (math.floor(local / 3600) + 1) * 3600 - self.offset
+            end = min(t1, edge)
+            hour = int(local // 3600) % 24
+            dt = end - t0
+            self.queue[hour] += waiting * dt
+            self.busy[hour] += busy * dt
+            self.covered[hour] += dt
+            t0 = end
+
+
+def simulate(workload, counters, threshold=None, priorities=None, utc_offset=0):
+    """Run a workload through the assignment rules in memory and summarise it.
+
+    Mirrors assign_tokens(): whenever a token is issued, comes due or a
+    counter is freed, free counters are taken longest-idle first and each
+    gets the best token it can serve, category priority first and then
+    schedule order, out of the first `threshold` + 1 due tokens of every
+    queue. A counter left free because the fairness window ran out is
+    retried after AUTO_ASSIGN_INTERVAL, like the assigner's fallback tick.
+    Service longer than MAX_SERVING_TIME is cut short, as the timeout sweep
+    does. `counters` is a list of category sets, empty for "serves all".
+
+    Waits are measured from when a token became due to when it was called;
+    tokens in a queue no counter serves are reported as unserved.
+    """
+    from .models import Token
+    if threshold is None:
+        threshold = Token.fairness_threshold()
+    priorities = priorities or {}
+    retry_after = settings.AUTO_ASSIGN_INTERVAL
+    max_service = settings.MAX_SERVING_TIME
+    issued, service, category, keys = workload.issued, workload.service, workload.category, workload.schedule_key
+    total = len(workload)
+    started_at = time.perf_counter()
+
+    queues = {}  # category -> heap of (schedule key, token index) of due waiting tokens
+    not_due = []  # heap of (schedule key, token index) for appointments issued early
+    completions = []  # heap of (time, counter index)
+    free = [(-math.inf, c) for c in range(len(counters))]  # (last completed, counter) kept sorted
+    retry = None
+    called = [math.nan] * total  # stays NaN for tokens no counter could take
+    busy_time = [0.0] * len(counters)
+    hourly = _HourlyTotals(utc_offset)
+    waiting = busy = max_waiting = 0
+    now = issued[0] if total else 0.0
+    first = now
+    i = 0
+
+    while i < total or completions or not_due or retry is not None:
+        t = math.inf
+        if i < total:
+            t = issued[i]
+        if completions and completions[0][0] < t:
+            t = completions[0][0]
+        if not_due and not_due[0][0] < t:
+            t = not_due[0][0]
+        if retry is not None and retry < t:
+            t = retry
+        if t > now:
+            hourly.add(now, t, waiting, busy)
+            now = t
+        if retry is not None and retry <= now:
+            retry = None
+
+        while completions and completions[0][0] <= now:
+            _, c = heapq.heappop(completions)
+            insort(free, (now, c))
+            busy -= 1
+        while i < total and issued[i] <= now:
+            if keys[i] <= now:
+                heapq.heappush(queues.setdefault(category[i], []), (keys[i], i))
+                waiting += 1
+            else:
+                heapq.heappush(not_due, (keys[i], i))
+            i += 1
+        while not_due and not_due[0][0] <= now:
+            key, j = heapq.heappop(not_due)
+            heapq.heappush(queues.setdefault(category[j], []), (key, j))
+            waiting += 1
+        if waiting > max_waiting:
+            max_waiting = waiting
+
+        if not free or not waiting:
+            continue
+        taken = {}
+        blocked = False
+        k = 0
+        while k < len(free) and waiting:
+            c = free[k][1]
+            best = best_queue = None
+            for queue_id in (counters[c] or queues):
+                heap = queues.get(queue_id)
+                if not heap:
+                    continue
+                if taken.get(queue_id, 0) > threshold:
+                    blocked = True
+                    continue
+                candidate = (-priorities.get(queue_id, 0), heap[0])
+                if best is None or candidate < best:
+                    best, best_queue = candidate, queue_id
+            if best is None:
+                k += 1
+                continue
+            _, j = heapq.heappop(queues[best_queue])
+            taken[best_queue] = taken.get(best_queue, 0) + 1
+            waiting -= 1
+            del free[k]
+            called[j] = now
+            duration = min(service[j], max_service)
+            heapq.heappush(completions, (now + duration, c))
+            busy_time[c] += duration
+            busy += 1
+        if blocked and free and waiting and retry is None:
+            retry = now + retry_after
+
+    elapsed = time.perf_counter() - started_at
+    return _summarise(workload, called, busy_time, hourly, max_waiting, now - first, elapsed, len(counters))
+
+
+def _summarise(workload, called, busy_time, hourly, max_waiting, span, elapsed, counter_count):
+    total = len(workload)
+    if np is not None:
+        ready = np.asarray(workload.ready)
+        waits = (np.asarray(called) - ready) / 60
+        served = ~np.isnan(waits)
+        waits, hours = waits[served], ((ready[served] + hourly.offset) // 3600 % 24).astype(int)
+        unserved = total - int(served.sum())
+        stats = _wait_stats(waits)
+        by_hour = {hour: _wait_stats(waits[hours == hour]) for hour in np.unique(hours).tolist()}
+    else:
+        grouped, waits = {}, []
+        for c, ready in zip(called, workload.ready):
+            if not math.isnan(c):
+                waits.append((c - ready) / 60)
+                grouped.setdefault(int((ready + hourly.offset) // 3600 % 24), []).append(waits[-1])
+        unserved = total - len(waits)
+        stats = _wait_stats(waits)
+        by_hour = {hour: _wait_stats(group) for hour, group in grouped.items()}
+
+    hours = []
+    for hour in range(24):
+        covered = hourly.covered[hour]
+        if not covered and hour not in by_hour:
+            continue
+        hours.append({
+            'hour': hour,
+            'arrivals': by_hour.get(hour, {}).get('count', 0),
+            'wait': by_hour.get(hour, _wait_stats([])),
+            'queue': hourly.queue[hour] / covered if covered else 0.0,
+            'utilisation': hourly.busy[hour] / (covered * counter_count) if covered and counter_count else 0.0,
+        })
+    return {
+        'counters': counter_count,
+        'tokens': total,
+        'unserved': unserved,
+        'wait': stats,
+        'queue': {'mean': sum(hourly.queue) / span if span else 0.0, 'max': max_waiting},
+        'utilisation': sum(busy_time) / (span * counter_count) if span and counter_count else 0.0,
+        'counter_utilisation': [busy / span if span else 0.0 for busy in busy_time],
+        'hours': hours,
+        'elapsed': elapsed,
+        'tokens_per_second': total / elapsed if elapsed else 0.0,
+    }
+
+
+def _wait_stats(waits):
+    """Wait summary in minutes"""
+    if np is not None and isinstance(waits, np.ndarray):
+        if not waits.size:
+            return _wait_stats([])
+        values = np.percentile(waits, WAIT_PERCENTILES).tolist()
+        return {
+            'count': int(waits.size), 'mean': float(waits.mean()), 'max': float(waits.max()),
+            **{f'p{pct}': value for pct, value in zip(WAIT_PERCENTILES, values)},
+        }
+    waits = list(waits)
+    return {
+        'count': len(waits),
+        'mean': sum(waits) / len(waits) if waits else 0.0,
+        'max': max(waits, default=0.0),
+        **{f'p{pct}': percentile(waits, pct) for pct in WAIT_PERCENTILES},
+    }
@@ -0,0 +1,226 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .logs import mask_phone
+from .metrics import observe_sms
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+_backend = None
+
+
+def normalize_phone_number(phone_number):
+    """Format Indian numbers automatically (optional)"""
+    if phone_number.isdigit() and len(phone_number) == 10:
+        return '+91' + phone_number
+    return phone_number
+
+
+class BaseSMSBackend:
+    """Deliver SMS; send() raises on failure so the dispatcher can retry"""
+
+    def send(self, phone_number, message):
+        raise NotImplementedError
+
+    def send_many(self, messages, max_workers=1):
+        """Send (phone_number, message) pairs, returning an error string or None for each"""
+        if max_workers <= 1 or len(messages) <= 1:
+            return [self._send_timed(message) for message in messages]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(messages))) as pool:
+            return list(pool.map(self._send_timed, messages))
+
+    def _send_timed(self, message):
+        phone_number, body = message
+        start = time.perf_counter()
+        try:
+            self.send(phone_number, body)
+            observe_sms(time.perf_counter() - start, ok=True)
+            return None
+        except Exception as e:
+            observe_sms(time.perf_counter() - start, ok=False)
+            return str(e) or e.__class__.__name__
+
+
+def _twilio_http_client():
+    """Twilio HTTP client with a keep-alive pool sized for the dispatcher's threads"""
+    from requests.adapters import HTTPAdapter
+    from twilio.http.http_client import TwilioHttpClient
+
+    class GatewayHttpClient(TwilioHttpClient):
+        base_url = settings.TWILIO_API_BASE_URL.rstrip('/')
+
+        def request(self, method, url, *args, **kwargs):
+            if self.base_url:
+                # Same paths on another host, e.g. the local fake_sms_gateway
+                url = self.base_url + url[url.index('/', len('https://')):]
+            return super().request(method, url, *args, **kwargs)
+
+    pool_size = settings.SMS_HTTP_POOL_SIZE
+    client = GatewayHttpClient(pool_connections=pool_size > 0, timeout=settings.SMS_HTTP_TIMEOUT)
+    if client.session is not None:
+        # Retries are the outbox's job, not urllib3's
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        client.session.mount('https://', adapter)
+        client.session.mount('http://', adapter)
+    return client
+
+
+class TwilioBackend(BaseSMSBackend):
+    """Send through Twilio with one client and a pool of keep-alive connections per process"""
+
+    def __init__(self):
+        from twilio.rest import Client
+        self.client = Client(
+            settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN, http_client=_twilio_http_client()
+        )
+
+    def send(self, phone_number, message):
+        # Prefer messaging service SID if configured, otherwise use a Twilio phone number
+        msg_kwargs = {
+            'body': message,
+            'to': phone_number,
+        }
+        if getattr(settings, 'TWILIO_MESSAGING_SERVICE_SID', ''):
+            msg_kwargs['messaging_service_sid'] = settings.TWILIO_MESSAGING_SERVICE_SID
+        else:
+            msg_kwargs['from_'] = settings.TWILIO_PHONE_NUMBER
+        self.client.messages.create(**msg_kwargs)
+
+
+class FakeBackend(BaseSMSBackend):
+    """Keep messages in memory instead of sending them (for tests and local runs)"""
+    sent = []
+    fail_numbers = set()
+
+    def send(self, phone_number, message):
+        if phone_number in self.fail_numbers:
+            raise RuntimeError(f"Fake delivery failure for {phone_number}")
+        self.sent.append((phone_number, message))
+
+
+def get_backend():
+    """Return the process-wide SMS backend configured by SMS_BACKEND"""
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.SMS_BACKEND)()
+    return _backend
+
+
+def reset_backend():
+    """Forget the backend so the next get_backend() reads the settings again"""
+    global _backend
+    _backend = None
+
+
+def send_sms(phone_number, message):
+    """Send an SMS immediately; used by the dispatcher, views should enqueue instead"""
+    if not phone_number or not settings.SMS_ENABLED:
+        return False
+    error = get_backend()._send_timed((normalize_phone_number(phone_number), message))
+    if error is None:
+        logger.info("SMS sent", extra={'phone': mask_phone(phone_number)})
+        return True
+    logger.error(f"SMS sending failed: {error}", extra={'phone': mask_phone(phone_number)})
+    return False
+
+
+def enqueue_sms(phone_number, message):
+    """Store an SMS in the outbox for the background dispatcher"""
+    if not phone_number or not settings.SMS_ENABLED:
+        return None
+    return OutboxMessage.objects.create(phone_number=phone_number, body=message)
+
+
+async def aenqueue_sms(phone_number, message):
+    """enqueue_sms() for async views"""
+    if not phone_number or not settings.SMS_ENABLED:
+        return None
+    return await OutboxMessage.objects.acreate(phone_number=phone_number, body=message)
+
+
+def enqueue_many(messages):
+    """Store several (phone_number, message) pairs in the outbox with one insert"""
+    if not settings.SMS_ENABLED:
+        return []
+    return OutboxMessage.objects.bulk_create([
+        OutboxMessage(phone_number=phone_number, body=message)
+        for phone_number, message in messages
+        if phone_number
+    ])
+
+
+def _claim_batch(batch_size):
+    """Lock a batch of due messages so concurrent dispatchers don't send them twice"""
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutboxMessage.objects.select_for_update(skip_locked=True)
+            .filter(status__in=[OutboxMessage.STATUS_PENDING, OutboxMessage.STATUS_SENDING],
+                    next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        if batch:
+            # A claimed message becomes due again if this dispatcher dies mid-batch
+            OutboxMessage.objects.filter(pk__in=[m.pk for m in batch]).update(
+                status=OutboxMessage.STATUS_SENDING,
+                next_attempt_at=now + timedelta(seconds=settings.SMS_CLAIM_TIMEOUT),
+            )
+    return batch
+
+
+def dispatch_pending(batch_size=None, max_workers=None):
+    """Send one batch of due outbox messages through the backend's bulk API.
+
+    Returns a (sent, failed) tuple. Failed messages are rescheduled with
+    exponential backoff until SMS_MAX_ATTEMPTS is reached.
+    """
+    batch_size = batch_size or settings.SMS_DISPATCH_BATCH_SIZE
+    max_workers = max_workers or settings.SMS_DISPATCH_WORKERS
+
+    batch = _claim_batch(batch_size)
+    if not batch:
+        return 0, 0
+
+    errors = get_backend().send_many(
+        [(normalize_phone_number(message.phone_number), message.body) for message in batch],
+        max_workers=max_workers,
+    )
+
+    now = timezone.now()
+    sent, retry = [], []
+    for message, error in zip(batch, errors):
+        message.attempts += 1
+        if error is None:
+            message.status = OutboxMessage.STATUS_SENT
+            message.sent_at = now
+            message.last_error = ''
+            sent.append(message)
+            continue
+        logger.error(
+            f"SMS delivery failed: {error}",
+            extra={'outbox_id': message.pk, 'phone': mask_phone(message.phone_number), 'attempt': message.attempts},
+        )
+        message.last_error = error
+        if message.attempts >= settings.SMS_MAX_ATTEMPTS:
+            message.status = OutboxMessage.STATUS_FAILED
+        else:
+            message.status = OutboxMessage.STATUS_PENDING
+            backoff = settings.SMS_RETRY_BACKOFF * (2 ** (message.attempts - 1))
+            message.next_attempt_at = now + timedelta(seconds=backoff)
+        retry.append(message)
+
+    OutboxMessage.objects.bulk_update(
+        sent + retry,
+        ['status', 'attempts', 'sent_at', 'last_error', 'next_attempt_at'],
+    )
+    if sent:
+        logger.info(f"Dispatched {len(sent)} SMS", extra={'sent': len(sent), 'failed': len(retry)})
+    return len(sent), len(retry)
@@ -0,0 +1,129 @@
+from bisect import bisect_left
+import threading
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+SNAPSHOT_CACHE = 'queue_snapshot'
+VERSION_KEY = 'queue_app:snapshot:version'
+
+
+class QueueSnapshot:
+    """The unserved tokens at one snapshot version, as every worker sees them"""
+
+    def __init__(self, version, max_token, queues):
+        self.version = version
+        self.max_token = max_token  # highest token number issued
+        self.queues = queues  # category id -> unserved token numbers in schedule order
+        self._where = {
+            token_number: (category_id, i)
+            for category_id, queue in queues.items()
+            for i, token_number in enumerate(queue)
+        }
+        self._unserved = None
+
+    def exists(self, token_number):
+        # Numbers are handed out in order, so anything up to the highest one was issued
+        return self.max_token is not None and 0 < token_number <= self.max_token
+
+    def is_unserved(self, token_number):
+        return token_number in self._where
+
+    def position(self, token_number):
+        """(front of its queue, tokens ahead of it, still unserved), like QueueStateIndex.position()"""
+        where = self._where.get(token_number)
+        if where is None:
+            # Tokens no longer queued are measured against the whole queue
+            if self._unserved is None:
+                self._unserved = sorted(self._where)
+            ahead = bisect_left(self._unserved, token_number)
+            return (self._unserved[0] if self._unserved else None), ahead, False
+        category_id, ahead = where
+        return self.queues[category_id][0], ahead, True
+
+
+_local = None  # this process's decoded copy of the newest snapshot it has read
+_rebuild_lock = threading.Lock()
+
+
+def _cache():
+    return caches[SNAPSHOT_CACHE]
+
+
+def _key(version):
+    return f'queue_app:snapshot:{version}'
+
+
+def snapshot_version():
+    """Current version of the shared queue snapshot; changes on every token state change"""
+    cache = _cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)  # first use, or evicted
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def invalidate_queue_snapshot():
+    """Retire the shared snapshot after tokens were issued, called or completed.
+
+    Each change sets a new random version rather than incrementing, so two
+    workers racing on a cache without atomic incr can never bring back a
+    version whose snapshot was built before their change committed.
+    """
+    _cache().set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def _build():
+    from .models import Token
+    queues = {}
+    rows = Token.objects.filter(is_served=False).order_by('schedule_key', 'token_number').values_list(
+        'token_number', 'category_id'
+    )
+    for token_number, category_id in rows:
+        queues.setdefault(category_id, []).append(token_number)
+    max_token = Token.objects.order_by('-token_number').values_list('token_number', flat=True).first()
+    return max_token, queues
+
+
+def _cached(version):
+    global _local
+    local = _local
+    if local is not None and local.version == version:
+        return local
+    data = _cache().get(_key(version))
+    if data is None:
+        return None
+    _local = QueueSnapshot(version, *data)
+    return _local
+
+
+def queue_snapshot():
+    """The shared snapshot, read from the cache; rebuilt from the database once per version.
+
+    The first worker to see a new version runs the rebuild and stores it
+    for the others, so a status page normally costs one cache read of the
+    version key and no queries.
+    """
+    global _local
+    version = snapshot_version()
+    snapshot = _cached(version)
+    if snapshot is None:
+        with _rebuild_lock:  # one rebuild per process; other threads wait for it
+            snapshot = _cached(version)
+            if snapshot is None:
+                # Built after reading the version, so it holds every change that version stands for
+                data = _build()
+                _cache().set(_key(version), data, settings.QUEUE_SNAPSHOT_TIMEOUT)
+                snapshot = _local = QueueSnapshot(version, *data)
+    return snapshot
+
+
+async def aqueue_snapshot():
+    """queue_snapshot() for async views: only a rebuild leaves the event loop"""
+    snapshot = _cached(snapshot_version())
+    if snapshot is None:
+        snapshot = await sync_to_async(queue_snapshot)()
+    return snapshot
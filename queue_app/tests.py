@@ -0,0 +1,611 @@
+import bisect
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+import io
+import random
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from queue_app.assignment import assign_tokens, expire_overdue_tokens
+from queue_app.bulk_import import category_lookup, issue_import, read_rows
+from queue_app.estimator import ServiceTimeEstimator
+from queue_app.leadership import Leadership
+from queue_app.metrics import registry
+from queue_app.notifications import completed_message
+from queue_app.models import (
+    ArchivedToken, CounterRollup, HourlyRollup, LeaderLease, OutboxMessage, QueueChange, ServiceCategory, ServiceCounter,
+    Token,
+)
+from queue_app.reporting import report, rollup_day
+from queue_app.queue_state import QueueStateIndex, _SortedList, queue_index
+from queue_app.sms import _claim_batch
+
+
+class BulkImportTests(TransactionTestCase):
+    # The queue index is updated on commit, so these run against real transactions
+
+    def setUp(self):
+        ServiceCategory.objects.create(name='Exams')
+        queue_index.rebuild()
+
+    def import_csv(self, text, chunk_size):
+        rows = list(read_rows(io.StringIO(text), 'csv'))
+        return list(issue_import(rows, category_lookup(), len(rows), chunk_size))
+
+    def test_positions_account_for_priority_rows_in_later_chunks(self):
+        results = self.import_csv(
+            'customer_name,phone_number,category,priority\n'
+            'Ana,,Exams,0\n'
+            'Ben,,Exams,0\n'
+            'Cal,,Exams,0\n'
+            'Dee,,Exams,1\n',
+            chunk_size=2,
+        )
+        self.assertEqual([r['customer_name'] for r in results], ['Ana', 'Ben', 'Cal', 'Dee'])
+        # Dee's row came in the second chunk but is filed ahead of every walk-in
+        ahead = {r['customer_name']: r['tokens_ahead'] for r in results}
+        self.assertEqual(ahead, {'Dee': 0, 'Ana': 1, 'Ben': 2, 'Cal': 3})
+        for result in results:
+            self.assertEqual(
+                result['tokens_ahead'], queue_index.tokens_ahead(result['token_number'])
+            )
+
+
+@override_settings(QUEUE_SYNC_INTERVAL=0, QUEUE_STATE_CHECK_INTERVAL=3600)
+class QueueStateIndexTests(TransactionTestCase):
+
+    def setUp(self):
+        queue_index.rebuild()
+
+    def test_edited_priority_refiles_the_token(self):
+        first = Token.objects.create(customer_name='Ana')
+        last = Token.objects.create(customer_name='Ben')
+        self.assertEqual(queue_index.tokens_ahead(last.token_number), 1)
+        last.priority = 1
+        last.save()
+        self.assertEqual(queue_index.tokens_ahead(last.token_number), 0)
+        self.assertEqual(queue_index.tokens_ahead(first.token_number), 1)
+        self.assertEqual(queue_index.check(repair=False)['queue'], set())
+
+    def window(self):
+        """(index window, index batch, database window) as token numbers in schedule order"""
+        indexed = [token_number for _, token_number, _ in queue_index.servable()]
+        batch = [token.token_number for token in Token.get_next_servable_batch(len(indexed) + 1)]
+        return indexed, batch, list(Token.servable().values_list('token_number', flat=True))
+
+    def assertWindowMatchesDatabase(self, step=''):
+        indexed, batch, database = self.window()
+        self.assertEqual(indexed, database, step)
+        self.assertEqual(batch, database, step)
+
+    @override_settings(FAIRNESS_THRESHOLD=1)
+    def test_refiling_back_to_the_old_place_leaves_no_stale_heap_entry(self):
+        tokens = [Token.objects.create(customer_name=f'Customer {i}') for i in range(5)]
+        last = tokens[-1]
+        self.assertWindowMatchesDatabase()
+        for priority in (2, 0):
+            last.priority = priority
+            last.save()
+            self.assertWindowMatchesDatabase(f'priority {priority}')
+        self.assertEqual(self.window()[0], [tokens[0].token_number, tokens[1].token_number])
+
+        last.appointment_at = timezone.now() + timedelta(hours=1)
+        last.save()
+        last.appointment_at = None
+        last.save()
+        self.assertWindowMatchesDatabase('appointment moved and cancelled')
+
+    @override_settings(FAIRNESS_THRESHOLD=2)
+    def test_index_window_matches_the_database_through_random_edits(self):
+        rng = random.Random(18)
+        categories = [None] + [ServiceCategory.objects.create(name=name) for name in ('Exams', 'Payments')]
+        counters = [ServiceCounter.objects.create(name=f'Counter {i}') for i in range(3)]
+        now = timezone.now()
+        appointments = [None, None, None, now - timedelta(minutes=30), now + timedelta(hours=1)]
+
+        def issue():
+            Token.objects.create(
+                customer_name='Walk-in', category=rng.choice(categories),
+                priority=rng.choice([0, 0, 1, 2]), appointment_at=rng.choice(appointments),
+            )
+
+        def edit():
+            waiting = list(Token.waiting())
+            if waiting:
+                token = rng.choice(waiting)
+                field = rng.choice(['priority', 'category', 'appointment_at'])
+                value = {'priority': rng.choice([0, 1, 2]), 'category': rng.choice(categories),
+                         'appointment_at': rng.choice(appointments)}[field]
+                setattr(token, field, value)
+                token.save()
+
+        def call():
+            window = list(Token.servable())
+            if window:
+                rng.choice(window).start_serving(rng.choice(counters))
+
+        def complete():
+            serving = list(Token.objects.filter(is_served=False, started_serving__isnull=False))
+            if serving:
+                rng.choice(serving).complete_serving()
+
+        def assign():
+            ServiceCounter.objects.filter(current_token__isnull=True).update(is_available=True)
+            assign_tokens()
+
+        for _ in range(10):
+            issue()
+        operations = [issue, issue, edit, edit, call, complete, assign]
+        for step in range(150):
+            operation = rng.choice(operations)
+            operation()
+            self.assertWindowMatchesDatabase(f'step {step}: {operation.__name__}')
+        self.assertEqual(queue_index.check(repair=False), {'missing': set(), 'extra': set(), 'serving': set(), 'queue': set()})
+
+    def test_catch_up_rescans_numbers_committed_out_of_order(self):
+        other = QueueStateIndex()  # another process's index: it only sees what catch_up() reads
+        other.rebuild()
+        earlier = Token.objects.create(customer_name='Ana')
+        other.catch_up()
+        first = Token.reserve_numbers(2)
+        walk_in = Token.objects.create(customer_name='Ben')
+        self.assertEqual(walk_in.token_number, first + 2)
+        other.catch_up()
+        self.assertEqual(other.unserved_after(0, 10), [earlier.token_number, walk_in.token_number])
+
+        # The import fills its block below the walk-in; the next scan starts from the gap
+        Token.issue_many([{'customer_name': 'Cal'}, {'customer_name': 'Dee'}], first_number=first)
+        other.catch_up()
+        self.assertEqual(other.unserved_after(0, 10), [earlier.token_number, first, first + 1, first + 2])
+        self.assertIsNone(other._gap)
+
+    def test_sync_rescans_a_gap_without_reporting_changes_again(self):
+        other = QueueStateIndex()
+        other.rebuild()
+        Token.objects.create(customer_name='Ana')
+        self.assertEqual(other.sync(), 1)
+        Token.objects.create(customer_name='Ben')
+        # As if another change were still in flight below Ben's
+        last = QueueChange.objects.latest('id')
+        QueueChange.objects.filter(pk=last.pk).update(id=last.pk + 1)
+        self.assertEqual(other.sync(), 1)
+        self.assertIsNotNone(other._change_gap)
+        self.assertEqual(other.sync(), 0)
+
+
+@override_settings(
+    QUEUE_SYNC_INTERVAL=0, QUEUE_STATE_CHECK_INTERVAL=3600, FAIRNESS_THRESHOLD=1, PRIORITY_HEAD_START=600,
+    APPOINTMENT_HEAD_START=300,
+)
+class FairnessWindowTests(TransactionTestCase):
+
+    def setUp(self):
+        queue_index.rebuild()
+
+    def issue(self, name, category=None, **fields):
+        return Token.objects.create(customer_name=name, category=category, **fields)
+
+    def assertServable(self, expected):
+        """Token.servable(), the queue index and the batch picker all give `expected`, in schedule order"""
+        expected = [token.token_number for token in expected]
+        self.assertEqual(list(Token.servable().values_list('token_number', flat=True)), expected)
+        self.assertEqual([token_number for _, token_number, _ in queue_index.servable()], expected)
+        self.assertEqual([token.token_number for token in Token.get_next_servable_batch(10)], expected)
+
+    def test_schedule_key_credits_priority_and_appointments(self):
+        issued = timezone.now()
+        slot = issued + timedelta(hours=1)
+        self.assertEqual(Token.schedule_key_for(issued), issued)
+        self.assertEqual(Token.schedule_key_for(issued, 2), issued - timedelta(seconds=1200))
+        self.assertEqual(Token.schedule_key_for(issued, 0, slot), slot - timedelta(seconds=300))
+        self.assertEqual(Token.schedule_key_for(issued, 1, slot), slot - timedelta(seconds=900))
+
+    def test_window_stops_after_threshold_plus_one_tokens(self):
+        tokens = [self.issue(f'Customer {i}') for i in range(4)]
+        self.assertServable(tokens[:2])
+        self.assertEqual(list(Token.servable(threshold=0).values_list('token_number', flat=True)), [tokens[0].token_number])
+        self.assertTrue(tokens[1].can_be_served)
+        self.assertFalse(tokens[2].can_be_served)
+
+    def test_appointment_is_not_servable_before_it_is_due(self):
+        walk_in = self.issue('Ana')
+        later = self.issue('Ben', appointment_at=timezone.now() + timedelta(hours=1))
+        soon = self.issue('Cal', appointment_at=timezone.now() + timedelta(minutes=2))
+        # Cal's slot less the head start has passed, so Cal goes ahead of the walk-in; Ben isn't due
+        self.assertServable([soon, walk_in])
+        self.assertFalse(later.can_be_served)
+
+        Token.objects.filter(pk=walk_in.pk).update(is_served=True, completed_serving=timezone.now())
+        queue_index.on_complete(walk_in.token_number)
+        self.assertServable([soon])
+
+    def test_priority_orders_tokens_within_a_category(self):
+        exams = ServiceCategory.objects.create(name='Exams')
+        normal = self.issue('Ana', exams)
+        priority = self.issue('Ben', exams, priority=1)
+        urgent = self.issue('Cal', exams, priority=2)
+        self.assertServable([urgent, priority])
+
+        urgent.priority = 0
+        urgent.save()
+        self.assertServable([priority, normal])
+
+    def test_busy_category_cannot_starve_another(self):
+        payments = ServiceCategory.objects.create(name='Payments', priority=1)  # called first at shared counters
+        exams = ServiceCategory.objects.create(name='Exams')
+        rush = [self.issue(f'Payer {i}', payments) for i in range(6)]
+        student = self.issue('Student', exams)
+        # One window over all tokens would stop at the first two payers
+        self.assertServable([*rush[:2], student])
+
+        counters = [ServiceCounter.objects.create(name=f'Counter {i}') for i in range(3)]
+        counters[0].categories.add(payments, exams)
+        assigned = {token.token_number: counter for token, counter in assign_tokens()}
+        self.assertEqual(set(assigned), {rush[0].token_number, rush[1].token_number, student.token_number})
+        self.assertEqual(assigned[rush[0].token_number], counters[0])
+
+
+class SortedListTests(SimpleTestCase):
+
+    def test_matches_a_plain_sorted_list(self):
+        rng = random.Random(2)
+        with patch.object(_SortedList, 'LOAD', 4):  # small buckets so they split and empty often
+            expected = sorted(rng.sample(range(300), 100))
+            items = _SortedList(expected)
+            for _ in range(3000):
+                item = rng.randrange(300)
+                if rng.random() < 0.55 and item not in expected:
+                    bisect.insort(expected, item)
+                    items.add(item)
+                elif rng.random() < 0.45:
+                    if item in expected:
+                        expected.remove(item)
+                    items.discard(item)
+                probe = rng.randrange(310)
+                self.assertEqual(items.bisect_left(probe), bisect.bisect_left(expected, probe))
+                self.assertEqual(items.after(probe, 5), expected[bisect.bisect_right(expected, probe):][:5])
+                self.assertEqual(items.first(), expected[0] if expected else None)
+            self.assertEqual(list(items), expected)
+            self.assertEqual(len(items), len(expected))
+
+
+@override_settings(ESTIMATOR_MIN_SAMPLES=3, PER_TOKEN_MINUTES=2, MAX_SERVING_TIME=600, ESTIMATOR_ACTIVE_WINDOW=1800)
+class ServiceTimeEstimatorTests(SimpleTestCase):
+
+    def estimator(self, services, counters=None):
+        """An estimator loaded with `services` of 60 seconds each; counter 1 is busy unless `counters` says otherwise"""
+        now = timezone.now()
+        history = [(1, now - timedelta(seconds=60 * (i + 1) + 60), now - timedelta(seconds=60 * (i + 1)))
+                   for i in range(services)]
+        estimator = ServiceTimeEstimator()
+        estimator._apply(history, counters if counters is not None else {1: (True, None)})
+        return estimator
+
+    def test_falls_back_to_per_token_minutes_until_enough_samples(self):
+        estimator = self.estimator(2)
+        self.assertIsNone(estimator.service_rate())
+        self.assertIsNone(estimator.mean_service_seconds())
+        self.assertEqual(estimator.estimate_wait(4), 10)
+
+    def test_uses_service_history_once_trusted(self):
+        estimator = self.estimator(3)
+        self.assertEqual(estimator.mean_service_seconds(), 60)
+        self.assertEqual(estimator.estimate_wait(4), 5)
+
+    def test_rate_counts_only_open_counters(self):
+        now = timezone.now()
+        estimator = self.estimator(3, {
+            1: (True, None),  # serving
+            2: (False, now - timedelta(minutes=5)),  # between customers
+            3: (False, now - timedelta(hours=2)),  # idle since this morning
+            4: (False, None),  # never used
+        })
+        self.assertAlmostEqual(estimator.service_rate(), 2 / 60)
+
+        estimator.update_counters([(3, True, now - timedelta(hours=2))])
+        estimator.remove_counter(2)
+        self.assertAlmostEqual(estimator.service_rate(), 2 / 60)
+        estimator.update_counters([(1, False, now - timedelta(hours=1)), (3, False, now - timedelta(hours=1))])
+        self.assertIsNone(estimator.service_rate())
+        self.assertEqual(estimator.estimate_wait(0), 2)
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_PROFILE_SAMPLE_RATE=0)
+class MetricsMiddlewareTests(TestCase):
+
+    async def test_async_view_records_its_queries(self):
+        key = ('queue_db_queries_total', (('view', 'generate_token'),))
+        before = registry._counters.get(key, 0)
+        response = await self.async_client.post('/generate-token/', {'customer_name': 'Ada'})
+        self.assertEqual(response.status_code, 200)
+        # The token INSERT runs in a sync_to_async worker thread
+        self.assertGreater(registry._counters.get(key, 0), before)
+        self.assertGreater(registry._counters[('queue_db_query_seconds_total', key[1])], 0)
+
+
+@override_settings(SMS_ENABLED=True)
+class ExpirySweepTests(TestCase):
+
+    def test_notifies_with_the_completed_message(self):
+        counter = ServiceCounter.objects.create(name='A', is_available=False)
+        token = Token.objects.create(
+            customer_name='Ana', phone_number='+15550001111', counter=counter,
+            started_serving=timezone.now() - timedelta(hours=1),
+        )
+        ServiceCounter.objects.filter(pk=counter.pk).update(current_token=token)
+        self.assertEqual(expire_overdue_tokens(notify=True), [token.token_number])
+
+        token.refresh_from_db()
+        counter.refresh_from_db()
+        self.assertTrue(token.is_served)
+        self.assertTrue(counter.is_available)
+        message = OutboxMessage.objects.get()
+        self.assertEqual(
+            (message.phone_number, message.body),
+            (token.phone_number, completed_message(token.token_number, token.completed_serving)),
+        )
+
+
+class LeadershipTests(TestCase):
+
+    def lapse(self):
+        LeaderLease.objects.filter(name='job').update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_first_heartbeat_takes_the_lease(self):
+        a, b = Leadership('job', 'a'), Leadership('job', 'b')
+        self.assertTrue(a.heartbeat())
+        self.assertFalse(b.heartbeat())
+        self.assertEqual(b.current_holder(), 'a')
+        self.assertEqual(LeaderLease.objects.get(name='job').term, 1)
+
+    def test_heartbeat_renews_without_a_new_term(self):
+        a = Leadership('job', 'a', ttl=60)
+        a.heartbeat()
+        self.lapse()
+        self.assertTrue(a.heartbeat())
+        lease = LeaderLease.objects.get(name='job')
+        self.assertEqual(lease.term, 1)
+        self.assertGreater(lease.expires_at, timezone.now() + timedelta(seconds=30))
+
+    def test_standby_takes_over_a_lapsed_lease(self):
+        a, b = Leadership('job', 'a'), Leadership('job', 'b')
+        a.heartbeat()
+        self.lapse()
+        self.assertIsNone(a.current_holder())
+        self.assertTrue(b.heartbeat())
+        self.assertFalse(a.heartbeat())
+        lease = LeaderLease.objects.get(name='job')
+        self.assertEqual((lease.holder, lease.term), ('b', 2))
+
+    def test_release_hands_over_at_the_next_heartbeat(self):
+        a, b = Leadership('job', 'a'), Leadership('job', 'b')
+        a.heartbeat()
+        a.release()
+        self.assertFalse(a.is_leader)
+        self.assertTrue(b.heartbeat())
+
+
+@override_settings(QUEUE_SYNC_INTERVAL=0, QUEUE_STATE_CHECK_INTERVAL=3600)
+class QueueChangeTests(TransactionTestCase):
+    """A second QueueStateIndex stands in for another process: it only learns of changes from the log"""
+
+    def setUp(self):
+        self.category = ServiceCategory.objects.create(name='Exams')
+        queue_index.rebuild()
+        self.other = QueueStateIndex()
+        self.other.rebuild()
+
+    def state(self, index):
+        return index.queues(), index.unserved_after(0, 100), index.waiting_count()
+
+    def assertInStep(self):
+        self.assertEqual(self.state(self.other), self.state(queue_index))
+
+    def test_replay_keeps_another_index_in_step(self):
+        first = Token.objects.create(customer_name='Ana')
+        Token.objects.create(customer_name='Ben', category=self.category)
+        last = Token.objects.create(customer_name='Cal')
+        self.assertEqual(self.other.sync(), 3)
+        self.assertInStep()
+
+        ServiceCounter.objects.create(name='A')
+        self.assertEqual(len(assign_tokens()), 1)
+        last.priority = 1
+        last.save()  # re-filed ahead of the walk-ins
+        self.other.sync()
+        self.assertInStep()
+        self.assertEqual(self.other.waiting_count(), 2)
+
+        Token.objects.get(pk=first.pk).complete_serving()
+        self.other.sync()
+        self.assertInStep()
+        self.assertEqual(self.other.sync(), 0)
+
+    def test_changes_made_by_the_index_itself_are_skipped(self):
+        Token.objects.create(customer_name='Ana')
+        self.assertEqual(queue_index.sync(), 0)
+        self.assertEqual(self.other.sync(), 1)
+
+    def test_reset_reloads_the_index(self):
+        Token.objects.create(customer_name='Ana')
+        self.other.sync()
+        with transaction.atomic():
+            Token.objects.all().delete()
+            QueueChange.record([None])
+        self.assertTrue(self.other.sync())
+        self.assertEqual(self.other.unserved_count(), 0)
+
+    def test_prune_deletes_only_old_changes(self):
+        Token.objects.create(customer_name='Ana')
+        QueueChange.objects.update(created_at=timezone.now() - timedelta(hours=2))
+        Token.objects.create(customer_name='Ben')
+        self.assertEqual(QueueChange.prune(3600), 1)
+        self.assertEqual(QueueChange.objects.count(), 1)
+        # Ana's change is gone: a process that far behind is repaired by its full check instead
+        self.assertEqual(self.other.sync(), 1)
+
+
+class ConcurrentClaimTests(TransactionTestCase):
+    """Workers claiming rows side by side, each on its own connection, never take the same row twice"""
+
+    def run_concurrently(self, work, workers=4):
+        def run():
+            try:
+                return work()
+            finally:
+                connection.close()
+        with ThreadPoolExecutor(workers) as pool:
+            return [future.result() for future in [pool.submit(run) for _ in range(workers)]]
+
+    def test_assigners_never_hand_out_a_token_or_counter_twice(self):
+        queue_index.rebuild()
+        ServiceCounter.objects.bulk_create([ServiceCounter(name=f'Counter {i}') for i in range(6)])
+        Token.issue_many([{'customer_name': f'Customer {i}'} for i in range(20)])
+        passes = self.run_concurrently(lambda: [(t.token_number, c.id) for t, c in assign_tokens()])
+        assigned = [pair for pass_ in passes for pair in pass_]
+        self.assertEqual(len({token for token, _ in assigned}), len(assigned))
+        self.assertEqual(len({counter for _, counter in assigned}), len(assigned))
+        self.assertEqual(Token.objects.filter(started_serving__isnull=False).count(), len(assigned))
+
+    def test_dispatchers_never_claim_a_message_twice(self):
+        OutboxMessage.objects.bulk_create([
+            OutboxMessage(phone_number=f'+1555000{i:04d}', body='Hello') for i in range(40)
+        ])
+        batches = self.run_concurrently(lambda: [m.pk for m in _claim_batch(15)])
+        claimed = [pk for batch in batches for pk in batch]
+        self.assertEqual(len(set(claimed)), len(claimed))
+        self.assertEqual(len(claimed), 40)
+
+
+
+class ArchiveTests(TestCase):
+
+    def test_archiving_moves_served_tokens_and_keeps_numbering_monotonic(self):
+        done = timezone.now() - timedelta(days=2)
+        tokens = [Token.objects.create(customer_name=f'Customer {i}') for i in range(5)]
+        Token.objects.filter(pk__in=[token.pk for token in tokens]).update(
+            is_served=True, started_serving=done, completed_serving=done
+        )
+        newest = tokens[-1].token_number
+
+        out = io.StringIO()
+        call_command('archive_tokens', '--older-than', '3600', '--batch-size', '2', stdout=out)
+        self.assertIn('Archived 4 served tokens', out.getvalue())
+        archived = ArchivedToken.objects.order_by('token_number')
+        self.assertEqual(list(archived.values_list('token_number', flat=True)), [t.token_number for t in tokens[:4]])
+        self.assertEqual(archived[0].customer_name, 'Customer 0')
+        self.assertEqual(archived[0].completed_serving, done)
+        # The newest stays live so the next number carries on from it
+        self.assertEqual(list(Token.objects.values_list('token_number', flat=True)), [newest])
+
+        issued = Token.objects.create(customer_name='Next')
+        self.assertGreater(issued.token_number, newest)
+        self.assertFalse(ArchivedToken.objects.filter(token_number=issued.token_number).exists())
+
+def at(day, hour, minute=0, second=0):
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()).replace(hour=hour, minute=minute, second=second))
+
+
+@override_settings(MAX_SERVING_TIME=3600)
+class ReportingTests(TestCase):
+    first_day, last_day = date(2024, 3, 4), date(2024, 3, 5)
+
+    def setUp(self):
+        self.exams = ServiceCategory.objects.create(name='Exams')
+        self.desk, self.window = ServiceCounter.objects.create(name='Desk'), ServiceCounter.objects.create(name='Window')
+        day, next_day = self.first_day, self.last_day
+        self.token(self.exams, self.desk, at(day, 9), at(day, 9, 10), at(day, 9, 15))
+        self.token(self.exams, None, at(day, 9, 30), None, None)  # walked away
+        self.token(None, self.window, at(day, 10), at(day, 10, 55), at(day, 11, 5))  # served across two hours
+        self.token(self.exams, self.desk, at(day, 23, 50), at(next_day, 0, 5), at(next_day, 0, 10))  # called next day
+        ArchivedToken.objects.create(
+            token_number=99, customer_name='Archived', category=self.exams, counter=self.desk,
+            issued_at=at(next_day, 14), started_serving=at(next_day, 14, 0, 30), completed_serving=at(next_day, 14, 20, 30),
+        )
+
+    def token(self, category, counter, issued, started, completed):
+        token = Token.objects.create(customer_name='Ada', category=category)
+        Token.objects.filter(pk=token.pk).update(
+            issued_at=issued, schedule_key=issued, counter=counter, started_serving=started,
+            completed_serving=completed, is_served=completed is not None,
+        )
+
+    def rollups(self):
+        hours = HourlyRollup.objects.order_by('day', 'hour').values_list(
+            'day', 'hour', 'category_id', 'issued', 'called', 'served', 'abandoned', 'timed_out', 'wait_seconds',
+            'service_seconds',
+        )
+        counters = CounterRollup.objects.order_by('day', 'hour').values_list(
+            'day', 'hour', 'counter_id', 'served', 'busy_seconds'
+        )
+        return list(hours), list(counters)
+
+    def test_rollup_counts_each_event_in_its_own_hour(self):
+        day, next_day, exams = self.first_day, self.last_day, self.exams.pk
+        self.assertEqual(rollup_day(day), 7)
+        self.assertEqual(rollup_day(next_day), 4)
+        hours, counters = self.rollups()
+        self.assertEqual(hours, [
+            (day, 9, exams, 2, 1, 1, 1, 0, 600, 300),
+            (day, 10, None, 1, 1, 0, 0, 0, 3300, 0),
+            (day, 11, None, 0, 0, 1, 0, 0, 0, 600),
+            (day, 23, exams, 1, 0, 0, 0, 0, 0, 0),
+            (next_day, 0, exams, 0, 1, 1, 0, 0, 900, 300),
+            (next_day, 14, exams, 1, 1, 1, 0, 0, 30, 1200),
+        ])
+        self.assertEqual(counters, [
+            (day, 9, self.desk.pk, 1, 300),
+            (day, 10, self.window.pk, 0, 300),
+            (day, 11, self.window.pk, 1, 300),
+            (next_day, 0, self.desk.pk, 1, 300),
+            (next_day, 14, self.desk.pk, 1, 1200),
+        ])
+
+    def test_refresh_reports_is_idempotent(self):
+        out = io.StringIO()
+        call_command('refresh_reports', '--from', '2024-03-04', '--to', '2024-03-05', stdout=out)
+        self.assertIn('Refreshed 2 days', out.getvalue())
+        first = self.rollups()
+        call_command('refresh_reports', '--from', '2024-03-04', '--to', '2024-03-05', stdout=io.StringIO())
+        self.assertEqual(self.rollups(), first)
+        self.assertEqual(HourlyRollup.objects.count(), 6)
+
+    def test_report_totals(self):
+        call_command('refresh_reports', '--from', '2024-03-04', '--to', '2024-03-05', stdout=io.StringIO())
+        figures = report(self.first_day, self.last_day)
+        self.assertEqual(
+            [figures[field] for field in ('issued', 'called', 'served', 'abandoned', 'timed_out')], [5, 4, 4, 1, 0]
+        )
+        self.assertEqual(figures['wait_seconds'], 4830)
+        self.assertAlmostEqual(figures['wait']['mean'], 4830 / 4 / 60)
+        self.assertAlmostEqual(figures['service']['mean'], 2400 / 4 / 60)
+        self.assertEqual(figures['abandonment_rate'], 1 / 5)
+        self.assertEqual([(row['day'], row['issued']) for row in figures['days']], [(self.first_day, 4), (self.last_day, 1)])
+        desk, window = figures['counters']
+        self.assertEqual((desk['counter'], desk['served'], desk['busy_seconds']), ('Desk', 3, 1800))
+        self.assertAlmostEqual(desk['utilisation'], 1800 / (6 * 3600))  # six hours saw activity
+        self.assertEqual((window['counter'], window['served']), ('Window', 1))
+
+        general = report(self.first_day, self.last_day, 0)
+        self.assertEqual((general['issued'], general['served']), (1, 1))
+        self.assertEqual([row['category'] for row in general['categories']], ['General'])
+        self.assertEqual(report(self.first_day, self.last_day, self.exams.pk)['issued'], 4)
+
+    def test_reports_page_selects_the_general_queue(self):
+        call_command('refresh_reports', '--from', '2024-03-04', '--to', '2024-03-05', stdout=io.StringIO())
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        url = '/admin-dashboard/reports/?first_day=2024-03-04&last_day=2024-03-05'
+        response = self.client.get(url + '&category=0')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['report']['issued'], 1)
+        self.assertEqual(response.context['category_name'], 'General queue')
+        self.assertContains(response, '<option value="0" selected>General queue</option>', html=True)
+
+        response = self.client.get(f'{url}&category={self.exams.pk}')
+        self.assertEqual(response.context['report']['issued'], 4)
+        self.assertEqual(self.client.get(url).context['report']['issued'], 5)
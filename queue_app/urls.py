@@ -1,13 +1,22 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 urlpatterns = [
     path('', views.home, name='home'),
     path('generate-token/', views.generate_token, name='generate_token'),
     path('status/<int:token_number>/', views.queue_status, name='queue_status'),
+    path('status/<int:token_number>/stream/', views.queue_status_stream, name='queue_status_stream'),
     path('admin-dashboard/', views.admin_dashboard, name='admin_dashboard'),
+    path('admin-dashboard/metrics/', views.metrics, name='metrics'),
+    path('admin-dashboard/reports/', views.reports, name='reports'),
     path('serve-next/', views.serve_next, name='serve_next'),
     path('reset-queue/', views.reset_queue, name='reset_queue'),
     path('create-counter/', views.create_counter, name='create_counter'),
     path('mark-served/<int:token_number>/', views.mark_served, name='mark_served'),
+    path('api/v1/tokens/', api.issue_tokens, name='api_issue_tokens'),
+    path('api/v1/tokens/import/', api.import_tokens, name='api_import_tokens'),
+    path('api/v1/tokens/<int:token_number>/', api.token_status, name='api_token_status'),
+    path('api/v1/tokens/<int:token_number>/complete/', api.complete_token, name='api_complete_token'),
+    path('api/v1/queue/', api.queue_snapshot, name='api_queue_snapshot'),
+    path('api/v1/counters/<int:counter_id>/serve-next/', api.counter_serve_next, name='api_counter_serve_next'),
 ]
@@ -1,15 +1,33 @@
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib.auth.decorators import user_passes_test
+from django.contrib.auth.views import redirect_to_login
+from django.views.decorators.http import etag
 from django.utils import timezone
 from datetime import timedelta
-from django.db import connection
+from django.core.management.color import no_style
+from django.db import connection, transaction
 from django.conf import settings
-from twilio.rest import Client
+import json
 import logging
+import time
 
-from .models import Token, ServiceCounter
-from .forms import TokenForm, CounterForm
+from .models import Token, ServiceCounter, Broadcast, QueueChange
+from .forms import TokenForm, CounterForm, ReportForm
+from .sms import aenqueue_sms
+from .notifications import (
+    all_busy_message, broadcast_to_waiting, confirmation_message,
+    notify_counter_assigned, notify_token_completed,
+)
+from .queue_state import queue_index
+from .snapshot import aqueue_snapshot, invalidate_queue_snapshot, queue_snapshot, snapshot_version
+from .estimator import estimate_wait, service_estimator
+from .assignment import assign_tokens
+from .dashboard import dashboard_version, invalidate_dashboard
+from .metrics import registry
+from .reporting import report
 
 logger = logging.getLogger(__name__)
 
@@ -17,30 +35,25 @@ def home(request):
     form = TokenForm()
     return render(request, 'index.html', {'form': form})
 
-def generate_token(request):
+async def generate_token(request):
     if request.method == 'POST':
         form = TokenForm(request.POST)
-        if form.is_valid():
+        # Validation checks the chosen category against the database
+        if await sync_to_async(form.is_valid)():
             customer_name = form.cleaned_data['customer_name']
             phone_number = form.cleaned_data.get('phone_number')
-            token = Token.objects.create(customer_name=customer_name, phone_number=phone_number)
+            token = await Token.objects.acreate(
+                customer_name=customer_name,
+                phone_number=phone_number,
+                category=form.cleaned_data.get('category'),
+            )
             # Calculate estimated wait and send a friendly initial SMS
-            tokens_ahead = Token.objects.filter(is_served=False, token_number__lt=token.token_number).count()
-            per_token = getattr(settings, 'PER_TOKEN_MINUTES', 2)
-            # Minimum wait for a newly created token should be one slot * per_token
-            est_wait = (tokens_ahead + 1) * per_token  # minutes per token estimate
-            try:
-                init_msg = (
-                    f"Hi {customer_name}, your token #{token.token_number} is confirmed. "
-#                    f"Counters will be allotted soon. Estimated wait: {est_wait} minutes. "
-                    f"You will receive an update when a counter is assigned."
-                    f"Track your status at /status/{token.token_number}/"
-                )
-                send_sms(phone_number, init_msg)
-            except Exception:
-                # don't block token creation if SMS fails
-                pass
-            return render(request, 'token.html', {
+            await _arefresh()
+            tokens_ahead = queue_index.tokens_ahead(token.token_number)
+            est_wait = estimate_wait(tokens_ahead)
+            # Queued for the dispatch_sms worker so Twilio latency never blocks the kiosk
+            await aenqueue_sms(phone_number, confirmation_message(token.token_number, customer_name))
+            return await _arender(request, 'token.html', {
                 'token': token,
                 'tokens_ahead': tokens_ahead,
                 'est_wait': est_wait,
@@ -48,81 +61,220 @@ def generate_token(request):
     return redirect('home')
 
 
-def send_sms(phone_number, message):
-    """Send SMS using Twilio"""
-    if not phone_number or not settings.SMS_ENABLED:
-        return False
+async def _arefresh():
+    """Run any due index/estimator reload in a thread; the reads that follow stay in memory.
 
-    # Format Indian numbers automatically (optional)
-    if phone_number.isdigit() and len(phone_number) == 10:
-        phone_number = '+91' + phone_number
+    The status and issue views are async so a process under ASGI can hold
+    thousands of waiting customers without a thread each. Under WSGI they
+    still work, run through async_to_sync.
+    """
+    await queue_index.arefresh()
+    await service_estimator.arefresh()
 
-    try:
-        client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
-        # Prefer messaging service SID if configured, otherwise use a Twilio phone number
-        msg_kwargs = {
-            'body': message,
-            'to': phone_number,
-        }
-        if getattr(settings, 'TWILIO_MESSAGING_SERVICE_SID', ''):
-            msg_kwargs['messaging_service_sid'] = settings.TWILIO_MESSAGING_SERVICE_SID
-        else:
-            msg_kwargs['from_'] = settings.TWILIO_PHONE_NUMBER
-
-        client.messages.create(**msg_kwargs)
-        print(f"SMS sent to {phone_number}")  # Debug
-        return True
-    except Exception as e:
-        logger.error(f"SMS sending failed: {e}")
-        print(f"SMS failed: {e}")  # Debug
-        return False
-
-def queue_status(request, token_number):
-    token = get_object_or_404(Token, token_number=token_number)
-    current_serving = Token.objects.filter(is_served=False).order_by('token_number').first()
-    tokens_ahead = Token.objects.filter(is_served=False, token_number__lt=token.token_number).count()
-    per_token = getattr(settings, 'PER_TOKEN_MINUTES', 2)
-    est_wait = (tokens_ahead + 1) * per_token
+
+async def _arender(request, template_name, context):
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        # Anonymous: the user and messages come from nothing but cookies, so nothing queries
+        return render(request, template_name, context)
+    # base.html reads the session user and messages, which query the database
+    return await sync_to_async(render)(request, template_name, context)
+
+
+def _is_ajax(request):
     # Support both modern header check and Django's is_ajax fallback
-    is_ajax = request.headers.get('x-requested-with') == 'XMLHttpRequest' or getattr(request, 'is_ajax', lambda: False)()
-    if is_ajax:
-        return JsonResponse({
-            'current_serving': current_serving.token_number if current_serving else None,
-            'tokens_ahead': tokens_ahead,
-            'est_wait': est_wait,
-        })
-
-    return render(request, 'queue_status.html', {
-        'token': token,
+    return request.headers.get('x-requested-with') == 'XMLHttpRequest' or getattr(request, 'is_ajax', lambda: False)()
+
+
+def status_snapshot(token_number, snapshot=None):
+    """Queue figures for token_number within its own category's queue, read from the shared queue snapshot"""
+    current_serving, tokens_ahead, unserved = (snapshot or queue_snapshot()).position(token_number)
+    return {
         'current_serving': current_serving,
         'tokens_ahead': tokens_ahead,
-        'est_wait': est_wait,
+        'est_wait': estimate_wait(tokens_ahead),
+        'is_served': not unserved,
+    }
+
+
+def _status_etag(request, token_number):
+    # The snapshot version is shared by every worker, so a poll is answered
+    # with a 304 whichever worker it lands on, before any other work
+    kind = 'json' if _is_ajax(request) else 'html'
+    return f"{snapshot_version()}-{token_number}-{kind}"
+
+
+@etag(_status_etag)
+async def queue_status(request, token_number):
+    # Everything comes from the shared snapshot; only a rebuild after a change queries
+    snapshot = await aqueue_snapshot()
+    if not snapshot.exists(token_number):
+        raise Http404('Unknown token')
+    await service_estimator.arefresh()
+    status = status_snapshot(token_number, snapshot)
+    if _is_ajax(request):
+        return JsonResponse(status)
+
+    return await _arender(request, 'queue_status.html', {
+        'token': {'token_number': token_number, 'is_served': status['is_served']},
+        'current_serving': status['current_serving'],
+        'tokens_ahead': status['tokens_ahead'],
+        'est_wait': status['est_wait'],
     })
 
+
+def _status_event(token_number, snapshot, last):
+    """(SSE event or None when nothing changed, status)"""
+    status = status_snapshot(token_number, snapshot)
+    if status == last:
+        return None, last
+    return f"id: {snapshot.version}\nevent: status\ndata: {json.dumps(status)}\n\n", status
+
+
+def _status_events(token_number):
+    """Yield an SSE event each time this token's status changes.
+
+    Wakes on changes made in this process at once, and on changes from
+    other processes once the queue index syncs them (QUEUE_SYNC_INTERVAL).
+    """
+    heartbeat = settings.STATUS_STREAM_HEARTBEAT
+    deadline = time.monotonic() + settings.STATUS_STREAM_MAX_AGE
+    version, last = None, None
+    # Bounded lifetime so connections get recycled; EventSource reconnects on its own
+    while time.monotonic() < deadline:
+        new_version = queue_index.wait_for_change(version, timeout=heartbeat)
+        timed_out, version = new_version == version, new_version
+        event, last = _status_event(token_number, queue_snapshot(), last)
+        if event is None:
+            if timed_out:
+                yield ': keepalive\n\n'
+            continue
+        yield event
+        if last['is_served']:
+            return
+
+
+async def _astatus_events(token_number):
+    """_status_events() as an async generator: a waiting stream holds no thread"""
+    heartbeat = settings.STATUS_STREAM_HEARTBEAT
+    deadline = time.monotonic() + settings.STATUS_STREAM_MAX_AGE
+    version, last = None, None
+    while time.monotonic() < deadline:
+        new_version = await queue_index.await_change(version, timeout=heartbeat)
+        timed_out, version = new_version == version, new_version
+        await service_estimator.arefresh()
+        event, last = _status_event(token_number, await aqueue_snapshot(), last)
+        if event is None:
+            if timed_out:
+                yield ': keepalive\n\n'
+            continue
+        yield event
+        if last['is_served']:
+            return
+
+
+async def queue_status_stream(request, token_number):
+    """Server-Sent Events feed that pushes queue changes for one token"""
+    if not (await aqueue_snapshot()).exists(token_number):
+        raise Http404('Unknown token')
+    # WSGI servers can only buffer an async iterator, so they get the blocking generator
+    if isinstance(request, ASGIRequest):
+        events = _astatus_events(token_number)
+    else:
+        events = _status_events(token_number)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # stop nginx from buffering the stream
+    return response
+
 def admin_check(user):
     return user.is_staff or user.is_superuser
 
 @user_passes_test(admin_check)
 def admin_dashboard(request):
-    active_tokens = Token.objects.filter(is_served=False).order_by('token_number')
-    served_tokens = Token.objects.filter(is_served=True).order_by('-issued_at')[:20]
-    counters = ServiceCounter.objects.all()
+    # Querysets stay lazy: they only hit the database when their template
+    # fragment is not already cached for the current dashboard version
+    try:
+        after = max(int(request.GET.get('after', 0)), 0)
+    except ValueError:
+        after = 0
+    page_size = settings.DASHBOARD_PAGE_SIZE
+    token_fields = (
+        'token_number', 'customer_name', 'issued_at', 'is_served', 'priority', 'appointment_at',
+        'counter__name', 'category__name',
+    )
+    active_tokens = Token.objects.filter(
+        is_served=False, token_number__gt=after
+    ).select_related('counter', 'category').only(*token_fields).order_by('token_number')[:page_size]
+    served_tokens = Token.objects.filter(is_served=True).select_related('counter', 'category').only(
+        *token_fields
+    ).order_by('-issued_at')[:20]
+    counters = ServiceCounter.objects.only('id', 'name', 'is_available').prefetch_related('categories')
     counter_form = CounterForm()
+    last_broadcast = Broadcast.objects.order_by('-created_at').first()
+
+    # Window over the active queue, sized from the in-memory queue index
+    window = queue_index.unserved_after(after, page_size + 1)
     return render(request, 'admin_dashboard.html', {
         'active_tokens': active_tokens,
         'served_tokens': served_tokens,
         'counters': counters,
         'counter_form': counter_form,
+        'dashboard_version': dashboard_version(),
+        'cache_timeout': settings.DASHBOARD_CACHE_TIMEOUT,
+        'after': after,
+        'active_total': queue_index.unserved_count(),
+        'next_after': window[page_size - 1] if len(window) > page_size else None,
+        'last_broadcast': last_broadcast,
+        'broadcast_progress': last_broadcast.progress() if last_broadcast else None,
     })
 
 
+@user_passes_test(admin_check)
+def reports(request):
+    # Built from the hourly rollups only; the token tables are never read here
+    form = ReportForm(request.GET or None)
+    last_day = timezone.localdate()
+    first_day, category = None, None
+    if form.is_valid():
+        first_day = form.cleaned_data['first_day']
+        last_day = form.cleaned_data['last_day'] or max(last_day, first_day or last_day)
+        category = form.cleaned_data['category']
+    first_day = first_day or last_day - timedelta(days=6)
+    figures = report(first_day, last_day, category)
+    return render(request, 'reports.html', {
+        'form': form,
+        'report': figures,
+        'category_name': None if category is None else dict(form.fields['category'].choices).get(category),
+        'summaries': [('Wait', figures['wait']), ('Service', figures['service'])],
+        'breakdowns': [
+            ('By Hour of Day', 'Hour', [
+                (f"{row['hour']:02d}:00", row) for row in figures['hours'] if row['issued'] or row['served']
+            ]),
+            ('By Day', 'Day', [(row['day'].isoformat(), row) for row in figures['days']]),
+            ('By Service', 'Service', [(row['category'], row) for row in figures['categories']]),
+        ],
+    })
+
+
+def metrics(request):
+    """Prometheus metrics for this process (staff, or a scraper holding METRICS_TOKEN)"""
+    token = settings.METRICS_TOKEN
+    authorized = admin_check(request.user) or (
+        token and request.headers.get('Authorization') == f'Bearer {token}'
+    )
+    if not authorized:
+        return redirect_to_login(request.get_full_path())
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @user_passes_test(admin_check)
 def create_counter(request):
     if request.method == 'POST':
         form = CounterForm(request.POST)
         if form.is_valid():
             name = form.cleaned_data['name']
-            ServiceCounter.objects.create(name=name, is_available=True)
+            counter = ServiceCounter.objects.create(name=name, is_available=True)
+            counter.categories.set(form.cleaned_data['categories'])
     return redirect('admin_dashboard')
 
 '''@user_passes_test(admin_check)
@@ -170,15 +322,8 @@ def serve_next(request):
         # ✅ Step 1: Check if any counters are available
         available_counters = ServiceCounter.objects.filter(is_available=True)
         if not available_counters.exists():
-            # No free counters — notify waiting users
-            waiting_tokens = Token.objects.filter(is_served=False, started_serving__isnull=True)
-            for t in waiting_tokens:
-                if t.phone_number:
-                    send_sms(
-                        t.phone_number,
-                        f"Dear {t.customer_name}, all counters are currently busy. "
-                        f"You’ll be notified once a counter is free."
-                    )
+            # No free counters — notify waiting users (deduplicated, sent in the background)
+            broadcast_to_waiting(Broadcast.KIND_ALL_BUSY, all_busy_message)
             # Return without trying to allocate
             return redirect('admin_dashboard')
 
@@ -188,22 +333,10 @@ def serve_next(request):
             if not counter.is_available:
                 return redirect('admin_dashboard')
 
-            next_token = Token.get_next_servable()
-            if next_token and next_token.start_serving(counter):
-                # Calculate estimated wait for clarity
-                tokens_ahead = Token.objects.filter(is_served=False, token_number__lt=next_token.token_number).count()
-                per_token = getattr(settings, 'PER_TOKEN_MINUTES', 2)
-                est_wait = (tokens_ahead + 1) * per_token
-
+            assigned = assign_tokens(counter_ids=[counter.id])
+            if assigned:
                 # ✅ Step 3: Send SMS about counter assignment
-                if next_token.phone_number:
-                    start_time = timezone.localtime(timezone.now()).strftime('%H:%M')
-                    message = (
-                        f"Hi {next_token.customer_name}, your token #{next_token.token_number} "
-                        f"is now being served at counter {counter.name}. "
-                        f"Estimated service start time: {start_time}. Please proceed soon."
-                    )
-                    send_sms(next_token.phone_number, message)
+                notify_counter_assigned(*assigned[0])
 
         except (ServiceCounter.DoesNotExist, ValueError) as e:
             logger.error(f"Serve next error: {e}")
@@ -217,30 +350,8 @@ def mark_served(request, token_number):
     token = get_object_or_404(Token, token_number=token_number)
     if request.method == 'POST':
         token.complete_serving()  # This handles counter availability too
-        
-        # Notify next in line if within threshold
-        next_possible = Token.get_next_servable()
-        if next_possible and next_possible.phone_number:
-            # Estimate wait time for the next_possible token and attach expected time
-            tokens_ahead_np = Token.objects.filter(is_served=False, token_number__lt=next_possible.token_number).count()
-            per_token = getattr(settings, 'PER_TOKEN_MINUTES', 2)
-            est_wait_np = (tokens_ahead_np + 1) * per_token
-            expected_time = (timezone.localtime(timezone.now()) + timedelta(minutes=est_wait_np)).strftime('%H:%M')
-            message = (
-                f"Update for token #{next_possible.token_number}: a counter will be allotted soon. "
-                f"Estimated wait: {est_wait_np} minutes (approx at {expected_time}). Please be ready to proceed to the waiting area."
-            )
-            send_sms(next_possible.phone_number, message)
-
-        # Notify the token owner that their order has been served/collected
-        if token.phone_number:
-            completed_time = timezone.localtime(token.completed_serving or timezone.now()).strftime('%H:%M')
-            collected_msg = (
-                f"Your token #{token.token_number} has been served and collected at {completed_time}. "
-                f"Thank you for visiting!"
-            )
-            send_sms(token.phone_number, collected_msg)
-            
+        notify_token_completed(token)
+
     return redirect('admin_dashboard')
 
 
@@ -248,15 +359,21 @@ def mark_served(request, token_number):
 def reset_queue(request):
     """Admin-only: clear all tokens (for testing / reset)"""
     if request.method == 'POST':
-        Token.objects.all().delete()
-        # mark all counters available
-        ServiceCounter.objects.update(is_available=True)
-        # Reset SQLite autoincrement sequence so token numbers start back at 1
-        try:
-            if connection.vendor == 'sqlite':
-                with connection.cursor() as cursor:
-                    cursor.execute("DELETE FROM sqlite_sequence WHERE name='queue_app_token';")
-        except Exception:
-            # Non-fatal; leave as-is for other DB backends
-            pass
+        with transaction.atomic():
+            Token.objects.all().delete()
+            QueueChange.record([None])  # other processes clear their index too
+            # mark all counters available
+            ServiceCounter.objects.update(is_available=True)
+            # Restart token numbering at 1 using the backend's own sequence reset
+            # (sqlite_sequence on SQLite, setval() on PostgreSQL)
+            sequence_sql = connection.ops.sequence_reset_by_name_sql(
+                no_style(), [{'table': Token._meta.db_table, 'column': Token._meta.pk.column}]
+            )
+            with connection.cursor() as cursor:
+                for sql in sequence_sql:
+                    cursor.execute(sql)
+        invalidate_queue_snapshot()
+        queue_index.clear()
+        service_estimator.reload_counters()
+        invalidate_dashboard()
     return redirect('admin_dashboard')
\ No newline at end of file
@@ -0,0 +1,104 @@
+import logging
+import select
+import socket
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_local_wakeup = threading.Event()
+_sender = None
+
+
+def _address():
+    return (settings.ASSIGNER_WAKEUP_HOST, settings.ASSIGNER_WAKEUP_PORT)
+
+
+def notify_assigner():
+    """Ask the auto assigner to run a pass now instead of at its next tick.
+
+    Sends a single UDP datagram to the local assigner; delivery is best
+    effort and never blocks or raises, the assigner's timer covers anything
+    that gets lost.
+    """
+    global _sender
+    _local_wakeup.set()
+    if not settings.ASSIGNER_WAKEUP_PORT:
+        return
+    try:
+        if _sender is None:
+            _sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            _sender.setblocking(False)
+        _sender.sendto(b'1', _address())
+    except OSError as e:
+        logger.debug(f"Assigner wakeup not delivered: {e}")
+
+
+class AssignerWakeup:
+    """Receiving end of notify_assigner(), used by auto_assign_tokens.
+
+    Only the leading assigner holds the port: it calls open() while it
+    leads and close() when it steps down, so a standby on the same host
+    never takes the wakeups meant for the leader.
+    """
+
+    def __init__(self):
+        self.sock = None
+        self._unavailable = False  # warned that the port is taken; retried quietly until it frees up
+
+    def open(self):
+        """Bind the wakeup port unless already bound; False if it is disabled or held by another process"""
+        if self.sock is not None:
+            return True
+        if not settings.ASSIGNER_WAKEUP_PORT:
+            return False
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.bind(_address())
+        except OSError as e:
+            sock.close()
+            if not self._unavailable:
+                logger.warning(f"Assigner wakeup channel unavailable, polling until it frees up: {e}")
+                self._unavailable = True
+            return False
+        sock.setblocking(False)
+        self.sock = sock
+        self._unavailable = False
+        return True
+
+    def wait(self, timeout):
+        """Block until a wakeup arrives or `timeout` seconds pass.
+
+        Returns True when woken by a notification. Any further notifications
+        queued up meanwhile are drained, so a burst of events triggers a
+        single assignment pass.
+        """
+        if _local_wakeup.is_set():
+            _local_wakeup.clear()
+            self._drain()
+            return True
+        if self.sock is None:
+            woken = _local_wakeup.wait(timeout)
+            _local_wakeup.clear()
+            return woken
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        _local_wakeup.clear()
+        if readable:
+            self._drain()
+            return True
+        return False
+
+    def _drain(self):
+        if self.sock is None:
+            return
+        while True:
+            try:
+                self.sock.recv(64)
+            except OSError:  # BlockingIOError once the socket is empty
+                return
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
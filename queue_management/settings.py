@@ -23,6 +23,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'queue_app.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -51,12 +52,61 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'queue_management.wsgi.application'
+ASGI_APPLICATION = 'queue_management.asgi.application'
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Database - SQLite for small installs, PostgreSQL for production (DB_ENGINE=postgres)
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'queue_management'),
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),  # Keep connections open between requests
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    if os.environ.get('DB_POOL', 'False').lower() == 'true':
+        # Native connection pool; needs psycopg 3 with the pool extra instead of psycopg2
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 20)),
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                # WAL lets readers run alongside the writer; IMMEDIATE takes the write
+                # lock up front so concurrent writers wait on the busy timeout
+                # instead of failing with "database is locked"
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 20)),  # Seconds to wait for a lock
+            },
+            # A file rather than the in-memory default, so tests running workers side by
+            # side wait on the busy timeout like production instead of failing
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
     }
+
+# Caches - the queue snapshot behind the status pages lives in its own cache.
+# LocMemCache is per process; with several workers point it at a backend they
+# share, e.g. FileBasedCache on /dev/shm, so every worker serves the same version
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'queue_snapshot': {
+        'BACKEND': os.environ.get('QUEUE_SNAPSHOT_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('QUEUE_SNAPSHOT_CACHE_LOCATION', 'queue-snapshot'),
+    },
 }
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -84,16 +134,27 @@ STATICFILES_DIRS = [BASE_DIR / 'queue_app' / 'static']
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Logging configuration
+# Handlers write from a background thread (queue_app.logs.BackgroundHandler),
+# so logging never blocks a request or the SMS dispatcher on I/O
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {
+            '()': 'queue_app.logs.StructuredFormatter',
+        },
+    },
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
+            '()': 'queue_app.logs.BackgroundHandler',
+            'target': 'logging.StreamHandler',
         },
         'file': {
-            'class': 'logging.FileHandler',
-            'filename': 'sms_debug.log',
+            '()': 'queue_app.logs.BackgroundHandler',
+            'target': 'logging.FileHandler',
+            'filename': os.environ.get('SMS_LOG_FILE', 'sms_debug.log'),
+            'delay': True,
+            'formatter': 'structured',
         },
     },
     'loggers': {
@@ -101,17 +162,70 @@ LOGGING = {
             'handlers': ['console', 'file'],
             'level': 'DEBUG',
         },
+        'queue_app.sms': {
+            'handlers': ['console', 'file'],
+            'level': os.environ.get('SMS_LOG_LEVEL', 'DEBUG'),
+        },
     },
 }
 
 # Queue settings
 FAIRNESS_THRESHOLD = int(os.environ.get('FAIRNESS_THRESHOLD', 3))  # Max tokens ahead allowed
-AUTO_ASSIGN_INTERVAL = int(os.environ.get('AUTO_ASSIGN_INTERVAL', 5))  # Seconds between auto-assignment checks
+AUTO_ASSIGN_INTERVAL = int(os.environ.get('AUTO_ASSIGN_INTERVAL', 5))  # Fallback seconds between auto-assignment checks
+ASSIGNER_WAKEUP_HOST = os.environ.get('ASSIGNER_WAKEUP_HOST', '127.0.0.1')  # Where auto_assign_tokens listens for wakeups
+ASSIGNER_WAKEUP_PORT = int(os.environ.get('ASSIGNER_WAKEUP_PORT', 8765))  # UDP port for wakeups, 0 disables them
+ASSIGNER_LEASE_TTL = int(os.environ.get('ASSIGNER_LEASE_TTL', 10))  # Seconds without a heartbeat before a standby assigner takes over
+ASSIGNER_HEARTBEAT = int(os.environ.get('ASSIGNER_HEARTBEAT', 3))  # Seconds between lease renewals by the leader and takeover attempts by standbys
 MAX_SERVING_TIME = int(os.environ.get('MAX_SERVING_TIME', 600))  # Maximum time (in seconds) a token can be served before auto-completion
+QUEUE_STATE_CHECK_INTERVAL = int(os.environ.get('QUEUE_STATE_CHECK_INTERVAL', 30))  # Seconds between in-memory queue index consistency checks
+QUEUE_SYNC_INTERVAL = int(os.environ.get('QUEUE_SYNC_INTERVAL', 1))  # Seconds between polls for queue changes made by other processes, 0 disables them
+QUEUE_CHANGE_RETENTION = int(os.environ.get('QUEUE_CHANGE_RETENTION', 3600))  # Seconds the queue change log is kept before the assigner prunes it
+STATUS_STREAM_HEARTBEAT = int(os.environ.get('STATUS_STREAM_HEARTBEAT', 15))  # Seconds between keepalives on the status stream
+STATUS_STREAM_MAX_AGE = int(os.environ.get('STATUS_STREAM_MAX_AGE', 300))  # Seconds before a status stream is closed and the browser reconnects
+ESTIMATOR_ALPHA = float(os.environ.get('ESTIMATOR_ALPHA', 0.2))  # Weight of the newest service time in the rolling averages
+ESTIMATOR_MIN_SAMPLES = int(os.environ.get('ESTIMATOR_MIN_SAMPLES', 5))  # Samples before the overall, a counter's or an hour's average is trusted
+ESTIMATOR_WARMUP_SAMPLES = int(os.environ.get('ESTIMATOR_WARMUP_SAMPLES', 500))  # Recent services replayed on startup
+ESTIMATOR_REFRESH_INTERVAL = int(os.environ.get('ESTIMATOR_REFRESH_INTERVAL', 600))  # Seconds between replays (picks up other processes)
+ESTIMATOR_ACTIVE_WINDOW = int(os.environ.get('ESTIMATOR_ACTIVE_WINDOW', 1800))  # Seconds a free counter still counts as open after its last service
+PER_TOKEN_MINUTES = int(os.environ.get('PER_TOKEN_MINUTES', 2))  # Fallback wait per token before any service history exists
+DASHBOARD_PAGE_SIZE = int(os.environ.get('DASHBOARD_PAGE_SIZE', 50))  # Active tokens shown per dashboard page
+PRIORITY_HEAD_START = int(os.environ.get('PRIORITY_HEAD_START', 600))  # Seconds of queue time a priority token is credited per priority level
+APPOINTMENT_HEAD_START = int(os.environ.get('APPOINTMENT_HEAD_START', 300))  # Appointments join the queue this many seconds before their slot
+ARCHIVE_AFTER = int(os.environ.get('ARCHIVE_AFTER', 86400))  # Seconds after completion before archive_tokens moves a served token
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 1000))  # Tokens moved per archive transaction
+QUEUE_API_KEYS = [key for key in os.environ.get('QUEUE_API_KEYS', '').split(',') if key]  # Keys accepted in X-API-Key for counter actions
+API_MAX_BATCH = int(os.environ.get('API_MAX_BATCH', 50))  # Most tokens issued (or listed) by one API request
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 1000))  # Tokens inserted per bulk import transaction
+IMPORT_MAX_ROWS = int(os.environ.get('IMPORT_MAX_ROWS', 100000))  # Most tokens one upload to the import endpoint may issue
+DASHBOARD_CACHE_TIMEOUT = int(os.environ.get('DASHBOARD_CACHE_TIMEOUT', 10))  # Seconds a rendered dashboard fragment may be reused
+QUEUE_SNAPSHOT_TIMEOUT = int(os.environ.get('QUEUE_SNAPSHOT_TIMEOUT', 300))  # Seconds a built queue snapshot is kept in the snapshot cache
+REPORTING_REFRESH_DAYS = int(os.environ.get('REPORTING_REFRESH_DAYS', 2))  # Recent days whose report rollups refresh_reports rebuilds each run
+REPORTING_REFRESH_INTERVAL = int(os.environ.get('REPORTING_REFRESH_INTERVAL', 300))  # Seconds between refresh_reports runs in the background
 
 # SMS settings - Twilio Configuration
 SMS_ENABLED = os.environ.get('SMS_ENABLED', 'False') == 'True'
 TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID', '')
 TWILIO_MESSAGING_SERVICE_SID = os.environ.get('TWILIO_MESSAGING_SERVICE_SID', '')
 TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN', '')  # Set this in environment for security
-TWILIO_PHONE_NUMBER = os.environ.get('TWILIO_PHONE_NUMBER', '')  # Optional fallback
\ No newline at end of file
+TWILIO_PHONE_NUMBER = os.environ.get('TWILIO_PHONE_NUMBER', '')  # Optional fallback
+
+# SMS outbox - messages are queued by the views and sent by `manage.py dispatch_sms`
+SMS_BACKEND = os.environ.get('SMS_BACKEND', 'queue_app.sms.TwilioBackend')  # Use queue_app.sms.FakeBackend to send nothing
+SMS_DISPATCH_BATCH_SIZE = int(os.environ.get('SMS_DISPATCH_BATCH_SIZE', 50))  # Messages claimed per dispatcher pass
+SMS_DISPATCH_WORKERS = int(os.environ.get('SMS_DISPATCH_WORKERS', 8))  # Threads sending a batch in parallel
+SMS_DISPATCH_INTERVAL = int(os.environ.get('SMS_DISPATCH_INTERVAL', 2))  # Seconds to wait when the outbox is empty
+SMS_MAX_ATTEMPTS = int(os.environ.get('SMS_MAX_ATTEMPTS', 5))  # Give up on a message after this many failures
+SMS_RETRY_BACKOFF = int(os.environ.get('SMS_RETRY_BACKOFF', 30))  # Base retry delay in seconds, doubled per attempt
+SMS_CLAIM_TIMEOUT = int(os.environ.get('SMS_CLAIM_TIMEOUT', 300))  # Seconds before a claimed but unfinished message is retried
+SMS_HTTP_POOL_SIZE = int(os.environ.get('SMS_HTTP_POOL_SIZE', SMS_DISPATCH_WORKERS))  # Keep-alive connections to the SMS provider, 0 opens one per message
+SMS_HTTP_TIMEOUT = float(os.environ.get('SMS_HTTP_TIMEOUT', 10))  # Seconds before a provider request is abandoned (and retried later)
+TWILIO_API_BASE_URL = os.environ.get('TWILIO_API_BASE_URL', '')  # Send to another Twilio-compatible endpoint, e.g. python manage.py fake_sms_gateway
+BROADCAST_DEDUP_WINDOW = int(os.environ.get('BROADCAST_DEDUP_WINDOW', 900))  # Seconds before a token gets the same broadcast again
+BROADCAST_MIN_INTERVAL = int(os.environ.get('BROADCAST_MIN_INTERVAL', 120))  # Minimum seconds between any two broadcasts to one token
+
+# Metrics - Prometheus text format at /admin-dashboard/metrics/ (per process)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() == 'true'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')  # Optional bearer token so a scraper can read metrics without a staff login
+METRICS_PROFILE_SAMPLE_RATE = float(os.environ.get('METRICS_PROFILE_SAMPLE_RATE', 0))  # Fraction of requests to profile, 0 disables
+METRICS_PROFILE_KEEP = int(os.environ.get('METRICS_PROFILE_KEEP', 10))  # Slowest profiled requests kept on disk
+METRICS_PROFILE_DIR = os.environ.get('METRICS_PROFILE_DIR', str(BASE_DIR / 'profiles'))